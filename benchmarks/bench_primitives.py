@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+"""
+microbenchmarks for procszoo primitives. E.g.,
+
+    benchmarks/bench_primitives.py --save-baseline baseline.json
+    ... upgrade procszoo ...
+    benchmarks/bench_primitives.py --baseline baseline.json
+
+Results are written as JSON by --output, the summary goes to stdout.
+Every sample is measured in a forked child, so namespaces and mounts of
+the benchmark process itself never change.
+"""
+import os
+import sys
+import time
+import json
+import pickle
+import signal
+import argparse
+import tempfile
+import subprocess
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.mounts import *
+from procszoo.utils import *
+
+_FORMAT_VERSION = 1
+_DEFAULT_REPEAT = 20
+_DEFAULT_THRESHOLD = 0.2
+
+
+def timer():
+    if hasattr(time, "perf_counter"):
+        return time.perf_counter()
+    return time.time()
+
+
+def run_in_child(func, *args):
+    """
+    run func in a forked child, func returns the seconds it measured.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        code = 0
+        try:
+            result = func(*args)
+        except Exception as e:
+            result = "%s: %s" % (e.__class__.__name__, e)
+            code = 1
+        fo = os.fdopen(w, "wb")
+        pickle.dump(result, fo)
+        fo.close()
+        os._exit(code)
+
+    os.close(w)
+    fo = os.fdopen(r, "rb")
+    try:
+        result = pickle.load(fo)
+    except EOFError:
+        result = "child died"
+    fo.close()
+    os.waitpid(pid, 0)
+    if not isinstance(result, float):
+        raise RuntimeError(result)
+    return result
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    if n % 2:
+        median = samples[n // 2]
+    else:
+        median = (samples[n // 2 - 1] + samples[n // 2]) / 2.0
+    return {"unit": "s", "samples": n, "min": samples[0],
+            "median": median, "mean": sum(samples) / n, "max": samples[-1]}
+
+
+def private_mount_namespace():
+    namespaces = ["mount"]
+    if os.geteuid() != 0:
+        namespaces = ["user"] + namespaces
+    workbench.unshare(namespaces)
+    workbench.set_propagation("private")
+
+
+def namespace_combinations():
+    available = [ns for ns, status in show_namespaces_status() if status]
+    combos = [[ns] for ns in available]
+    if os.geteuid() != 0 and "user" in available:
+        combos = [["user"] + combo for combo in combos if combo != ["user"]]
+        combos.append(["user"])
+    combos.append(available)
+    return combos
+
+
+def bench_spawn(namespaces):
+    """
+    spawn_namespaces() latency of a sandbox that does nothing.
+    """
+    kwargs = {"namespaces": list(namespaces), "func": lambda: None,
+              "maproot": "user" in namespaces,
+              "mountproc": "pid" in namespaces and "mount" in namespaces}
+    def measure():
+        started = timer()
+        spawn_namespaces(**kwargs)
+        return timer() - started
+    return measure
+
+
+def bench_unshare(namespaces):
+    def measure():
+        started = timer()
+        workbench.unshare(namespaces)
+        return timer() - started
+    return measure
+
+
+def bench_setns(target_pid, namespace):
+    def measure():
+        if os.geteuid() != 0 and namespace != "user":
+            workbench.setns(pid=target_pid, namespace="user")
+        started = timer()
+        workbench.setns(pid=target_pid, namespace=namespace)
+        return timer() - started
+    return measure
+
+
+def bench_mount(op):
+    def measure():
+        private_mount_namespace()
+        target = tempfile.mkdtemp(prefix="procszoo-bench-")
+        try:
+            started = timer()
+            workbench.mount(source="none", target=target,
+                                filesystemtype="tmpfs", mount_type="unchanged")
+            mounted = timer()
+            workbench.umount2(target, "detach")
+            umounted = timer()
+        finally:
+            os.rmdir(target)
+        if op == "mount":
+            return mounted - started
+        return umounted - mounted
+    return measure
+
+
+def bench_mount_plan(plan, use_mount_api):
+    """
+    a bind, a tmpfs and a procfs mount of a mount plan.
+    """
+    def measure():
+        plan.clone_ahead()
+        private_mount_namespace()
+        started = timer()
+        plan.apply(use_mount_api=use_mount_api)
+        return timer() - started
+    return measure
+
+
+def bench_pivot_root(new_root):
+    def measure():
+        private_mount_namespace()
+        workbench.mount(source="none", target=new_root,
+                            filesystemtype="tmpfs", mount_type="unchanged")
+        put_old = os.path.join(new_root, "old-root")
+        os.mkdir(put_old)
+        started = timer()
+        workbench.pivot_root(new_root, put_old)
+        return timer() - started
+    return measure
+
+
+def bench_check_namespaces(cache_dir):
+    def measure():
+        if cache_dir is None:
+            os.environ["PROCSZOO_CACHE_DIR"] = ""
+        else:
+            os.environ["PROCSZOO_CACHE_DIR"] = cache_dir
+        workbench._namespaces_available_status_checked = False
+        started = timer()
+        check_namespaces_available_status()
+        return timer() - started
+    return measure
+
+
+def bench_import():
+    code = ("import time\n"
+            "started = time.time()\n"
+            "import procszoo.c_functions\n"
+            "print(repr(time.time() - started))\n")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([path for path in sys.path if path])
+    output = subprocess.check_output([sys.executable, "-c", code], env=env)
+    return float(output.decode().strip())
+
+
+def benchmarks():
+    """
+    yield (name, measure) tuples, measure() returns seconds.
+    """
+    for combo in namespace_combinations():
+        yield ("spawn_namespaces[%s]" % ",".join(combo),
+               lambda combo=combo: run_in_child(bench_spawn(combo)))
+    for combo in namespace_combinations():
+        yield ("unshare[%s]" % ",".join(combo),
+               lambda combo=combo: run_in_child(bench_unshare(combo)))
+
+    target = None
+    try:
+        target = spawn_sandbox(maproot=user_namespace_available(),
+                                   func=lambda: time.sleep(3600))
+    except (NamespaceSettingError, NamespaceRequireSuperuserPrivilege) as e:
+        warn("cannot spawn the setns target: %s" % e)
+    if target is not None:
+        pid = target.config.bottom_halves_child_pid
+        for ns, status in show_namespaces_status():
+            if status:
+                yield ("setns[%s]" % ns,
+                       lambda ns=ns: run_in_child(bench_setns(pid, ns)))
+        os.kill(pid, signal.SIGKILL)
+        target.wait()
+
+    yield ("mount[tmpfs]", lambda: run_in_child(bench_mount("mount")))
+    yield ("umount2[detach]", lambda: run_in_child(bench_mount("umount2")))
+
+    plan_dir = tempfile.mkdtemp(prefix="procszoo-bench-")
+    plan = MountPlan()
+    for name in ["bind", "tmp", "proc"]:
+        os.mkdir(os.path.join(plan_dir, name))
+    plan.bind("/usr", os.path.join(plan_dir, "bind"), attrs=["ro"])
+    plan.tmpfs(os.path.join(plan_dir, "tmp"))
+    plan.proc(os.path.join(plan_dir, "proc"))
+    yield ("mount_plan[mount]",
+           lambda: run_in_child(bench_mount_plan(plan, False)))
+    if mount_api_available():
+        prepared = plan.prepare()
+        yield ("mount_plan[new_api]",
+               lambda: run_in_child(bench_mount_plan(plan, True)))
+        yield ("mount_plan[prepared]",
+               lambda: run_in_child(bench_mount_plan(prepared, None)))
+        prepared.close()
+    for name in ["bind", "tmp", "proc"]:
+        os.rmdir(os.path.join(plan_dir, name))
+    os.rmdir(plan_dir)
+
+    new_root = tempfile.mkdtemp(prefix="procszoo-bench-")
+    yield ("pivot_root", lambda: run_in_child(bench_pivot_root(new_root)))
+    os.rmdir(new_root)
+
+    cache_dir = tempfile.mkdtemp(prefix="procszoo-bench-cache-")
+    yield ("check_namespaces_available_status[cold]",
+           lambda: run_in_child(bench_check_namespaces(None)))
+    yield ("check_namespaces_available_status[cached]",
+           lambda: run_in_child(bench_check_namespaces(cache_dir)))
+    for name in os.listdir(cache_dir):
+        os.unlink(os.path.join(cache_dir, name))
+    os.rmdir(cache_dir)
+
+    yield ("import[procszoo.c_functions]", bench_import)
+
+
+def run(repeat, only=None):
+    results = {}
+    for name, measure in benchmarks():
+        if only and not [pattern for pattern in only if pattern in name]:
+            continue
+        try:
+            samples = [measure() for i in range(repeat)]
+        except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+            warn("%s: skipped, %s" % (name, e))
+            results[name] = {"skipped": "%s" % e}
+            continue
+        results[name] = summarize(samples)
+    return results
+
+
+def metadata(repeat):
+    return {"format": _FORMAT_VERSION, "procszoo": __version__,
+            "python": sys.version.split()[0], "kernel": os.uname()[2],
+            "euid": os.geteuid(), "repeat": repeat,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(results, baseline, threshold):
+    """
+    return the names of benchmarks whose median is slower than the
+    baseline by more than threshold.
+    """
+    regressions = []
+    for name in sorted(results):
+        old = baseline.get(name)
+        new = results[name]
+        if not old or "median" not in old or "median" not in new:
+            continue
+        ratio = new["median"] / old["median"]
+        new["baseline_median"] = old["median"]
+        new["ratio"] = ratio
+        if ratio > 1.0 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def show(results, regressions):
+    width = max([len(name) for name in results] + [10])
+    for name in sorted(results):
+        result = results[name]
+        if "skipped" in result:
+            printf("%-*s  skipped" % (width, name))
+            continue
+        line = "%-*s  median %10.3fus  min %10.3fus" % (
+            width, name, result["median"] * 1e6, result["min"] * 1e6)
+        if "ratio" in result:
+            line += "  %+6.1f%%" % ((result["ratio"] - 1.0) * 100)
+            if name in regressions:
+                line += "  REGRESSION"
+        printf(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark procszoo primitives")
+    parser.add_argument("--repeat", type=int, default=_DEFAULT_REPEAT,
+                        help="samples per benchmark")
+    parser.add_argument("--only", action="append",
+                        help="only run benchmarks whose name contains it")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare with a saved result")
+    parser.add_argument("--save-baseline", dest="save_baseline",
+                        help="write the results as a new baseline")
+    parser.add_argument("--threshold", type=float, default=_DEFAULT_THRESHOLD,
+                        help="allowed slowdown of medians, 0.2 means 20%%")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        dest="fail_on_regression")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.only)
+    report = {"meta": metadata(args.repeat), "results": results}
+
+    regressions = []
+    if args.baseline:
+        fo = open(args.baseline, "r")
+        try:
+            baseline = json.load(fo)
+        finally:
+            fo.close()
+        regressions = compare(results, baseline["results"], args.threshold)
+        report["baseline"] = baseline["meta"]
+        report["regressions"] = regressions
+
+    show(results, regressions)
+
+    for path in [args.output, args.save_baseline]:
+        if path:
+            fo = open(path, "w")
+            try:
+                json.dump(report, fo, indent=2, sort_keys=True)
+            finally:
+                fo.close()
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -109,6 +109,7 @@ Summary: %{sum}
 
 rm -f "$RPM_BUILD_ROOT"/%{_bindir}/richard_parker
 rm -f "$RPM_BUILD_ROOT"/%{_bindir}/mamaji
+rm -f "$RPM_BUILD_ROOT"/%{_bindir}/pi_patel
 
 %clean
 rm -rf "$RPM_BUILD_ROOT"
@@ -139,11 +140,14 @@ rm -rf "$RPM_BUILD_ROOT"
     mamaji %{_bindir}/mamaji-2 2
 %{_sbindir}/update-alternatives --install %{_bindir}/richard_parker \
     richard_parker %{_bindir}/richard_parker-2 2
+%{_sbindir}/update-alternatives --install %{_bindir}/pi_patel \
+    pi_patel %{_bindir}/pi_patel-2 2
 
 %postun -n python2-%{srcname}
 if [ $1 -eq 0 ] ; then
     %{_sbindir}/update-alternatives --remove mamaji %{_bindir}/mamaji-2
     %{_sbindir}/update-alternatives --remove richard_parker %{_bindir}/richard_parker-2
+    %{_sbindir}/update-alternatives --remove pi_patel %{_bindir}/pi_patel-2
 fi
 %endif
 
@@ -153,11 +157,14 @@ fi
     mamaji %{_bindir}/mamaji-3 3
 %{_sbindir}/update-alternatives --install %{_bindir}/richard_parker \
     richard_parker %{_bindir}/richard_parker-3 3
+%{_sbindir}/update-alternatives --install %{_bindir}/pi_patel \
+    pi_patel %{_bindir}/pi_patel-3 3
 
 %postun -n %{python3_pkgprefix}-%{srcname}
 if [ $1 -eq 0 ] ; then
     %{_sbindir}/update-alternatives --remove mamaji %{_bindir}/mamaji-3
     %{_sbindir}/update-alternatives --remove richard_parker %{_bindir}/richard_parker-3
+    %{_sbindir}/update-alternatives --remove pi_patel %{_bindir}/pi_patel-3
 fi
 %endif
 
@@ -0,0 +1,338 @@
+# Copyright 2016 Red Hat, Inc. All Rights Reserved.
+# Licensed to GPL under a Contributor Agreement.
+
+"""
+resource accounting of running sandboxes. E.g.,
+
+    sampler = UsageSampler()
+    for i in range(100):
+        sampler.add(spawn_sandbox(limits={}, nscmd=["make"]))
+    for record in sampler.stream(interval=1.0):
+        export(record._asdict())
+
+Every pass reads the stat files of all sandboxes, by descriptors opened
+once, so a pass over many sandboxes costs a few pread(2) calls each. A
+sandbox with a cgroup is read from cpu.stat, memory.current, memory.peak,
+io.stat and the PSI files of its cgroup, a sandbox without one from
+/proc/<pid>/stat, status and io of its first process, that has no
+pressure data. The last record of a SandboxHandle that exits has final
+true, the fields that the cgroup could not give then come from the
+rusage of os.wait4().
+"""
+
+import os
+import time
+import errno
+from collections import namedtuple
+
+from procszoo.cgroups import Cgroup
+
+__all__ = ["UsageRecord", "UsageSampler", "rusage_record"]
+
+UsageRecord = namedtuple("UsageRecord", [
+    "key", "pid", "time", "cpu_usec", "memory_bytes", "memory_peak_bytes",
+    "io_read_bytes", "io_write_bytes", "cpu_pressure_usec",
+    "memory_pressure_usec", "io_pressure_usec", "final"])
+
+_RECORD_FIELDS = UsageRecord._fields[3:-1]
+_READ_SIZE = 1 << 16
+_GONE_ERRNOS = [errno.ENOENT, errno.ESRCH, errno.ENODEV]
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _pread(fd):
+    if hasattr(os, "pread"):
+        return os.pread(fd, _READ_SIZE, 0).decode()
+    os.lseek(fd, 0, os.SEEK_SET)
+    return os.read(fd, _READ_SIZE).decode()
+
+
+def _open_quietly(path):
+    try:
+        return os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return None
+
+
+def _keyed_values(text):
+    """
+    "key value" lines, e.g., cpu.stat.
+    """
+    values = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(" ")
+        values[key] = value
+    return values
+
+
+def _pressure_total(text):
+    """
+    the total stall time in usec of the "some" line of a PSI file.
+    """
+    for line in text.splitlines():
+        if line.startswith("some "):
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key == "total":
+                    return int(value)
+    return None
+
+
+def _io_bytes(text):
+    read_bytes = write_bytes = 0
+    for line in text.splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition("=")
+            if key == "rbytes":
+                read_bytes += int(value)
+            elif key == "wbytes":
+                write_bytes += int(value)
+    return read_bytes, write_bytes
+
+
+def rusage_record(rusage, key=None, pid=None, final=True):
+    """
+    a UsageRecord of a resource.struct_rusage, e.g., the one of
+    os.wait4(), it has no memory_bytes nor pressure data.
+    """
+    return UsageRecord(
+        key=key, pid=pid, time=time.time(),
+        cpu_usec=int((rusage.ru_utime + rusage.ru_stime) * 1000000),
+        memory_bytes=None, memory_peak_bytes=rusage.ru_maxrss * 1024,
+        io_read_bytes=rusage.ru_inblock * 512,
+        io_write_bytes=rusage.ru_oublock * 512,
+        cpu_pressure_usec=None, memory_pressure_usec=None,
+        io_pressure_usec=None, final=final)
+
+
+class _Source(object):
+    """
+    the open stat files of one sandbox, None ones are not there.
+    """
+    files = []
+
+    def __init__(self, key, pid, handle=None):
+        self.key = key
+        self.pid = pid
+        self.handle = handle
+        self.fds = {}
+
+    def _open(self, directory):
+        for name in self.files:
+            self.fds[name] = _open_quietly(os.path.join(directory, name))
+        if not [fd for fd in self.fds.values() if fd is not None]:
+            raise OSError(errno.ENOENT, "no stat files in %s" % directory)
+
+    def _read(self, name):
+        fd = self.fds.get(name)
+        if fd is None:
+            return None
+        try:
+            return _pread(fd)
+        except (IOError, OSError) as e:
+            if e.errno in _GONE_ERRNOS:
+                raise
+            return None
+
+    def read(self):
+        """
+        return a dict of the record fields, raise OSError if it has gone.
+        The fields that a source could not read are None.
+        """
+        return dict.fromkeys(_RECORD_FIELDS)
+
+    def close(self):
+        for fd in self.fds.values():
+            if fd is not None:
+                os.close(fd)
+        self.fds = {}
+
+
+class _CgroupSource(_Source):
+    files = ["cpu.stat", "memory.current", "memory.peak", "io.stat",
+             "cpu.pressure", "memory.pressure", "io.pressure"]
+
+    def __init__(self, key, pid, path, handle=None):
+        _Source.__init__(self, key, pid, handle)
+        self._open(path)
+
+    def read(self):
+        fields = dict.fromkeys(_RECORD_FIELDS)
+        text = self._read("cpu.stat")
+        if text is not None:
+            usage = _keyed_values(text).get("usage_usec")
+            if usage is not None:
+                fields["cpu_usec"] = int(usage)
+        for name, field in [("memory.current", "memory_bytes"),
+                                ("memory.peak", "memory_peak_bytes")]:
+            text = self._read(name)
+            if text is not None:
+                fields[field] = int(text)
+        text = self._read("io.stat")
+        if text is not None:
+            fields["io_read_bytes"], fields["io_write_bytes"] = (
+                _io_bytes(text))
+        for resource in ["cpu", "memory", "io"]:
+            text = self._read("%s.pressure" % resource)
+            if text is not None:
+                fields["%s_pressure_usec" % resource] = _pressure_total(text)
+        return fields
+
+
+class _ProcSource(_Source):
+    """
+    the first process of a sandbox without a cgroup, the cpu time counts
+    its children that have been reaped, the memory is its own.
+    """
+    files = ["stat", "status", "io"]
+
+    def __init__(self, key, pid, handle=None):
+        _Source.__init__(self, key, pid, handle)
+        self._open("/proc/%d" % pid)
+
+    def read(self):
+        fields = dict.fromkeys(_RECORD_FIELDS)
+        text = self._read("stat")
+        if text is not None:
+            stat = text[text.rindex(")") + 2:].split()
+            ticks = sum([int(value) for value in stat[11:15]])
+            fields["cpu_usec"] = ticks * 1000000 // _CLOCK_TICKS
+            fields["memory_bytes"] = int(stat[21]) * _PAGE_SIZE
+        text = self._read("status")
+        if text is not None:
+            for line in text.splitlines():
+                if line.startswith("VmHWM:"):
+                    fields["memory_peak_bytes"] = int(line.split()[1]) * 1024
+                    break
+        text = self._read("io")
+        if text is not None:
+            values = {}
+            for line in text.splitlines():
+                key, _, value = line.partition(":")
+                values[key] = value
+            if "read_bytes" in values:
+                fields["io_read_bytes"] = int(values["read_bytes"])
+                fields["io_write_bytes"] = int(values["write_bytes"])
+        return fields
+
+
+class UsageSampler(object):
+    """
+    sample many sandboxes in one pass. A target is a SandboxHandle, a
+    Cgroup, a path of a cgroup dir, or a pid.
+    """
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.sources = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add(self, target, key=None):
+        """
+        return the key of the records of target, it is the pid of the
+        sandbox by default.
+        """
+        handle = None
+        pid = None
+        path = None
+        if hasattr(target, "config") and hasattr(target, "poll"):
+            handle = target
+            config = handle.config
+            pid = handle.pid
+            if config is not None:
+                pid = config.bottom_halves_child_pid or pid
+                path = config._cgroup_dir()
+        elif isinstance(target, Cgroup):
+            path = target.path
+        elif isinstance(target, int):
+            pid = target
+        else:
+            path = target
+        if key is None:
+            key = pid if pid is not None else path
+        if key in self.sources:
+            self.remove(key)
+
+        if path is not None:
+            source = _CgroupSource(key, pid, path, handle)
+        else:
+            source = _ProcSource(key, pid, handle)
+        self.sources[key] = source
+        return key
+
+    def remove(self, key):
+        source = self.sources.pop(key, None)
+        if source is not None:
+            source.close()
+
+    def _record(self, source, fields, final=False):
+        return UsageRecord(key=source.key, pid=source.pid, time=time.time(),
+                           final=final, **fields)
+
+    def _final_record(self, source, fields):
+        """
+        fill in what the stat files did not have from the rusage, the
+        rusage is None if someone else reaped the sandbox.
+        """
+        record = dict.fromkeys(_RECORD_FIELDS)
+        record.update(fields)
+        handle = source.handle
+        if handle.rusage is not None:
+            usage = rusage_record(handle.rusage)
+            for name in _RECORD_FIELDS:
+                if record[name] is None:
+                    record[name] = getattr(usage, name)
+        return self._record(source, record, final=True)
+
+    def sample(self):
+        """
+        one pass over the sandboxes, yield a UsageRecord of each one.
+        Sandboxes that have gone are dropped, a SandboxHandle is reaped
+        when it exits and its record is final.
+        """
+        for key in list(self.sources):
+            source = self.sources[key]
+            try:
+                fields = source.read()
+            except (IOError, OSError):
+                fields = None
+            handle = source.handle
+            if handle is not None and handle.poll() is not None:
+                self.remove(key)
+                yield self._final_record(source, fields or {})
+            elif fields is None:
+                self.remove(key)
+            else:
+                yield self._record(source, fields)
+
+    def stream(self, interval=None, count=None):
+        """
+        yield the records of a pass every interval seconds, until no
+        sandbox is left, or count passes.
+        """
+        if interval is None:
+            interval = self.interval
+        passes = 0
+        while self.sources:
+            started = time.time()
+            for record in self.sample():
+                yield record
+            passes += 1
+            if count is not None and passes >= count:
+                return
+            if self.sources:
+                delay = interval - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def close(self):
+        for key in list(self.sources):
+            self.remove(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
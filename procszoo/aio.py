@@ -0,0 +1,113 @@
+# Copyright 2016 Red Hat, Inc. All Rights Reserved.
+# Licensed to GPL under a Contributor Agreement.
+
+"""
+asyncio support, python3 only. E.g.,
+
+    async def main():
+        sandbox = await spawn_namespaces_async(nscmd=["hostname"])
+        status = await sandbox
+
+The top halves of the spawn protocol wait for the children on
+non-blocking descriptors registered with the event loop, so one event loop
+could manage many sandboxes at the same time.
+"""
+
+import os
+import asyncio
+
+from procszoo.c_functions import *
+from procszoo.c_functions import _abort_children
+
+__all__ = ["spawn_namespaces_async", "AsyncSandbox"]
+
+
+def _pidfd_open(pid):
+    if not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+async def _wait_readable(fd, loop=None):
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def on_readable():
+        if not future.done():
+            future.set_result(None)
+
+    loop.add_reader(fd, on_readable)
+    try:
+        await future
+    finally:
+        loop.remove_reader(fd)
+
+
+class AsyncSandbox(object):
+    """
+    a running sandbox, awaiting it returns the exit status as
+    os.waitpid() does. pid is the process that we wait for, it is
+    config.top_halves_child_pid.
+    """
+    def __init__(self, config, pidfd=None):
+        self.config = config
+        self.pid = config.top_halves_child_pid
+        self.pidfd = pidfd
+        self.status = None
+
+    async def wait(self):
+        if self.status is not None:
+            return self.status
+        if self.pidfd is None:
+            self.pidfd = _pidfd_open(self.pid)
+        if self.pidfd is None:
+            loop = asyncio.get_running_loop()
+            self.status = (await loop.run_in_executor(
+                None, os.waitpid, self.pid, 0))[1]
+            self.config.release_cgroup()
+            return self.status
+
+        try:
+            await _wait_readable(self.pidfd)
+            self.status = os.waitpid(self.pid, 0)[1]
+        finally:
+            os.close(self.pidfd)
+            self.pidfd = None
+        self.config.release_cgroup()
+        return self.status
+
+    def __await__(self):
+        return self.wait().__await__()
+
+    def send_signal(self, signum):
+        if self.status is None:
+            os.kill(self.pid, signum)
+
+
+async def spawn_namespaces_async(**kwargs):
+    """
+    the same arguments as SpawnNamespacesConfig, but sandboxes always run
+    in interactive mode, for batch mode exits the caller. timing is not
+    supported, for the timings are read by blocking reads. If the spawn is
+    cancelled, the children are killed and reaped.
+    """
+    if kwargs.get("interactive") is False:
+        raise NamespaceSettingError("batch mode is not supported")
+    kwargs["interactive"] = True
+    config = SpawnNamespacesConfig(**kwargs)
+    if config.timing:
+        raise NamespaceSettingError("timing is not supported")
+    config.parse_conf()
+
+    children = config.start_children()
+    try:
+        await _wait_readable(children[2])
+    except BaseException:
+        _abort_children(children, config)
+        raise
+    handle = config.finish_start(children)
+    return AsyncSandbox(config, handle.pidfd)
@@ -6,9 +6,19 @@ import sys
 import resource
 import atexit
 import re
-from ctypes import (cdll, c_int, c_long, c_char_p, c_size_t, string_at,
+import time
+import errno
+import threading
+import traceback
+import signal
+import fcntl
+import select
+import types
+import math
+from ctypes import (cdll, CDLL, c_int, c_uint, c_long, c_char_p, c_size_t, string_at,
                         create_string_buffer, POINTER, c_void_p, CFUNCTYPE,
-             pythonapi)
+             pythonapi, PyDLL, Structure, c_uint64, addressof, byref,
+             sizeof, get_errno)
 import pwd
 import grp
 
@@ -19,10 +29,13 @@ except ImportError:
 
 import pickle
 from copy import copy, deepcopy
+from collections import OrderedDict
 import json
 
 from procszoo.utils import *
 from procszoo.namespaces import *
+from procszoo.mountinfo import MountTable
+from procszoo.cgroups import Cgroup, CgroupRoot
 from procszoo.version import PROCSZOO_VERSION
 from procszoo.c_functions.macros import *
 from procszoo.c_functions.atfork import atfork as c_atfork
@@ -51,10 +64,18 @@ __all__ = [
     "get_namespace", "unregister_fork_handlers", "to_unicode", "to_bytes",
     "get_available_propagations", "__version__", "find_shell",
     "get_current_users_and_groups", "getresuid", "getresgid",
-    "setresuid", "setresgid", "SpawnNamespacesConfig"]
+    "setresuid", "setresgid", "SpawnNamespacesConfig", "SandboxPool",
+    "PooledSandbox", "close_fds", "pidfd_open", "pidfd_send_signal",
+    "SandboxHandle", "SandboxSupervisor", "spawn_sandbox", "spawn_many",
+    "enable_stats", "disable_stats", "get_stats", "reset_stats",
+    "add_audit_hook", "remove_audit_hook", "CFunctionStats",
+    "NamespaceHandle", "NamespaceHandleCache", "open_namespace", "enter",
+    "mount_api_available", "open_tree", "move_mount", "umount_tree",
+    "prune_mounts",
+    "MountTable", "Cgroup", "CgroupRoot", "terminate_sandboxes"]
 
 _HOST_NAME_MAX = 256
-_CDLL = cdll.LoadLibrary(None)
+_CDLL = CDLL(None, use_errno=True)
 _ACKCHAR = 0x006
 _MAX_USERS_MAP = 5
 _MAX_GROUPS_MAP = 5
@@ -62,6 +83,40 @@ _PREPARE_FORKHANDLERS = []
 _PARENT_FORKHANDLERS = []
 _CHILD_FORKHANDLERS = []
 _CALLERS_REGISTERED = False
+_PYDLL = PyDLL(None, use_errno=True)
+_PYDLL.syscall.restype = c_long
+_CLONE_PIDFD = 0x00001000
+_CLONE_INTO_CGROUP = 0x200000000
+_CLOSE_RANGE_CLOEXEC = 4
+_MAX_FD = 0xffffffff
+_BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+_NAMESPACES_STATUS_CACHE = "namespaces-status.json"
+_SPAWN_ENGINES = ["fork", "clone"]
+_INSTANCE_SETTINGS = ["nscmd", "func", "extra", "cgroup", "keep_fds",
+                          "cloexec_fds", "rootfs", "mounts"]
+_SPAWN_MANY_PARALLEL = 16
+_SPAWN_TRACE_ENV = "PROCSZOO_SPAWN_TRACE"
+_STATS_ENV = "PROCSZOO_STATS"
+_STATS_BUCKETS = 25
+_AUDIT_HOOKS = []
+_NAMESPACE_HANDLES_MAX_FDS = 256
+_ENTER_ORDER = ["user", "cgroup", "ipc", "uts", "net", "pid", "mount"]
+_PRUNE_MOUNTS_KEEP = ["/", "/proc", "/sys", "/dev", "/dev/pts", "/dev/shm",
+                          "/dev/mqueue", "/run", "/tmp"]
+_AT_FDCWD = -100
+_AT_SYMLINK_NOFOLLOW = 0x100
+_AT_EMPTY_PATH = 0x1000
+_AT_RECURSIVE = 0x8000
+_OPEN_TREE_CLONE = 1
+_MOVE_MOUNT_F_EMPTY_PATH = 0x4
+_FSOPEN_CLOEXEC = 1
+_FSMOUNT_CLOEXEC = 1
+_FSCONFIG_SET_FLAG = 0
+_FSCONFIG_SET_STRING = 1
+_FSCONFIG_CMD_CREATE = 6
+_MOUNT_ATTRS = {"ro": 0x1, "nosuid": 0x2, "nodev": 0x4, "noexec": 0x8,
+                    "noatime": 0x10, "nodiratime": 0x80,
+                    "nosymfollow": 0x200000}
 
 
 def _register_fork_handlers(prepare=None, parent=None, child=None):
@@ -115,6 +170,148 @@ def _fork():
     return pid
 
 
+class _CloneArgs(Structure):
+    """
+    struct clone_args of clone3(2)
+    """
+    _fields_ = [("flags", c_uint64), ("pidfd", c_uint64),
+                    ("child_tid", c_uint64), ("parent_tid", c_uint64),
+                    ("exit_signal", c_uint64), ("stack", c_uint64),
+                    ("stack_size", c_uint64), ("tls", c_uint64),
+                    ("set_tid", c_uint64), ("set_tid_size", c_uint64),
+                    ("cgroup", c_uint64)]
+
+
+def _mount_attrs(names):
+    attrs = 0
+    for name in names or []:
+        if name not in _MOUNT_ATTRS:
+            raise RuntimeError("%s: unknown mount attribute" % name)
+        attrs |= _MOUNT_ATTRS[name]
+    return attrs
+
+
+class _MountAttr(Structure):
+    """
+    struct mount_attr of mount_setattr(2)
+    """
+    _fields_ = [("attr_set", c_uint64), ("attr_clr", c_uint64),
+                    ("propagation", c_uint64), ("userns_fd", c_uint64)]
+
+
+def _clone3(flags, cgroup_fd=None):
+    """
+    fork-like clone3(2): the child gets a copy of our stack, so it returns
+    here just as os.fork() does. The GIL is held during the syscall and the
+    interpreter fork hooks are called as os.fork() does, but the libc
+    pthread_atfork handlers are not run. Return (pid, pidfd).
+    """
+    if not SYSCALL_CLONE3_AVAILABLE:
+        raise CFunctionUnknowSyscall()
+
+    args = _CloneArgs()
+    args.flags = flags | _CLONE_PIDFD
+    args.exit_signal = signal.SIGCHLD
+    pidfd = c_int(-1)
+    args.pidfd = addressof(pidfd)
+    if cgroup_fd is not None:
+        args.flags |= _CLONE_INTO_CGROUP
+        args.cgroup = cgroup_fd
+
+    if _CALLERS_REGISTERED:
+        _prepare_caller()
+    if hasattr(pythonapi, "PyOS_BeforeFork"):
+        pythonapi.PyOS_BeforeFork()
+    pid = _PYDLL.syscall(c_long(NR_CLONE3), byref(args),
+                             c_size_t(sizeof(args)))
+    if pid == 0:
+        if hasattr(pythonapi, "PyOS_AfterFork_Child"):
+            pythonapi.PyOS_AfterFork_Child()
+        else:
+            pythonapi.PyOS_AfterFork()
+        if _CALLERS_REGISTERED:
+            _child_caller()
+        return 0, -1
+
+    _errno = get_errno()
+    if hasattr(pythonapi, "PyOS_AfterFork_Parent"):
+        pythonapi.PyOS_AfterFork_Parent()
+    if _CALLERS_REGISTERED:
+        _parent_caller()
+    if pid == -1:
+        raise CFunctionCallFailed(os.strerror(_errno), errno=_errno)
+    return pid, pidfd.value
+
+
+def _exit_code_from_status(status):
+    if status is None:
+        return 1
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _exit_forked_child(func, *args, **kwargs):
+    """
+    run func in a forked child and never return to the caller's frames.
+    """
+    code = 0
+    try:
+        func(*args, **kwargs)
+    except SystemExit as e:
+        code = e.code
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    if code is None:
+        code = 0
+    elif not isinstance(code, int):
+        warn(code)
+        code = 1
+    for fo in [sys.stdout, sys.stderr]:
+        try:
+            fo.flush()
+        except (OSError, IOError, ValueError):
+            pass
+    os._exit(code)
+
+
+def _monotonic():
+    if hasattr(time, "monotonic"):
+        return time.monotonic()
+    return time.time()
+
+
+def _set_cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+
+class _SpawnPhase(object):
+    def __init__(self, config, name):
+        self.config = config
+        self.name = name
+        self.begin = None
+
+    def __enter__(self):
+        self.begin = _monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.config.record_phase(self.name, self.begin, _monotonic())
+        return False
+
+
 def _write2file(path, str=None):
     if path is None:
         raise RuntimeError("path cannot be none")
@@ -208,38 +405,120 @@ def _accetable_group_map(group_map):
     return True
 
 
-def _write_to_uid_and_gid_map(maproot, users_map, groups_map, pid):
+def _format_uid_and_gid_map(maproot, users_map, groups_map):
+    """
+    return the strings written to uid_map and gid_map, None means
+    nothing to write.
+    """
     if maproot is None:
-        return
+        return None, None
 
     if users_map is None:
         _maps = ["0 %d 1" % os.geteuid()]
     else:
         _maps = users_map
 
+    uid_map_str = None
     if _maps:
         if len(_maps) > _MAX_USERS_MAP:
             raise NamespaceSettingError()
-        map_str = "%s\n" % "\n".join(_maps)
-        try:
-            _map_id("uid_map", map_str, pid)
-        except IOError:
-            raise NamespaceRequireSuperuserPrivilege()
+        uid_map_str = "%s\n" % "\n".join(_maps)
 
     if groups_map is None:
         _maps = ["0 %d 1" % os.getegid()]
     else:
         _maps = groups_map
 
+    gid_map_str = None
     if _maps:
         if len(_maps) > _MAX_GROUPS_MAP:
             raise NamespaceSettingError()
-        map_str = "%s\n" % "\n".join(_maps)
+        gid_map_str = "%s\n" % "\n".join(_maps)
+
+    return uid_map_str, gid_map_str
+
+
+def _write_uid_and_gid_map_str(uid_map_str, gid_map_str, pid):
+    for name, map_str in [("uid_map", uid_map_str), ("gid_map", gid_map_str)]:
+        if map_str is None:
+            continue
         try:
-            _map_id("gid_map", map_str, pid)
+            _map_id(name, map_str, pid)
         except IOError:
             raise NamespaceRequireSuperuserPrivilege()
 
+
+def _cache_dir():
+    """
+    the dir of procszoo caches, PROCSZOO_CACHE_DIR could override it, and
+    an empty PROCSZOO_CACHE_DIR disables caches.
+    """
+    if "PROCSZOO_CACHE_DIR" in os.environ:
+        return os.environ["PROCSZOO_CACHE_DIR"] or None
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if not cache_home:
+        try:
+            home = pwd.getpwuid(os.geteuid()).pw_dir
+        except KeyError:
+            return None
+        cache_home = os.path.join(home, ".cache")
+    return os.path.join(cache_home, "procszoo")
+
+
+def _kernel_identity():
+    try:
+        fo = open(_BOOT_ID_PATH, 'r')
+    except IOError:
+        return None
+    try:
+        boot_id = fo.read().strip()
+    finally:
+        fo.close()
+    return {"kernel": os.uname()[2], "boot_id": boot_id}
+
+
+def _load_cache(name, identity):
+    cache_dir = _cache_dir()
+    if cache_dir is None or identity is None:
+        return None
+    try:
+        fo = open(os.path.join(cache_dir, name), 'r')
+    except IOError:
+        return None
+    try:
+        try:
+            cache = json.load(fo)
+        except ValueError:
+            return None
+    finally:
+        fo.close()
+    if not isinstance(cache, dict) or cache.get("identity") != identity:
+        return None
+    return cache.get("data")
+
+
+def _save_cache(name, identity, data):
+    cache_dir = _cache_dir()
+    if cache_dir is None or identity is None:
+        return
+    path = os.path.join(cache_dir, name)
+    tmp_path = "%s.%d" % (path, os.getpid())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fo = open(tmp_path, 'w')
+        try:
+            json.dump({"identity": identity, "data": data}, fo)
+        finally:
+            fo.close()
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
 def _find_my_init(pathes=None, name=None, file_mode=None, dir_mode=None):
     if pathes is None:
         pathes = [_procszoo_scripts_dir]
@@ -320,7 +599,18 @@ class SpawnNamespacesConfig(object):
                 bottom_halves_after_sync=None,
                 top_halves_entry_point=None,
                 bottom_halves_entry_point=None,
-                     entry_point=None):
+                entry_point=None,
+                engine=None,
+                cgroup=None,
+                keep_fds=None,
+                cloexec_fds=None,
+                     timing=None,
+                     rootfs=None,
+                     mounts=None,
+                     prune_mounts=None,
+                     limits=None,
+                     cgroup_root=None,
+                     cgroupfs=None):
         if namespaces is None:
             self.namespaces = adjust_namespaces()
         else:
@@ -332,6 +622,9 @@ class SpawnNamespacesConfig(object):
         else:
             self.mountpoint = mountpoint
         self.ns_bind_dir = ns_bind_dir
+        self.rootfs = rootfs
+        self.mounts = mounts
+        self.prune_mounts = prune_mounts
         self.nscmd = nscmd
         self.propagation = propagation
         self.negative_namespaces = negative_namespaces
@@ -360,6 +653,38 @@ class SpawnNamespacesConfig(object):
             self.pid = pid
         self.top_halves_child_pid = top_halves_child_pid
         self.bottom_halves_child_pid = bottom_halves_child_pid
+        self.bottom_halves_child_status = None
+        self.pidfd = None
+        self.id_maps = None
+
+        self.trace_path = os.environ.get(_SPAWN_TRACE_ENV) or None
+        if timing is None:
+            self.timing = self.trace_path is not None
+        else:
+            self.timing = timing
+        self.timings = []
+        self._timings_sent = 0
+        self._trace_process = "top_halves"
+        self._trace_fd = None
+        self._trace_buffer = b""
+
+        if engine is None:
+            self.engine = "fork"
+        elif engine not in _SPAWN_ENGINES:
+            raise NamespaceSettingError(
+                "engine should be one of [%s]" % ", ".join(_SPAWN_ENGINES))
+        else:
+            self.engine = engine
+        self.cgroup = cgroup
+        self.limits = limits
+        self.cgroup_root = cgroup_root
+        self.cgroup_leaf = None
+        self.cgroupfs = cgroupfs
+        self.keep_fds = keep_fds
+        if cloexec_fds is None:
+            self.cloexec_fds = False
+        else:
+            self.cloexec_fds = cloexec_fds
 
         if parse_conf is None:
             self.parse_conf = self.default_handler_to_parse_conf
@@ -439,30 +764,264 @@ class SpawnNamespacesConfig(object):
                         bottom_halves_entry_point)
 
         if entry_point is None:
-            self.entry_point = self.default_entry_point
+            if self.engine == "clone":
+                self.entry_point = self.clone_entry_point
+            else:
+                self.entry_point = self.default_entry_point
         elif not getattr(entry_point, '__call__'):
             raise NamespaceSettingError('handler must be a callable')
         else:
             setattr(self, 'entry_point', entry_point)
 
     def default_entry_point(self, *args, **kwargs):
-        self.parse_conf(*args, **kwargs)
+        with self.phase("parse_conf"):
+            self.parse_conf(*args, **kwargs)
 
+        with self.phase("fork"):
+            pid, r1, w1, r2, w2 = self.fork_children(*args, **kwargs)
+        self.top_halves_entry_point(r1, w1, r2, w2, pid, *args, **kwargs)
+
+    def phase(self, name):
+        """
+        with config.phase(name): ... records the time spent in the block
+        in config.timings, if timing is enabled.
+        """
+        if not self.timing:
+            return _NULL_PHASE
+        return _SpawnPhase(self, name)
+
+    def record_phase(self, name, begin, end=None):
+        self.timings.append({"process": self._trace_process,
+                                 "pid": os.getpid(), "phase": name,
+                                 "begin": begin, "end": end})
+
+    def _trace_child(self, process):
+        self._trace_process = process
+        self.timings = []
+        self._timings_sent = 0
+        self._trace_buffer = b""
+
+    def _send_timings(self, fd, **message):
+        lines = [json.dumps({"timing": record})
+                     for record in self.timings[self._timings_sent:]]
+        self._timings_sent = len(self.timings)
+        if message:
+            lines.append(json.dumps(message))
+        data = to_bytes("".join(["%s\n" % line for line in lines]))
+        while data:
+            data = data[os.write(fd, data):]
+
+    def _send_sync_timings(self, fd):
+        """
+        send the timings of the sync. The top halves read them until EOF,
+        and only the default bottom_halves_after_sync surely execs or runs
+        func soon, so close the pipe before any other one, e.g. the parked
+        sandboxes of SandboxPool, then the exec phase is not recorded.
+        """
+        self._send_timings(fd)
+        if (self.bottom_halves_after_sync !=
+                self.default_bottom_halves_after_sync):
+            os.close(fd)
+            self._trace_fd = None
+
+    def _recv_timings(self, fd, key=None):
+        """
+        read the timings that the children send, until a message having
+        key arrives, or until EOF if key is None.
+        """
+        while True:
+            while b"\n" in self._trace_buffer:
+                line, self._trace_buffer = self._trace_buffer.split(b"\n", 1)
+                message = json.loads(to_unicode(line))
+                if "timing" in message:
+                    self.timings.append(message["timing"])
+                elif key is not None and key in message:
+                    return message
+            data = os.read(fd, 4096)
+            if not data:
+                if key is not None:
+                    raise RuntimeError("sync failed")
+                return None
+            self._trace_buffer += data
+
+    def _finish_timings(self, r1):
+        """
+        wait until the sandbox execs or runs func, then close r1, the
+        exec phase ends at that moment.
+        """
+        self._recv_timings(r1)
+        os.close(r1)
+        now = _monotonic()
+        for record in self.timings:
+            if record["end"] is None:
+                record["end"] = now
+            if record["process"] == "sandbox":
+                record["pid"] = self.bottom_halves_child_pid
+        self.timings.sort(key=lambda record: record["begin"])
+        if self.trace_path is not None:
+            path = self.trace_path
+            if os.path.isdir(path):
+                path = os.path.join(path, "procszoo-spawn-%d.json"
+                                        % self.bottom_halves_child_pid)
+            self.write_chrome_trace(path)
+
+    def chrome_trace(self):
+        """
+        config.timings in the Chrome trace event format, that
+        chrome://tracing or Perfetto could load.
+        """
+        events = []
+        processes = {}
+        for record in self.timings:
+            processes[record["pid"]] = record["process"]
+            events.append({"name": record["phase"], "ph": "X",
+                               "cat": record["process"],
+                               "ts": record["begin"] * 1e6,
+                               "dur": (record["end"] - record["begin"]) * 1e6,
+                               "pid": record["pid"], "tid": record["pid"]})
+        for pid, process in processes.items():
+            events.append({"name": "process_name", "ph": "M", "pid": pid,
+                               "args": {"name": "%s %d" % (process, pid)}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        fo = open(path, 'w')
+        try:
+            json.dump(self.chrome_trace(), fo)
+        finally:
+            fo.close()
+
+    def start(self, *args, **kwargs):
+        """
+        spawn the sandbox without waiting for it, return a SandboxHandle.
+        """
+        if not self.interactive:
+            raise NamespaceSettingError("batch mode exits the caller")
+        with self.phase("parse_conf"):
+            self.parse_conf(*args, **kwargs)
+        with self.phase("fork"):
+            children = self.start_children(*args, **kwargs)
+        return self.finish_start(children, *args, **kwargs)
+
+    def start_children(self, *args, **kwargs):
+        """
+        the first half of start(), return (pid, pidfd, r1, w1, r2, w2),
+        pidfd is None for the fork engine. r1 turns readable when the
+        children are ready to sync.
+        """
+        children = None
+        if self.engine == "clone":
+            children = self.clone_children(exit_child=True, *args, **kwargs)
+        if children is not None:
+            return children
+        pid, r1, w1, r2, w2 = self.fork_children(exit_child=True,
+                                                     *args, **kwargs)
+        return pid, None, r1, w1, r2, w2
+
+    def finish_start(self, children, *args, **kwargs):
+        """
+        the second half of start(), sync with the children and return
+        a SandboxHandle.
+        """
+        pid, pidfd, r1, w1, r2, w2 = children
+        if pidfd is not None:
+            self.clone_top_halves_sync(r1, w1, r2, w2, pid, pidfd,
+                                           *args, **kwargs)
+            self.pidfd = None
+            return SandboxHandle(pid, pidfd, config=self)
+
+        self.top_halves_sync(r1, w1, r2, w2, pid, *args, **kwargs)
+        return SandboxHandle(pid, config=self)
+
+    def prepare(self):
+        """
+        check the settings and build the uid/gid map strings, so that
+        instance() copies could be spawned without doing it again.
+        """
+        self.parse_conf()
+        self.id_maps = _format_uid_and_gid_map(
+            self.maproot, self.users_map, self.groups_map)
+
+    def instance(self, **overrides):
+        """
+        return a copy of this config that shares the checked settings.
+        Only the settings in _INSTANCE_SETTINGS could be overridden.
+        """
+        for key in overrides:
+            if key not in _INSTANCE_SETTINGS:
+                raise NamespaceSettingError(
+                    "'%s' cannot be set per instance" % key)
+
+        config = copy(self)
+        for key, value in self.__dict__.items():
+            if getattr(value, "__self__", None) is self:
+                setattr(config, key, types.MethodType(value.__func__, config))
+        config.top_halves_child_pid = None
+        config.bottom_halves_child_pid = None
+        config.bottom_halves_child_status = None
+        config.pidfd = None
+        config.cgroup_leaf = None
+        config.timings = []
+        config._trace_buffer = b""
+        for key, value in overrides.items():
+            setattr(config, key, value)
+
+        if config.func is not None and (
+                config.nscmd is not None or config.init_prog is not None):
+            raise NamespaceSettingError()
+        return config
+
+    def fork_children(self, *args, **kwargs):
+        """
+        fork the bottom halves, return (pid, r1, w1, r2, w2) in the parent.
+        If exit_child is true, the child never returns to the caller's
+        frames, even if it raises an exception.
+        """
+        exit_child = kwargs.pop("exit_child", False)
+        self._create_cgroup()
         r1, w1 = os.pipe()
         r2, w2 = os.pipe()
 
         pid = _fork()
 
         if pid == 0:
+            self._trace_child("bottom_halves")
+            self._enter_cgroup()
+            if exit_child:
+                _exit_forked_child(self._bottom_halves_and_exit,
+                                       r1, w1, r2, w2, *args, **kwargs)
             self.bottom_halves_entry_point(r1, w1, r2, w2, *args, **kwargs)
             sys.exit(0)
-        elif pid > 0:
-            self.top_halves_entry_point(r1, w1, r2, w2, pid, *args, **kwargs)
-        else:
-            sys.exit(0)
+        return pid, r1, w1, r2, w2
+
+    def _bottom_halves_and_exit(self, *args, **kwargs):
+        self.bottom_halves_entry_point(*args, **kwargs)
+        if self.bottom_halves_child_status is not None:
+            sys.exit(_exit_code_from_status(self.bottom_halves_child_status))
 
     def default_top_halves_entry_point(self, r1, w1, r2, w2, pid,
                                             *args, **kwargs):
+        self.top_halves_sync(r1, w1, r2, w2, pid, *args, **kwargs)
+
+        if self.interactive:
+            os.waitpid(self.top_halves_child_pid, 0)
+            if self.pidfd is not None:
+                os.close(self.pidfd)
+                self.pidfd = None
+            self.release_cgroup()
+        else:
+            self._release_cgroup_when_empty()
+            sys.exit(0)
+
+    def top_halves_sync(self, r1, w1, r2, w2, pid, *args, **kwargs):
+        """
+        run the top halves side of the sync protocol, but do not wait
+        for the children. A child of clone_entry_point() has its pidfd in
+        self.pidfd, and syncs as clone_top_halves_sync() expects.
+        """
+        if self.pidfd is not None:
+            return self.clone_top_halves_sync(r1, w1, r2, w2, pid,
+                                                  self.pidfd, *args, **kwargs)
         self.top_halves_child_pid = pid
 
         self.top_halves_before_sync(*args, **kwargs)
@@ -470,8 +1029,12 @@ class SpawnNamespacesConfig(object):
         os.close(w1)
         os.close(r2)
 
-        child_pid = os.read(r1, 64)
-        os.close(r1)
+        with self.phase("sync_wait"):
+            if self.timing:
+                child_pid = self._recv_timings(r1, "pid")["pid"]
+            else:
+                child_pid = os.read(r1, 64)
+                os.close(r1)
         try:
             child_pid = int(child_pid)
         except ValueError:
@@ -479,86 +1042,86 @@ class SpawnNamespacesConfig(object):
 
         self.bottom_halves_child_pid = child_pid
 
-        self.top_halves_half_sync(*args, **kwargs)
+        with self.phase("half_sync"):
+            self.top_halves_half_sync(*args, **kwargs)
 
         os.write(w2, to_bytes(chr(_ACKCHAR)))
         os.close(w2)
 
         self.top_halves_after_sync(*args, **kwargs)
-
-        if self.interactive:
-            os.waitpid(self.top_halves_child_pid, 0)
-        else:
-            sys.exit(0)
+        if self.timing:
+            self._finish_timings(r1)
 
     def default_bottom_halves_entry_point(self, r1, w1, r2, w2,
                                                *args, **kwargs):
         os.close(r1)
         os.close(w2)
 
-        self.bottom_halves_before_fork(*args, **kwargs)
+        self._clone_mount_trees()
+        with self.phase("before_fork"):
+            self.bottom_halves_before_fork(*args, **kwargs)
 
         r3, w3 = os.pipe()
         r4, w4 = os.pipe()
-        pid = _fork()
+        with self.phase("fork"):
+            pid = _fork()
 
         if pid == 0:
+            self._trace_child("sandbox")
             if not self.interactive:
                 process_id = os.setsid()
                 if process_id == -1:
                     sys.exit(1)
 
-            os.close(w1)
+            if self.timing:
+                _set_cloexec(w1)
+                self._trace_fd = w1
+            else:
+                os.close(w1)
             os.close(r2)
 
             os.close(r3)
             os.close(w4)
 
-            self.bottom_halves_before_sync(*args, **kwargs)
+            with self.phase("before_sync"):
+                self.bottom_halves_before_sync(*args, **kwargs)
+            if self.timing:
+                self._send_timings(w1)
 
             os.write(w3, to_bytes(chr(_ACKCHAR)))
             os.close(w3)
 
             self.bottom_halves_half_sync(*args, **kwargs)
 
-            if ord(os.read(r4, 1)) != _ACKCHAR:
-                raise RuntimeError('sync failed')
+            with self.phase("sync_wait"):
+                if ord(os.read(r4, 1)) != _ACKCHAR:
+                    raise RuntimeError('sync failed')
             os.close(r4)
 
             if not self.interactive:
-                devnull = "/dev/null"
-                if hasattr(os, "devnull"):
-                    devnull = os.devnull
-
-                for fd in range(
-                        3, resource.getrlimit(resource.RLIMIT_NOFILE)[0]):
-                    try:
-                        os.close(fd)
-                    except OSError:
-                        pass
-
-                os.chdir('/')
-                devnull_fd = os.open(devnull, os.O_RDWR)
-                os.dup2(devnull_fd, 0)
-                os.dup2(devnull_fd, 1)
-                os.dup2(devnull_fd, 2)
-                os.close(devnull_fd)
-                os.umask(0)
+                self.daemonize()
+            elif self.timing:
+                self._send_sync_timings(w1)
 
             self.bottom_halves_after_sync(*args, **kwargs)
 
             sys.exit(0)
         else:
+            self._release_mount_trees()
 
             os.close(w3)
             os.close(r4)
 
-            if ord(os.read(r3, 1)) != _ACKCHAR:
-                raise RuntimeError('sync failed')
+            with self.phase("sync_wait"):
+                if ord(os.read(r3, 1)) != _ACKCHAR:
+                    raise RuntimeError('sync failed')
             os.close(r3)
 
-            os.write(w1, to_bytes("%d" % pid))
-            os.close(w1)
+            if self.timing:
+                self._send_timings(w1, pid=pid)
+            else:
+                os.write(w1, to_bytes("%d" % pid))
+                os.close(w1)
 
             if ord(os.read(r2, 1)) != _ACKCHAR:
                 raise RuntimeError('sync failed')
@@ -566,13 +1129,164 @@ class SpawnNamespacesConfig(object):
 
             os.write(w4, to_bytes(chr(_ACKCHAR)))
             os.close(w4)
+            if self.timing:
+                self._send_timings(w1)
+                os.close(w1)
 
             if self.interactive:
-                os.waitpid(pid, 0)
+                self.bottom_halves_child_status = os.waitpid(pid, 0)[1]
             else:
                 sys.exit(0)
 
 
+    def clone_entry_point(self, *args, **kwargs):
+        """
+        create the child in the new namespaces by a single clone3(2) call,
+        instead of unshare(2) and two forks, then run the top halves entry
+        point, whose top_halves_sync() syncs with the cloned child. Fall
+        back to the fork engine as clone_children() does.
+        """
+        with self.phase("parse_conf"):
+            self.parse_conf(*args, **kwargs)
+
+        with self.phase("fork"):
+            children = self.clone_children(exit_child=True, *args, **kwargs)
+            if children is None:
+                pid, r1, w1, r2, w2 = self.fork_children(*args, **kwargs)
+            else:
+                pid, self.pidfd, r1, w1, r2, w2 = children
+        self.top_halves_entry_point(r1, w1, r2, w2, pid, *args, **kwargs)
+
+    def clone_children(self, *args, **kwargs):
+        """
+        clone the child in the new namespaces, return
+        (pid, pidfd, r1, w1, r2, w2) in the parent, or None if the kernel
+        does not support clone3(2), or if bottom_halves_before_fork is not
+        the default one, it should run before the namespaces are created.
+        exit_child works as in fork_children.
+        """
+        exit_child = kwargs.pop("exit_child", False)
+        if self.bottom_halves_before_fork != (
+                self.default_bottom_halves_before_fork):
+            return None
+        flags = workbench.namespaces_to_flags(self.namespaces)
+        self._create_cgroup()
+        cgroup_fd = None
+        cgroup_dir = self._cgroup_dir()
+        if cgroup_dir is not None:
+            cgroup_fd = os.open(cgroup_dir, os.O_RDONLY | os.O_DIRECTORY)
+
+        r1, w1 = os.pipe()
+        r2, w2 = os.pipe()
+        self._clone_mount_trees()
+        try:
+            pid, pidfd = _clone3(flags, cgroup_fd)
+        except (CFunctionUnknowSyscall, CFunctionCallFailed) as e:
+            self._release_mount_trees()
+            for fd in [r1, w1, r2, w2]:
+                os.close(fd)
+            if isinstance(e, CFunctionCallFailed) and e.errno not in [
+                    errno.ENOSYS, errno.E2BIG]:
+                self.release_cgroup()
+                raise
+            return None
+        finally:
+            if cgroup_fd is not None:
+                os.close(cgroup_fd)
+
+        if pid == 0:
+            self._trace_child("sandbox")
+            if exit_child:
+                _exit_forked_child(self.clone_bottom_halves,
+                                       r1, w1, r2, w2, *args, **kwargs)
+            self.clone_bottom_halves(r1, w1, r2, w2, *args, **kwargs)
+            sys.exit(0)
+        self._release_mount_trees()
+        return pid, pidfd, r1, w1, r2, w2
+
+    def clone_bottom_halves(self, r1, w1, r2, w2, *args, **kwargs):
+        os.close(r1)
+        os.close(w2)
+        if not self.interactive:
+            if os.setsid() == -1:
+                sys.exit(1)
+
+        with self.phase("before_sync"):
+            self.bottom_halves_before_sync(*args, **kwargs)
+
+        if self.timing:
+            _set_cloexec(w1)
+            self._trace_fd = w1
+            self._send_timings(w1, ready=True)
+        else:
+            os.write(w1, to_bytes(chr(_ACKCHAR)))
+            os.close(w1)
+
+        self.bottom_halves_half_sync(*args, **kwargs)
+
+        with self.phase("sync_wait"):
+            if ord(os.read(r2, 1)) != _ACKCHAR:
+                raise RuntimeError('sync failed')
+        os.close(r2)
+
+        if not self.interactive:
+            self.daemonize()
+        elif self.timing:
+            self._send_sync_timings(w1)
+
+        self.bottom_halves_after_sync(*args, **kwargs)
+
+    def clone_top_halves_sync(self, r1, w1, r2, w2, pid, pidfd,
+                                  *args, **kwargs):
+        self.top_halves_child_pid = pid
+        self.bottom_halves_child_pid = pid
+        self.pidfd = pidfd
+
+        self.top_halves_before_sync(*args, **kwargs)
+
+        os.close(w1)
+        os.close(r2)
+
+        with self.phase("sync_wait"):
+            if self.timing:
+                self._recv_timings(r1, "ready")
+            else:
+                if ord(os.read(r1, 1)) != _ACKCHAR:
+                    raise RuntimeError('sync failed')
+                os.close(r1)
+
+        with self.phase("half_sync"):
+            self.top_halves_half_sync(*args, **kwargs)
+
+        os.write(w2, to_bytes(chr(_ACKCHAR)))
+        os.close(w2)
+
+        self.top_halves_after_sync(*args, **kwargs)
+        if self.timing:
+            self._finish_timings(r1)
+
+    def daemonize(self):
+        """
+        keep_fds are left open and are made inheritable, other descriptors
+        are closed, or only marked close-on-exec if cloexec_fds is true.
+        """
+        devnull = "/dev/null"
+        if hasattr(os, "devnull"):
+            devnull = os.devnull
+
+        workbench.close_fds(keep_fds=self.keep_fds, cloexec=self.cloexec_fds)
+        if self.keep_fds and hasattr(os, "set_inheritable"):
+            for fd in self.keep_fds:
+                os.set_inheritable(fd, True)
+
+        os.chdir('/')
+        devnull_fd = os.open(devnull, os.O_RDWR)
+        os.dup2(devnull_fd, 0)
+        os.dup2(devnull_fd, 1)
+        os.dup2(devnull_fd, 2)
+        os.close(devnull_fd)
+        os.umask(0)
+
     def default_handler_to_parse_conf(self):
         if self.init_prog is not None or self.nscmd is not None:
             if self.func is not None:
@@ -643,6 +1357,57 @@ class SpawnNamespacesConfig(object):
             else:
                 raise NamespaceSettingError()
 
+        if self.rootfs is not None:
+            if not hasattr(self.rootfs, "setup"):
+                raise NamespaceSettingError("rootfs should be a Rootfs object")
+            if not mount_namespace_available():
+                raise NamespaceSettingError("rootfs needs a mount namespace")
+            if "mount" not in self.namespaces:
+                if self.strict:
+                    raise NamespaceSettingError(
+                        "rootfs needs a mount namespace")
+                else:
+                    self.namespaces.append("mount")
+            self.rootfs.check()
+
+        if self.mounts is not None:
+            if not hasattr(self.mounts, "apply"):
+                raise NamespaceSettingError(
+                    "mounts should be a MountPlan object")
+            if not mount_namespace_available():
+                raise NamespaceSettingError("mounts needs a mount namespace")
+            if "mount" not in self.namespaces:
+                if self.strict:
+                    raise NamespaceSettingError(
+                        "mounts needs a mount namespace")
+                else:
+                    self.namespaces.append("mount")
+
+        if self.cgroupfs:
+            if not (cgroup_namespace_available()
+                        and mount_namespace_available()):
+                raise NamespaceSettingError(
+                    "cgroupfs needs cgroup and mount namespaces")
+            for namespace in ["cgroup", "mount"]:
+                if namespace not in self.namespaces:
+                    if self.strict:
+                        raise NamespaceSettingError(
+                            "cgroupfs needs a %s namespace" % namespace)
+                    else:
+                        self.namespaces.append(namespace)
+            if self.cgroupfs is True:
+                self.cgroupfs = "/sys/fs/cgroup"
+
+        if self.limits is not None and self.cgroup_root is None:
+            self.cgroup_root = CgroupRoot()
+        if self.cgroup_root is not None:
+            if self.cgroup is not None:
+                raise NamespaceSettingError(
+                    "cgroup and limits conflict, limits need a new leaf")
+            if not isinstance(self.cgroup_root, CgroupRoot):
+                self.cgroup_root = CgroupRoot(self.cgroup_root)
+            self.cgroup_root.check(self.limits)
+
         if mount_namespace_available():
             if "mount" in self.namespaces and self.propagation is None:
                 self.propagation = "private"
@@ -667,95 +1432,1136 @@ class SpawnNamespacesConfig(object):
              self.propagation = None
              self.mountproc = False
 
+        if self.prune_mounts:
+            if "mount" not in self.namespaces or "user" in self.namespaces:
+                if self.strict:
+                    raise NamespaceSettingError(
+                        "prune_mounts needs a mount namespace without a "
+                        "user namespace, inherited mounts are locked there")
+                else:
+                    self.prune_mounts = None
+            elif self.propagation not in ["private", "slave"]:
+                raise NamespaceSettingError(
+                    "prune_mounts needs private or slave propagation")
+
         if self.users_map:
             _users_map = []
             for _map in self.users_map:
                 inter_id, outer_id, _range = _covert_map_to_tuple(_map, 'user')
                 _users_map.append('%d %d %d' % (inter_id, outer_id, _range))
 
-            for _map in _users_map:
-                if not _accetable_user_map(_map):
-                    raise NamespaceRequireSuperuserPrivilege()
-            self.users_map = _users_map
+            for _map in _users_map:
+                if not _accetable_user_map(_map):
+                    raise NamespaceRequireSuperuserPrivilege()
+            self.users_map = _users_map
+
+        if self.groups_map:
+            _groups_map = []
+            for _map in self.groups_map:
+                inter_id, outer_id, _range = _covert_map_to_tuple(
+                    _map, 'group')
+                _groups_map.append('%d %d %d' % (inter_id, outer_id, _range))
+
+            for _map in _groups_map:
+                if not _accetable_group_map(_map):
+                    raise NamespaceRequireSuperuserPrivilege()
+            self.groups_map = _groups_map
+
+        if self.maproot:
+            if not self.users_map:
+                self.users_map = ['0 %d 1' % os.geteuid()]
+            if not self.groups_map:
+                self.groups_map = ['0 %d 1' % os.getegid()]
+
+    def need_super_privilege(self):
+        require_root_privilege = False
+        if not user_namespace_available():
+            require_root_privilege = True
+        if self.namespaces and "user" not in self.namespaces:
+            require_root_privilege = True
+        if self.ns_bind_dir:
+            require_root_privilege = True
+        if require_root_privilege:
+            euid = os.geteuid()
+            require_root_privilege = (euid != 0)
+        return require_root_privilege
+
+    def default_null_handler(self, *args, **kwargs):
+        pass
+
+    def default_bottom_halves_before_fork(self, *args, **kwargs):
+        with self.phase("unshare"):
+            unshare(self.namespaces)
+
+    def default_bottom_halves_before_sync(self, *args, **kwargs):
+        table = None
+        if self.prune_mounts:
+            with self.phase("read_mountinfo"):
+                table = MountTable.read()
+        if "mount" in self.namespaces and self.propagation is not None:
+            with self.phase("set_propagation"):
+                workbench.set_propagation(self.propagation)
+        if self.prune_mounts:
+            with self.phase("prune_mounts"):
+                workbench.prune_mounts(self._prune_mounts_keep(table),
+                                           table=table)
+        if self.mounts is not None and self.rootfs is None:
+            with self.phase("mounts"):
+                self.mounts.apply()
+        if self.mountproc and self.rootfs is None:
+            with self.phase("mount_proc"):
+                workbench._mount_proc(mountpoint=self.mountpoint)
+        if self.cgroupfs and self.rootfs is None:
+            self._mount_cgroupfs()
+
+    def _prune_mounts_keep(self, table=None):
+        """
+        pruning comes before the mount plan is applied, so the sources of
+        its bind mounts are kept, and the mounts under the sources of the
+        recursive ones.
+        """
+        if self.prune_mounts is True:
+            keep = list(_PRUNE_MOUNTS_KEEP)
+        else:
+            keep = list(self.prune_mounts)
+        if self.mountproc:
+            keep.append(self.mountpoint)
+        store = getattr(self.rootfs, "store", None)
+        if store is not None:
+            keep.append(store.path)
+        if hasattr(self.mounts, "sources"):
+            for source, recursive in self.mounts.sources():
+                source = os.path.realpath(source)
+                keep.append(source)
+                if recursive and table is not None:
+                    prefix = source.rstrip("/") + "/"
+                    keep.extend([mount.mount_point for mount in table
+                                     if mount.mount_point.startswith(prefix)])
+        return keep
+
+    def _clone_mount_trees(self):
+        """
+        prepared mount trees could only be cloned in the mount namespace
+        they come from, and attached in the same user namespace.
+        """
+        if self.mounts is not None and "user" not in self.namespaces:
+            if hasattr(self.mounts, "clone_ahead"):
+                self.mounts.clone_ahead()
+
+    def _release_mount_trees(self):
+        if self.mounts is not None and hasattr(self.mounts, "release"):
+            self.mounts.release()
+
+    def _create_cgroup(self):
+        """
+        the leaf is created by the caller before the children are, each
+        copy of instance() gets its own.
+        """
+        if self.cgroup_root is None or self.cgroup_leaf is not None:
+            return
+        with self.phase("cgroup"):
+            self.cgroup_leaf = self.cgroup_root.create_leaf(limits=self.limits)
+
+    def _cgroup_dir(self):
+        if self.cgroup_leaf is not None:
+            return self.cgroup_leaf.path
+        return self.cgroup
+
+    def _enter_cgroup(self):
+        """
+        the fork engine has no CLONE_INTO_CGROUP, the bottom halves moves
+        itself into the cgroup before it creates the namespaces.
+        """
+        path = self._cgroup_dir()
+        if path is not None:
+            Cgroup(path).add()
+
+    def release_cgroup(self):
+        """
+        remove the leaf once the sandbox has been reaped, a leaf that
+        still has processes is left as it is.
+        """
+        if self.cgroup_leaf is not None and self.cgroup_leaf.remove():
+            self.cgroup_leaf = None
+
+    def _release_cgroup_when_empty(self):
+        """
+        nobody reaps a sandbox of batch mode, so a detached watcher, that
+        is not in the leaf, removes the leaf once it has no processes.
+        """
+        leaf = self.cgroup_leaf
+        if leaf is None:
+            return
+        pid = _fork()
+        if pid == 0:
+            try:
+                os.setsid()
+                if _fork() == 0:
+                    workbench.close_fds(lowest_fd=0)
+                    leaf.wait_event("populated", "0")
+                    leaf.remove()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.cgroup_leaf = None
+
+    def _mount_cgroupfs(self):
+        """
+        a cgroup namespace is rooted at the cgroup its creator is in, the
+        clone engine puts the child into its leaf after its namespaces are
+        created, so the cgroup namespace is created once more here, then
+        the cgroupfs only shows the subtree of the sandbox.
+        """
+        with self.phase("mount_cgroupfs"):
+            unshare(["cgroup"])
+            workbench.mount(source="cgroup2", target=self.cgroupfs,
+                            filesystemtype="cgroup2", mount_type="mount_proc")
+
+    def _setup_rootfs(self):
+        """
+        the rootfs is set up after the sync, the uid/gid maps have been
+        written then, so the sandbox could create the overlayfs dirs.
+        The mounts and procfs are done in the new root before the old one
+        is detached, the kernel does not allow a new procfs in a user
+        namespace that could not see one, and the bind sources are gone
+        with the old root.
+        """
+        mountpoint = None
+        if self.mountproc:
+            mountpoint = self.mountpoint
+        with self.phase("rootfs"):
+            self.rootfs.setup(mountproc=mountpoint, mounts=self.mounts)
+        if self.cgroupfs:
+            self._mount_cgroupfs()
+
+    def default_bottom_halves_after_sync(self, *args, **kwargs):
+        if self.rootfs is not None:
+            self._setup_rootfs()
+        if self.func is None:
+            if not self.nscmd:
+                self.nscmd = [find_shell()]
+            elif not isinstance(self.nscmd, list):
+                self.nscmd = [self.nscmd]
+            # my_init is a file of the old root, it is gone after a rootfs
+            # is pivoted to, so nscmd is the first process of the rootfs
+            if "pid" not in self.namespaces:
+                args = self.nscmd
+            elif self.init_prog is not None:
+                args = [self.init_prog] + self.nscmd
+            elif self.rootfs is not None:
+                args = self.nscmd
+            else:
+                args = [sys.executable, self.my_init, "--skip-startup-files",
+                        "--skip-runit", "--quiet", "--"] + self.nscmd
+            if self._trace_fd is not None:
+                self.record_phase("exec", _monotonic())
+                self._send_timings(self._trace_fd)
+            os.execlp(args[0], *args)
+        else:
+            if self._trace_fd is not None:
+                self._send_timings(self._trace_fd)
+                os.close(self._trace_fd)
+                self._trace_fd = None
+            if hasattr(self.func, '__call__'):
+                self.func(*args, **kwargs)
+            else:
+                raise NamespaceSettingError()
+
+    def _default_top_halves_before_sync(self, *args, **kwargs):
+        if self.setgroups == "allow" and self.maproot:
+            raise NamespaceSettingError()
+
+    def _default_top_halves_half_sync(self, *args, **kwargs):
+        if "user" in self.namespaces:
+            with self.phase("id_maps"):
+                workbench.setgroups_control(self.setgroups,
+                                                self.bottom_halves_child_pid)
+                if self.id_maps is None:
+                    self.id_maps = _format_uid_and_gid_map(
+                        self.maproot, self.users_map, self.groups_map)
+                _write_uid_and_gid_map_str(self.id_maps[0], self.id_maps[1],
+                                               self.bottom_halves_child_pid)
+
+        if self.ns_bind_dir is not None and "mount" in self.namespaces:
+            with self.phase("bind_ns_files"):
+                workbench.bind_ns_files(self.bottom_halves_child_pid,
+                                            self.namespaces, self.ns_bind_dir)
+
+
+class SandboxHandle(object):
+    """
+    a sandbox tracked by a pidfd, so that signals never hit a recycled pid.
+    pid should be a child of ours, status and rusage are the ones
+    os.wait4() returns.
+    """
+    def __init__(self, pid, pidfd=None, config=None, error=None):
+        self.pid = pid
+        self.config = config
+        self.error = error
+        if pidfd is None and pid is not None:
+            try:
+                pidfd = workbench.pidfd_open(pid)
+            except (CFunctionNotFound, CFunctionCallFailed, OSError):
+                pidfd = None
+        self.pidfd = pidfd
+        self.status = None
+        self.rusage = None
+        self.frozen_since = None
+
+    def fileno(self):
+        return self.pidfd
+
+    @property
+    def cgroup(self):
+        """
+        the Cgroup of the sandbox, or None if it has no cgroup.
+        """
+        if self.config is None:
+            return None
+        path = self.config._cgroup_dir()
+        if path is None:
+            return None
+        return Cgroup(path)
+
+    def _require_cgroup(self):
+        cgroup = self.cgroup
+        if cgroup is None:
+            raise NamespaceSettingError("sandbox has no cgroup")
+        return cgroup
+
+    def freeze(self, timeout=None):
+        """
+        freeze the sandbox by cgroup.freeze, return whether it is frozen
+        in timeout seconds, timeout 0 does not wait.
+        """
+        if self.status is not None:
+            return False
+        frozen = self._require_cgroup().freeze(timeout)
+        if self.frozen_since is None:
+            self.frozen_since = time.time()
+        return frozen
+
+    def thaw(self):
+        if self.status is not None:
+            return
+        self._require_cgroup().thaw()
+        self.frozen_since = None
+
+    @property
+    def exit_code(self):
+        if self.status is None:
+            return None
+        return _exit_code_from_status(self.status)
+
+    def send_signal(self, signum):
+        if self.status is not None or self.pid is None:
+            return
+        if self.pidfd is None:
+            os.kill(self.pid, signum)
+        else:
+            workbench.pidfd_send_signal(self.pidfd, signum)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def signal_init(self, signum):
+        """
+        signal the first process of the sandbox, the init of its pid
+        namespace. Of the fork engine it is a child of the bottom halves,
+        it is signaled by a pidfd, the signal never hits a recycled pid.
+        """
+        pid = None
+        if self.config is not None:
+            pid = self.config.bottom_halves_child_pid
+        if pid is None or pid == self.pid:
+            self.send_signal(signum)
+            return
+        if self.status is not None:
+            return
+        try:
+            pidfd = workbench.pidfd_open(pid)
+        except CFunctionNotFound:
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+            return
+        except (CFunctionCallFailed, OSError) as e:
+            if e.errno != errno.ESRCH:
+                raise
+            return
+        try:
+            workbench.pidfd_send_signal(pidfd, signum)
+        except (CFunctionCallFailed, OSError) as e:
+            if e.errno != errno.ESRCH:
+                raise
+        finally:
+            os.close(pidfd)
+
+    def kill_all(self):
+        """
+        kill every process of the sandbox at once, by cgroup.kill if it
+        has a leaf of its own, otherwise by SIGKILL to the init of its pid
+        namespace, the kernel kills all the others of the namespace then.
+        A cgroup given by cgroup= may be shared, it is not killed.
+        """
+        if self.status is not None:
+            return
+        cgroup = None
+        if self.config is not None:
+            cgroup = self.config.cgroup_leaf
+        if cgroup is not None:
+            try:
+                cgroup.write("cgroup.kill", 1)
+            except (IOError, OSError) as e:
+                # cgroup.kill is new in linux 5.14
+                if e.errno != errno.ENOENT:
+                    raise
+            else:
+                return
+        self.signal_init(signal.SIGKILL)
+        self.kill()
+
+    def terminate(self, grace=5.0, timeout=5.0):
+        """
+        SIGTERM the sandbox, kill all of it if it is still running after
+        grace seconds, and wait at most timeout seconds more. Return the
+        status, or None if it has not exited.
+        """
+        terminate_sandboxes([self], grace, timeout)
+        return self.status
+
+    def _wait4(self, options):
+        if self.status is not None or self.pid is None:
+            return self.status
+        try:
+            pid, status, rusage = os.wait4(self.pid, options)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+            pid, status, rusage = self.pid, -1, None
+        if pid == 0:
+            return None
+        self.status = status
+        self.rusage = rusage
+        self.close()
+        if self.config is not None:
+            self.config.release_cgroup()
+        return status
+
+    def poll(self):
+        return self._wait4(os.WNOHANG)
+
+    def wait(self):
+        return self._wait4(0)
+
+    def close(self):
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+
+
+class SandboxSupervisor(object):
+    """
+    wait for many sandboxes by one epoll instance. E.g.,
+
+        supervisor = SandboxSupervisor()
+        for i in range(100):
+            supervisor.add(spawn_sandbox(nscmd=["true"]))
+        for handle in supervisor.wait_all():
+            print(handle.pid, handle.exit_code, handle.rusage.ru_maxrss)
+
+    Handles without a pidfd are polled.
+    """
+    def __init__(self, poll_interval=0.05):
+        self.epoll = select.epoll()
+        self.handles = {}
+        self.polled_handles = []
+        self.poll_interval = poll_interval
+
+    def add(self, handle):
+        if handle.pidfd is None:
+            self.polled_handles.append(handle)
+        else:
+            self.handles[handle.pidfd] = handle
+            self.epoll.register(handle.pidfd, select.EPOLLIN)
+        return handle
+
+    def __len__(self):
+        return len(self.handles) + len(self.polled_handles)
+
+    def poll(self, timeout=None):
+        """
+        wait at most timeout seconds, return the handles that exited, each
+        one has been reaped and has its status and rusage.
+        """
+        if not self:
+            return []
+        if timeout is None:
+            timeout = -1
+        if self.polled_handles and (timeout < 0
+                                        or timeout > self.poll_interval):
+            timeout = self.poll_interval
+
+        finished = []
+        events = []
+        if self.handles:
+            events = self.epoll.poll(timeout, len(self.handles))
+        elif timeout > 0:
+            time.sleep(timeout)
+        for fd, event in events:
+            handle = self.handles.pop(fd)
+            self.epoll.unregister(fd)
+            handle.wait()
+            finished.append(handle)
+        for handle in self.polled_handles[:]:
+            if handle.poll() is not None:
+                self.polled_handles.remove(handle)
+                finished.append(handle)
+        return finished
+
+    def wait_all(self, timeout=None):
+        """
+        yield the handles as they exit, until all are done or timeout.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while self:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+            for handle in self.poll(remaining):
+                yield handle
+
+    def close(self):
+        for handle in list(self.handles.values()):
+            self.epoll.unregister(handle.pidfd)
+        self.handles = {}
+        self.polled_handles = []
+        self.epoll.close()
+
+
+def terminate_sandboxes(handles, grace=5.0, timeout=5.0):
+    """
+    terminate many sandboxes in parallel. All of them get SIGTERM at
+    once, the ones still running after grace seconds are killed at once,
+    by cgroup.kill or by their pid namespace inits, then they are waited
+    for at most timeout seconds. The whole call takes at most grace plus
+    timeout seconds, however many sandboxes there are. Return the handles
+    that have not exited.
+    """
+    deadline = time.time() + (grace or 0) + timeout
+    handles = [handle for handle in handles if handle.status is None]
+    supervisor = SandboxSupervisor()
+    try:
+        for handle in handles:
+            supervisor.add(handle)
+        if grace:
+            for handle in handles:
+                handle.signal_init(signal.SIGTERM)
+            for handle in supervisor.wait_all(grace):
+                pass
+        running = [handle for handle in handles if handle.status is None]
+        for handle in running:
+            handle.kill_all()
+        for handle in supervisor.wait_all(max(deadline - time.time(), 0)):
+            pass
+    finally:
+        supervisor.close()
+
+    # the sandbox of the fork engine may die after its bottom halves, only
+    # our own leaves are waited for, a cgroup= may be shared
+    for handle in handles:
+        leaf = None
+        if handle.config is not None:
+            leaf = handle.config.cgroup_leaf
+        if handle.status is None or leaf is None:
+            continue
+        remaining = max(deadline - time.time(), 0)
+        if leaf.wait_event("populated", "0", remaining):
+            handle.config.release_cgroup()
+    return [handle for handle in handles if handle.status is None]
+
+
+def _process_start_time(pid):
+    fo = open("/proc/%d/stat" % pid, 'r')
+    try:
+        stat = fo.read()
+    finally:
+        fo.close()
+    return int(stat[stat.rindex(")") + 2:].split()[19])
+
+
+def _pidfd_exited(pidfd):
+    poller = select.poll()
+    poller.register(pidfd, select.POLLIN)
+    return bool(poller.poll(0))
+
+
+def _process_alive(pid, pidfd, start_time):
+    """
+    whether pid is still the process that pidfd or start_time was taken
+    from.
+    """
+    if pidfd is not None:
+        return not _pidfd_exited(pidfd)
+    try:
+        return _process_start_time(pid) == start_time
+    except (IOError, OSError, ValueError):
+        return False
+
+
+class NamespaceHandle(object):
+    """
+    an open nsfs file of a namespace. identity is (st_dev, st_ino) of the
+    file, two handles with the same identity refer to the same namespace.
+    The handles opened by pid keep a pidfd of the pid, or its start time
+    if pidfds are unavailable, so that valid() could tell whether the pid
+    exited or was reused. process=(pidfd, start_time) shares them with
+    other handles of the pid, then close() leaves the pidfd open.
+    """
+    def __init__(self, fd, namespace, pid=None, pidfd=None, start_time=None,
+                     path=None, owns_pidfd=True):
+        self.fd = fd
+        self.namespace = namespace
+        self.pid = pid
+        self.pidfd = pidfd
+        self.start_time = start_time
+        self.path = path
+        self.owns_pidfd = owns_pidfd
+        stat = os.fstat(fd)
+        self.identity = (stat.st_dev, stat.st_ino)
+
+    @classmethod
+    def open(cls, namespace, pid=None, path=None, process=None):
+        ns_obj = workbench.get_namespace(namespace)
+        if path is None:
+            if pid is None:
+                pid = os.getpid()
+            path = "/proc/%d/ns/%s" % (pid, ns_obj.entry)
+        else:
+            pid = None
+
+        pidfd = None
+        start_time = None
+        if pid is not None and process is not None:
+            pidfd, start_time = process
+        elif pid is not None:
+            try:
+                pidfd = workbench.pidfd_open(pid)
+            except (CFunctionNotFound, CFunctionCallFailed, OSError) as e:
+                if getattr(e, "errno", None) == errno.ESRCH:
+                    raise OSError(errno.ESRCH, "%d exited" % pid)
+                start_time = _process_start_time(pid)
+
+        owns_pidfd = process is None
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+        except OSError:
+            if pidfd is not None and owns_pidfd:
+                os.close(pidfd)
+            raise
+        handle = cls(fd, namespace, pid, pidfd, start_time, path, owns_pidfd)
+        if pid is not None and not handle.valid():
+            handle.close()
+            raise OSError(errno.ESRCH, "%d exited" % pid)
+        return handle
+
+    def fileno(self):
+        return self.fd
+
+    def valid(self):
+        """
+        whether the handle is open and its pid, if any, is still the
+        process that the handle was opened for.
+        """
+        if self.fd is None:
+            return False
+        if self.pid is None:
+            return True
+        return _process_alive(self.pid, self.pidfd, self.start_time)
+
+    def current(self):
+        """
+        valid(), and the pid is still in this namespace, as it may have
+        called unshare(2) or setns(2) since the handle was opened.
+        """
+        if self.fd is None or self.pid is None:
+            return self.valid()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        # the pid is checked after the stat, so the stat was of it
+        return (stat.st_dev, stat.st_ino) == self.identity and self.valid()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        if self.pidfd is not None and self.owns_pidfd:
+            os.close(self.pidfd)
+        self.fd = None
+        self.pidfd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return "<NamespaceHandle %s pid=%s identity=%s>" % (
+            self.namespace, self.pid, self.identity)
+
+
+class NamespaceHandleCache(object):
+    """
+    a LRU cache of the NamespaceHandles of pids. A handle is reopened if
+    its pid exited or is in another namespace now, the evicted ones are
+    closed, so callers should not keep or close handles that they get
+    from the cache. The handles of a pid share one pidfd, and the cache
+    holds at most max_fds descriptors, the pidfds included.
+    """
+    def __init__(self, max_fds=None):
+        if max_fds is None:
+            max_fds = _NAMESPACE_HANDLES_MAX_FDS
+        self.max_fds = max_fds
+        self.handles = OrderedDict()
+        # pid -> [pidfd, start_time, count of its handles]
+        self.processes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fds(self):
+        return len(self.handles) + len(
+            [p for p in self.processes.values() if p[0] is not None])
+
+    def _close(self, handle):
+        handle.close()
+        process = self.processes[handle.pid]
+        process[2] -= 1
+        if process[2] == 0:
+            del self.processes[handle.pid]
+            if process[0] is not None:
+                os.close(process[0])
+
+    def _open(self, namespace, pid):
+        process = self.processes.get(pid)
+        if process is not None and not _process_alive(pid, *process[:2]):
+            # pid was reused, the handles of the old process are stale
+            for key in [key for key in self.handles if key[0] == pid]:
+                self._close(self.handles.pop(key))
+            process = None
+        if process is None:
+            handle = NamespaceHandle.open(namespace, pid=pid)
+            handle.owns_pidfd = False
+            process = [handle.pidfd, handle.start_time, 0]
+            self.processes[pid] = process
+        else:
+            handle = NamespaceHandle.open(namespace, pid=pid,
+                                              process=process[:2])
+        process[2] += 1
+        return handle
+
+    def get(self, namespace, pid):
+        key = (pid, namespace)
+        self.lock.acquire()
+        try:
+            handle = self.handles.pop(key, None)
+            if handle is not None:
+                if handle.current():
+                    self.hits += 1
+                    self.handles[key] = handle
+                    return handle
+                self._close(handle)
+            self.misses += 1
+            handle = self._open(namespace, pid)
+            self.handles[key] = handle
+            while self.fds() > self.max_fds and len(self.handles) > 1:
+                self._close(self.handles.popitem(last=False)[1])
+            return handle
+        finally:
+            self.lock.release()
+
+    def invalidate(self, pid=None):
+        """
+        close the handles of pid, or all handles if pid is None.
+        """
+        self.lock.acquire()
+        try:
+            for key in list(self.handles.keys()):
+                if pid is None or key[0] == pid:
+                    self._close(self.handles.pop(key))
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.invalidate()
+
+    def __len__(self):
+        return len(self.handles)
+
+
+class PooledSandbox(object):
+    """
+    a sandbox that has been set up by SandboxPool and now is parked at
+    the bottom_halves_after_sync point, waiting for a nscmd or a func.
+    """
+    def __init__(self, config, control_fd):
+        self.config = config
+        self.control_fd = control_fd
+        self.created = time.time()
+        self.top_halves_child_pid = config.top_halves_child_pid
+        self.bottom_halves_child_pid = config.bottom_halves_child_pid
+        self.status = None
+
+    def alive(self):
+        if self.status is not None:
+            return False
+        try:
+            pid, status = os.waitpid(self.top_halves_child_pid, os.WNOHANG)
+        except OSError:
+            self.status = -1
+            return False
+        if pid == 0:
+            return True
+        self.status = status
+        self.config.release_cgroup()
+        return False
+
+    def expired(self, max_age=None):
+        if max_age is None:
+            return False
+        return time.time() - self.created > max_age
+
+    def _send(self, request):
+        if self.control_fd is None:
+            raise RuntimeError("sandbox has been used or discarded")
+        fo = os.fdopen(self.control_fd, 'wb')
+        self.control_fd = None
+        try:
+            pickle.dump(request, fo)
+        finally:
+            fo.close()
+
+    def run(self, nscmd=None, func=None, args=None, kwargs=None):
+        if nscmd is not None and func is not None:
+            raise NamespaceSettingError()
+        if func is not None and not hasattr(func, '__call__'):
+            raise NamespaceSettingError('handler must be a callable')
+        self._send({"nscmd": nscmd, "func": func,
+                        "args": args or (), "kwargs": kwargs or {}})
+
+    def discard(self):
+        if self.control_fd is not None:
+            try:
+                self._send(None)
+            except (OSError, IOError):
+                pass
+        return self.wait()
 
-        if self.groups_map:
-            _groups_map = []
-            for _map in self.groups_map:
-                inter_id, outer_id, _range = _covert_map_to_tuple(
-                    _map, 'group')
-                _groups_map.append('%d %d %d' % (inter_id, outer_id, _range))
+    def wait(self):
+        if self.status is None:
+            try:
+                self.status = os.waitpid(self.top_halves_child_pid, 0)[1]
+            except OSError:
+                self.status = -1
+            self.config.release_cgroup()
+        return self.status
 
-            for _map in _groups_map:
-                if not _accetable_group_map(_map):
-                    raise NamespaceRequireSuperuserPrivilege()
-            self.groups_map = _groups_map
 
-        if self.maproot:
-            if not self.users_map:
-                self.users_map = ['0 %d 1' % os.geteuid()]
-            if not self.groups_map:
-                self.groups_map = ['0 %d 1' % os.getegid()]
+class SandboxPool(object):
+    """
+    keep some sandboxes set up and parked, so that spawning a sandbox
+    does not pay for parse_conf, forks, unshare, uid/gid maps writing
+    and procfs mounting. E.g.,
+
+        pool = SandboxPool(high_watermark=8, low_watermark=2,
+                               namespaces=["pid", "mount", "user"])
+        pool.start()
+        sandbox = pool.spawn(nscmd=["hostname"])
+        sandbox.wait()
+        pool.close()
+
+    Other keyword arguments are passed to SpawnNamespacesConfig. The
+    sandboxes always run in interactive mode, because batch mode closes
+    the control pipes and leaves no process to wait for.
+    """
+    def __init__(self, high_watermark=4, low_watermark=None, max_age=None,
+                     refill_interval=1.0, **kwargs):
+        if low_watermark is None:
+            low_watermark = high_watermark // 2
+        if high_watermark < 1 or not 0 <= low_watermark <= high_watermark:
+            raise NamespaceSettingError('bad pool watermarks')
+        for key in ["func", "nscmd", "interactive"]:
+            if kwargs.get(key) is not None:
+                raise NamespaceSettingError(
+                    "'%s' cannot be set for pooled sandboxes" % key)
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.max_age = max_age
+        self.refill_interval = refill_interval
+        self.config_kwargs = kwargs
+        self.sandboxes = []
+        self._cond = threading.Condition()
+        self._spawn_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def _control_fds(self):
+        return [sandbox.control_fd for sandbox in self.sandboxes
+                    if sandbox.control_fd is not None]
+
+    def _park(self, config, r, *args, **kwargs):
+        fo = os.fdopen(r, 'rb')
+        try:
+            request = pickle.load(fo)
+        except EOFError:
+            request = None
+        fo.close()
+        if request is None:
+            sys.exit(0)
+        config.nscmd = request["nscmd"]
+        config.func = request["func"]
+        config.default_bottom_halves_after_sync(*request["args"],
+                                                     **request["kwargs"])
 
-    def need_super_privilege(self):
-        require_root_privilege = False
-        if not user_namespace_available():
-            require_root_privilege = True
-        if self.namespaces and "user" not in self.namespaces:
-            require_root_privilege = True
-        if self.ns_bind_dir:
-            require_root_privilege = True
-        if require_root_privilege:
-            euid = os.geteuid()
-            require_root_privilege = (euid != 0)
-        return require_root_privilege
+    def _spawn_one(self):
+        config = SpawnNamespacesConfig(interactive=True, **self.config_kwargs)
+        r, w = os.pipe()
+        inherited_fds = self._control_fds() + [w]
 
-    def default_null_handler(self, *args, **kwargs):
-        pass
+        before_sync = config.bottom_halves_before_sync
 
-    def default_bottom_halves_before_fork(self, *args, **kwargs):
-        unshare(self.namespaces)
+        def bottom_halves_before_fork(*args, **kwargs):
+            for fd in inherited_fds:
+                os.close(fd)
+            config.default_bottom_halves_before_fork(*args, **kwargs)
 
-    def default_bottom_halves_before_sync(self, *args, **kwargs):
-        if "mount" in self.namespaces and self.propagation is not None:
-            workbench.set_propagation(self.propagation)
-        if self.mountproc:
-            workbench._mount_proc(mountpoint=self.mountpoint)
+        def bottom_halves_before_sync(*args, **kwargs):
+            for fd in inherited_fds:
+                os.close(fd)
+            before_sync(*args, **kwargs)
 
-    def default_bottom_halves_after_sync(self, *args, **kwargs):
-        if self.func is None:
-            if not self.nscmd:
-                self.nscmd = [find_shell()]
-            elif not isinstance(self.nscmd, list):
-                self.nscmd = [self.nscmd]
-            if "pid" not in self.namespaces:
-                args = self.nscmd
-            elif self.init_prog is not None:
-                args = [self.init_prog] + self.nscmd
-            else:
-                args = [sys.executable, self.my_init, "--skip-startup-files",
-                        "--skip-runit", "--quiet"] + self.nscmd
-            os.execlp(args[0], *args)
+        def bottom_halves_entry_point(*args, **kwargs):
+            config.default_bottom_halves_entry_point(*args, **kwargs)
+            sys.exit(_exit_code_from_status(
+                config.bottom_halves_child_status))
+
+        # the clone engine has no before_fork hook, its child closes the
+        # descriptors before the sync instead
+        if config.engine == "clone":
+            config.bottom_halves_before_sync = bottom_halves_before_sync
         else:
-            if hasattr(self.func, '__call__'):
-                self.func(*args, **kwargs)
-            else:
-                raise NamespaceSettingError()
+            config.bottom_halves_before_fork = bottom_halves_before_fork
+        config.bottom_halves_entry_point = (
+            lambda *args, **kwargs: _exit_forked_child(
+                bottom_halves_entry_point, *args, **kwargs))
+        config.bottom_halves_after_sync = (
+            lambda *args, **kwargs: self._park(config, r, *args, **kwargs))
+        config.top_halves_entry_point = config.top_halves_sync
+        try:
+            config.entry_point()
+        except BaseException:
+            os.close(w)
+            raise
+        finally:
+            os.close(r)
+            if config.pidfd is not None:
+                os.close(config.pidfd)
+                config.pidfd = None
+        return PooledSandbox(config, w)
+
+    def fill(self, count=None):
+        """
+        spawn sandboxes until the pool reaches the high watermark, or
+        count sandboxes are spawned.
+        """
+        with self._spawn_lock:
+            with self._cond:
+                missing = self.high_watermark - len(self.sandboxes)
+            if count is not None:
+                missing = min(missing, count)
+            for i in range(missing):
+                if self._closed:
+                    break
+                sandbox = self._spawn_one()
+                with self._cond:
+                    self.sandboxes.append(sandbox)
+                    self._cond.notify_all()
+
+    def prune(self):
+        """
+        discard the sandboxes that are dead or older than max_age.
+        """
+        with self._cond:
+            stale = [sandbox for sandbox in self.sandboxes
+                         if sandbox.expired(self.max_age)
+                         or not sandbox.alive()]
+            for sandbox in stale:
+                self.sandboxes.remove(sandbox)
+        for sandbox in stale:
+            sandbox.discard()
+        return len(stale)
+
+    def _refill_loop(self):
+        while not self._closed:
+            self.prune()
+            with self._cond:
+                need_refill = len(self.sandboxes) < self.low_watermark
+            if need_refill:
+                self.fill()
+            with self._cond:
+                if self._closed:
+                    break
+                if len(self.sandboxes) >= self.low_watermark:
+                    self._cond.wait(self.refill_interval)
+
+    def start(self):
+        """
+        fill the pool and start refilling it in the background.
+        """
+        self.fill()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refill_loop)
+            self._thread.daemon = True
+            self._thread.start()
 
-    def _default_top_halves_before_sync(self, *args, **kwargs):
-        if self.setgroups == "allow" and self.maproot:
-            raise NamespaceSettingError()
+    def acquire(self):
+        """
+        return a parked sandbox, spawn one if the pool is empty.
+        """
+        if self._closed:
+            raise RuntimeError("sandbox pool has been closed")
+        sandbox = None
+        stale = []
+        with self._cond:
+            while self.sandboxes:
+                candidate = self.sandboxes.pop(0)
+                if candidate.expired(self.max_age) or not candidate.alive():
+                    stale.append(candidate)
+                    continue
+                sandbox = candidate
+                break
+            self._cond.notify_all()
+        # discarding kills and waits, do not block the pool meanwhile
+        for candidate in stale:
+            candidate.discard()
+        if sandbox is None:
+            with self._spawn_lock:
+                sandbox = self._spawn_one()
+        return sandbox
+
+    def spawn(self, nscmd=None, func=None, args=None, kwargs=None):
+        sandbox = self.acquire()
+        sandbox.run(nscmd=nscmd, func=func, args=args, kwargs=kwargs)
+        return sandbox
+
+    def __len__(self):
+        with self._cond:
+            return len(self.sandboxes)
+
+    def close(self):
+        self._closed = True
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._spawn_lock:
+            with self._cond:
+                sandboxes = self.sandboxes
+                self.sandboxes = []
+        for sandbox in sandboxes:
+            sandbox.discard()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _audit(event, *args):
+    """
+    raise an audit event by sys.audit(), and call the hooks added by
+    add_audit_hook(), python older than 3.8 has no sys.audit().
+    """
+    if hasattr(sys, "audit"):
+        sys.audit(event, *args)
+    for hook in _AUDIT_HOOKS:
+        hook(event, args)
 
-    def _default_top_halves_half_sync(self, *args, **kwargs):
-        if "user" in self.namespaces:
-            workbench.setgroups_control(self.setgroups,
-                                            self.bottom_halves_child_pid)
-            _write_to_uid_and_gid_map(
-                self.maproot, self.users_map,
-                self.groups_map, self.bottom_halves_child_pid)
 
-        if self.ns_bind_dir is not None and "mount" in self.namespaces:
-            workbench.bind_ns_files(self.bottom_halves_child_pid,
-                                        self.namespaces, self.ns_bind_dir)
+def _ctypes_value(arg):
+    return getattr(arg, "value", arg)
+
+
+class CFunctionStats(object):
+    """
+    counters of a C function: calls, failures by errno, and a latency
+    histogram, histogram[i] counts the calls that took less than 2**i
+    microseconds, the last bucket counts all slower calls.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.failures = {}
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * _STATS_BUCKETS
+
+    def add(self, elapsed, _errno=None):
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if _errno is not None:
+            self.failures[_errno] = self.failures.get(_errno, 0) + 1
+        bucket = 0
+        if elapsed > 0:
+            bucket = max(0, math.frexp(elapsed * 1e6)[1])
+        self.histogram[min(bucket, _STATS_BUCKETS - 1)] += 1
+
+    def as_dict(self):
+        failures = {}
+        for _errno, count in self.failures.items():
+            failures[errno.errorcode.get(_errno, "%d" % _errno)] = count
+        return {"calls": self.calls, "failures": failures,
+                "total_time": self.total_time, "max_time": self.max_time,
+                "histogram": [[2 ** idx, count]
+                                  for idx, count in enumerate(self.histogram)
+                                  if count]}
+
+
+class _WorkbenchStats(object):
+    def __init__(self, syscalls, audit):
+        self.counters = {}
+        self.audit = audit
+        self.lock = threading.Lock()
+        self.syscall_names = {}
+        for name, nr in syscalls.items():
+            if isinstance(nr, int):
+                self.syscall_names[nr] = name
+
+    def add(self, name, elapsed, _errno=None):
+        self.lock.acquire()
+        try:
+            if name not in self.counters:
+                self.counters[name] = CFunctionStats(name)
+            self.counters[name].add(elapsed, _errno)
+        finally:
+            self.lock.release()
+
+    def syscall_name(self, nr):
+        nr = _ctypes_value(nr)
+        return self.syscall_names.get(nr, "syscall_%s" % nr)
 
 
 class CFunction(object):
@@ -788,6 +2594,80 @@ class CFunction(object):
                 self.func = func
                 break
 
+        if argtypes is None:
+            self.string_args = None
+        else:
+            self.string_args = tuple(
+                [idx for idx, argtype in enumerate(argtypes)
+                     if argtype in (c_char_p, c_void_p)])
+
+    def make_wrapper(self):
+        """
+        return a wrapper that converts the string arguments to bytes, calls
+        the C function and raises an exception by the errno of this thread
+        if the call failed.
+        """
+        c_func = self.func
+        failed = self.failed
+        string_args = self.string_args
+
+        def c_func_wrapper(*args):
+            if string_args is None:
+                args = [to_bytes(arg) if is_string_or_unicode(arg) else arg
+                            for arg in args]
+            elif string_args:
+                args = list(args)
+                for idx in string_args:
+                    if idx < len(args) and is_string_or_unicode(args[idx]):
+                        args[idx] = to_bytes(args[idx])
+            res = c_func(*args)
+            if failed(res):
+                _errno = get_errno()
+                if _errno == EPERM:
+                    raise NamespaceRequireSuperuserPrivilege()
+                else:
+                    raise CFunctionCallFailed(os.strerror(_errno),
+                                                  errno=_errno)
+            return res
+
+        c_func_wrapper.__name__ = "_c_func_%s" % self.exported_name
+        return c_func_wrapper
+
+    def make_instrumented_wrapper(self, stats):
+        """
+        the same as make_wrapper(), but it counts the calls in stats and
+        raises an audit event "procszoo.<name>" before each call, the
+        calls of syscall are named by the syscall.
+        """
+        c_func_wrapper = self.make_wrapper()
+        exported_name = self.exported_name
+        timer = getattr(time, "perf_counter", _monotonic)
+
+        def instrumented_wrapper(*args):
+            name = exported_name
+            if name == "syscall" and args:
+                name = stats.syscall_name(args[0])
+                event_args = args[1:]
+            else:
+                event_args = args
+            if stats.audit:
+                _audit("procszoo.%s" % name,
+                           *[_ctypes_value(arg) for arg in event_args])
+            started = timer()
+            try:
+                res = c_func_wrapper(*args)
+            except NamespaceRequireSuperuserPrivilege:
+                stats.add(name, timer() - started, EPERM)
+                raise
+            except CFunctionCallFailed as e:
+                stats.add(name, timer() - started, e.errno)
+                raise
+            stats.add(name, timer() - started)
+            return res
+
+        instrumented_wrapper.__name__ = c_func_wrapper.__name__
+        return instrumented_wrapper
+
 class Workbench(object):
     """
     class used as a singleton.
@@ -799,6 +2679,11 @@ class Workbench(object):
         self.namespaces = Namespaces()
         self._init_c_functions()
         self._namespaces_available_status_checked = False
+        self._stats = None
+        if os.environ.get(_STATS_ENV):
+            self.enable_stats()
+        self.namespace_handles = NamespaceHandleCache()
+        self._mount_api_available = None
 
     def _init_c_functions(self):
         exported_name = "unshare"
@@ -830,9 +2715,28 @@ class Workbench(object):
             extra["pivot_root"] = NR_PIVOT_ROOT
         if SYSCALL_SETNS_AVAILABLE:
             extra["setns"] = NR_SETNS
+        if SYSCALL_CLOSE_RANGE_AVAILABLE:
+            extra["close_range"] = NR_CLOSE_RANGE
+        if SYSCALL_PIDFD_OPEN_AVAILABLE:
+            extra["pidfd_open"] = NR_PIDFD_OPEN
+        if SYSCALL_PIDFD_SEND_SIGNAL_AVAILABLE:
+            extra["pidfd_send_signal"] = NR_PIDFD_SEND_SIGNAL
+        if SYSCALL_OPEN_TREE_AVAILABLE:
+            extra["open_tree"] = NR_OPEN_TREE
+        if SYSCALL_MOVE_MOUNT_AVAILABLE:
+            extra["move_mount"] = NR_MOVE_MOUNT
+        if SYSCALL_FSOPEN_AVAILABLE:
+            extra["fsopen"] = NR_FSOPEN
+        if SYSCALL_FSCONFIG_AVAILABLE:
+            extra["fsconfig"] = NR_FSCONFIG
+        if SYSCALL_FSMOUNT_AVAILABLE:
+            extra["fsmount"] = NR_FSMOUNT
+        if SYSCALL_MOUNT_SETATTR_AVAILABLE:
+            extra["mount_setattr"] = NR_MOUNT_SETATTR
 
         self.functions[exported_name] = CFunction(
-            exported_name=exported_name, extra=extra)
+            exported_name=exported_name, extra=extra, restype=c_long,
+            failed=lambda res: res == -1)
 
         exported_name = "mount"
         self.functions[exported_name] = CFunction(
@@ -847,8 +2751,10 @@ class Workbench(object):
                     "data": None,},
 
                 "flag": {
-                    "MS_NOSUID": 2, "MS_NODEV": 4,
-                    "MS_NOEXEC": 8, "MS_REC": 16384,
+                    "MS_RDONLY": 1, "MS_NOSUID": 2, "MS_NODEV": 4,
+                    "MS_NOEXEC": 8, "MS_REMOUNT": 32, "MS_NOSYMFOLLOW": 256,
+                    "MS_NOATIME": 1024, "MS_NODIRATIME": 2048,
+                    "MS_REC": 16384,
                     "MS_PRIVATE": 1 << 18,
                     "MS_SLAVE": 1 << 19,
                     "MS_SHARED": 1 << 20,
@@ -951,6 +2857,58 @@ class Workbench(object):
                 self.available_c_functions.append(func_name)
         self.available_c_functions.sort()
 
+        for func_name, func_obj in self.functions.items():
+            if func_obj.func is not None:
+                setattr(self, "_c_func_%s" % func_name,
+                            func_obj.make_wrapper())
+
+    def enable_stats(self, audit=True):
+        """
+        count the calls, the failures by errno and the latency of every
+        C function, see get_stats(). If audit is true, an audit event
+        "procszoo.<name>" with the arguments is raised before each call.
+        The PROCSZOO_STATS environment variable enables it at import.
+        """
+        if self._stats is not None:
+            self._stats.audit = audit
+            return
+        self._stats = _WorkbenchStats(self.functions["syscall"].extra, audit)
+        for func_name, func_obj in self.functions.items():
+            if func_obj.func is not None:
+                setattr(self, "_c_func_%s" % func_name,
+                            func_obj.make_instrumented_wrapper(self._stats))
+
+    def disable_stats(self):
+        if self._stats is None:
+            return
+        self._stats = None
+        for func_name, func_obj in self.functions.items():
+            if func_obj.func is not None:
+                setattr(self, "_c_func_%s" % func_name,
+                            func_obj.make_wrapper())
+
+    def get_stats(self):
+        """
+        return {name: counters} as dicts, see CFunctionStats.
+        """
+        if self._stats is None:
+            return {}
+        self._stats.lock.acquire()
+        try:
+            return dict([(name, counters.as_dict()) for name, counters
+                             in self._stats.counters.items()])
+        finally:
+            self._stats.lock.release()
+
+    def reset_stats(self):
+        if self._stats is None:
+            return
+        self._stats.lock.acquire()
+        try:
+            self._stats.counters = {}
+        finally:
+            self._stats.lock.release()
+
     def _syscall_nr(self, syscall_name):
         func_obj = self.functions["syscall"]
         if syscall_name in func_obj.extra:
@@ -959,33 +2917,14 @@ class Workbench(object):
             raise CFunctionUnknowSyscall()
 
     def __getattr__(self, name):
+        """
+        the wrappers of available C functions are bound in _init_c_functions,
+        so we only get here for missing ones.
+        """
         if name.startswith("_c_func_"):
-            c_func_name = name.replace("_c_func_", "")
-            if c_func_name not in self.available_c_functions:
-                if c_func_name != 'syscall':
-                    raise CFunctionNotFound(c_func_name)
-            func_obj = self.functions[c_func_name]
-            c_func = func_obj.func
-            context = locals()
-            def c_func_wrapper(*args, **context):
-                tmp_args = []
-                for arg in args:
-                    if is_string_or_unicode(arg):
-                        tmp_args.append(to_bytes(arg))
-                    else:
-                        tmp_args.append(arg)
-                res = c_func(*tmp_args)
-                c_int_errno = c_int.in_dll(pythonapi, "errno")
-                if func_obj.failed(res):
-                    if c_int_errno.value == EPERM:
-                        raise NamespaceRequireSuperuserPrivilege()
-                    else:
-                        raise CFunctionCallFailed(os.strerror(c_int_errno.value))
-                return res
-
-            return c_func_wrapper
+            raise CFunctionNotFound(name.replace("_c_func_", ""))
         else:
-            raise AttributeError("'CFunction' object has no attribute '%s'"
+            raise AttributeError("'Workbench' object has no attribute '%s'"
                                      % name)
 
     def get_available_propagations(self):
@@ -1044,6 +2983,37 @@ class Workbench(object):
 
         return self._c_func_setresgid(rgid, egid, sgid)
 
+    def pidfd_open(self, pid, flags=0):
+        try:
+            os.pidfd_open
+        except AttributeError:
+            pass
+        else:
+            return os.pidfd_open(pid, flags)
+
+        try:
+            NR_PIDFD_OPEN = self._syscall_nr("pidfd_open")
+        except CFunctionUnknowSyscall:
+            raise CFunctionNotFound("pidfd_open")
+        return self._c_func_syscall(c_long(NR_PIDFD_OPEN), c_int(pid),
+                                        c_uint(flags))
+
+    def pidfd_send_signal(self, pidfd, signum, flags=0):
+        try:
+            signal.pidfd_send_signal
+        except AttributeError:
+            pass
+        else:
+            return signal.pidfd_send_signal(pidfd, signum, None, flags)
+
+        try:
+            NR_PIDFD_SEND_SIGNAL = self._syscall_nr("pidfd_send_signal")
+        except CFunctionUnknowSyscall:
+            raise CFunctionNotFound("pidfd_send_signal")
+        return self._c_func_syscall(c_long(NR_PIDFD_SEND_SIGNAL),
+                                        c_int(pidfd), c_int(signum),
+                                        c_void_p(None), c_uint(flags))
+
     def atfork(self, prepare=None, parent=None, child=None):
         """
         This function will let us to insert our codes before and after fork
@@ -1072,11 +3042,21 @@ class Workbench(object):
     def check_namespaces_available_status(self):
         """
         On rhel6/7, the kernel default does not enable all namespaces
-        that it supports.
+        that it supports. The result is cached on disk by the kernel release
+        and boot_id, so that new processes do not probe again.
         """
         if self._namespaces_available_status_checked:
             return
 
+        identity = _kernel_identity()
+        if identity is not None:
+            identity["namespaces"] = self.namespaces.namespaces
+        status = _load_cache(_NAMESPACES_STATUS_CACHE, identity)
+        if status is not None:
+            self._apply_namespaces_available_status(
+                [ns for ns in status if status[ns]])
+            return
+
         unshare = self.functions["unshare"].func
 
         r, w = os.pipe()
@@ -1092,9 +3072,8 @@ class Workbench(object):
                     ns_obj = self.get_namespace(ns)
                     val = ns_obj.value
                     res = unshare(c_int(val))
-                    _errno_c_int = c_int.in_dll(pythonapi, "errno")
                     if res == -1:
-                        if _errno_c_int.value != EINVAL:
+                        if get_errno() != EINVAL:
                             keys.append(ns)
                     else:
                         keys.append(ns)
@@ -1112,12 +3091,18 @@ class Workbench(object):
             keys = pickle.load(tmpfile)
             tmpfile.close()
 
-            for ns_name in self.namespaces.namespaces:
-                if ns_name not in keys:
-                    ns_obj = self.get_namespace(ns_name)
-                    ns_obj.available = False
+            self._apply_namespaces_available_status(keys)
+            _save_cache(_NAMESPACES_STATUS_CACHE, identity,
+                            dict([(ns, ns in keys)
+                                      for ns in self.namespaces.namespaces]))
+
+    def _apply_namespaces_available_status(self, keys):
+        for ns_name in self.namespaces.namespaces:
+            if ns_name not in keys:
+                ns_obj = self.get_namespace(ns_name)
+                ns_obj.available = False
 
-            self._namespaces_available_status_checked = True
+        self._namespaces_available_status_checked = True
 
     def show_available_c_functions(self):
         return self.available_c_functions
@@ -1210,7 +3195,234 @@ class Workbench(object):
         val = flag[behaviors[behavior]]
         self._c_func_umount2(mountpoint, c_int(val))
 
-    def set_propagation(self, type=None):
+    def prune_mounts(self, keep=None, table=None):
+        """
+        lazily detach the mounts of the current mount namespace, except
+        the mounts that the paths in keep are on, and the mounts they are
+        on in turn. Return the detached mount points. The mounts should
+        not be shared, or the umounts propagate out of the namespace.
+        """
+        if keep is None:
+            keep = _PRUNE_MOUNTS_KEEP
+        if table is None:
+            table = MountTable.read()
+
+        kept = set()
+        for path in keep:
+            mounts = table.by_point.get(os.path.normpath(path))
+            if not mounts:
+                mounts = [table.find(path)]
+            for mount in mounts:
+                while mount is not None and mount.mount_id not in kept:
+                    kept.add(mount.mount_id)
+                    mount = mount.parent
+
+        flag = self.functions["umount2"].extra["flag"]["MNT_DETACH"]
+        mountpoints = []
+        for mount in table:
+            if mount.mount_id in kept or mount.parent is None:
+                continue
+            if mount.parent.mount_id not in kept:
+                # it is detached with its parent
+                continue
+            try:
+                self._c_func_umount2(mount.mount_point, c_int(flag))
+            except CFunctionCallFailed:
+                # covered by another mount, it could not be reached
+                continue
+            mountpoints.append(mount.mount_point)
+        return mountpoints
+
+    def umount_tree(self, mountpoint, behavior=None, table=None):
+        """
+        unmount the mounts at mountpoint and under it, children first, and
+        return their mount points. table is a MountTable of the current
+        mount namespace, it is read if it is not given.
+        """
+        func_obj = self.functions["umount2"]
+        flags = 0
+        if behavior is not None:
+            behaviors = func_obj.extra["behaviors"]
+            if behavior not in behaviors:
+                raise RuntimeError("behavior should be one of [%s]"
+                                   % ", ".join(behaviors.keys()))
+            flags = func_obj.extra["flag"][behaviors[behavior]]
+        if table is None:
+            table = MountTable.read()
+
+        mountpoints = []
+        for mount in table.umount_order(mountpoint):
+            self._c_func_umount2(mount.mount_point, c_int(flags))
+            mountpoints.append(mount.mount_point)
+        return mountpoints
+
+    def _mount_api_syscall(self, name, *args):
+        try:
+            NR = self._syscall_nr(name)
+        except CFunctionUnknowSyscall:
+            raise CFunctionNotFound(name)
+        return self._c_func_syscall(c_long(NR), *args)
+
+    def mount_api_available(self):
+        """
+        whether the kernel has fsopen(2) and friends, it is probed once.
+        """
+        if self._mount_api_available is None:
+            try:
+                os.close(self.fsopen("tmpfs"))
+            except CFunctionNotFound:
+                self._mount_api_available = False
+            except NamespaceRequireSuperuserPrivilege:
+                self._mount_api_available = True
+            except CFunctionCallFailed as e:
+                self._mount_api_available = e.errno != errno.ENOSYS
+            else:
+                self._mount_api_available = True
+        return self._mount_api_available
+
+    def open_tree(self, path="", flags=None, dirfd=None):
+        """
+        return a descriptor of the mount at path. By default it is a
+        detached recursive copy of the mount, that could be attached
+        by move_mount().
+        """
+        if flags is None:
+            flags = _OPEN_TREE_CLONE | _AT_RECURSIVE | os.O_CLOEXEC
+        if dirfd is None:
+            dirfd = _AT_FDCWD
+        elif not path:
+            flags |= _AT_EMPTY_PATH
+        return self._mount_api_syscall("open_tree", c_int(dirfd),
+                                           c_char_p(to_bytes(path)),
+                                           c_uint(flags))
+
+    def move_mount(self, from_fd, to_path, to_dirfd=None, from_path="",
+                       flags=None):
+        """
+        attach the mount of from_fd to to_path, to_path is relative to
+        to_dirfd if it is given.
+        """
+        if flags is None:
+            flags = 0
+            if not from_path:
+                flags |= _MOVE_MOUNT_F_EMPTY_PATH
+        if to_dirfd is None:
+            to_dirfd = _AT_FDCWD
+        return self._mount_api_syscall("move_mount", c_int(from_fd),
+                                           c_char_p(to_bytes(from_path)),
+                                           c_int(to_dirfd),
+                                           c_char_p(to_bytes(to_path)),
+                                           c_uint(flags))
+
+    def fsopen(self, filesystemtype, flags=_FSOPEN_CLOEXEC):
+        return self._mount_api_syscall("fsopen",
+                                           c_char_p(to_bytes(filesystemtype)),
+                                           c_uint(flags))
+
+    def fsconfig(self, fs_fd, key=None, value=None, cmd=None):
+        """
+        set a parameter of the filesystem context fs_fd, a flag if value
+        is None, else a string. fsconfig(fs_fd) creates the superblock.
+        """
+        if cmd is None:
+            if key is None:
+                cmd = _FSCONFIG_CMD_CREATE
+            elif value is None:
+                cmd = _FSCONFIG_SET_FLAG
+            else:
+                cmd = _FSCONFIG_SET_STRING
+        if key is not None:
+            key = to_bytes(key)
+        if value is not None:
+            value = to_bytes("%s" % value)
+        return self._mount_api_syscall("fsconfig", c_int(fs_fd), c_uint(cmd),
+                                           c_char_p(key), c_char_p(value),
+                                           c_int(0))
+
+    def fsmount(self, fs_fd, attrs=None, flags=_FSMOUNT_CLOEXEC):
+        """
+        return a descriptor of a detached mount of fs_fd, attrs is a list
+        of names in _MOUNT_ATTRS, e.g., ["nosuid", "nodev"].
+        """
+        return self._mount_api_syscall("fsmount", c_int(fs_fd),
+                                           c_uint(flags),
+                                           c_uint(_mount_attrs(attrs)))
+
+    def mount_setattr(self, fd, attrs=None, clear_attrs=None,
+                          propagation=None, recursive=True, path=""):
+        """
+        change the attributes and the propagation type of the mount fd,
+        propagation is one of "private", "slave" and "shared".
+        """
+        attr = _MountAttr()
+        attr.attr_set = _mount_attrs(attrs)
+        attr.attr_clr = _mount_attrs(clear_attrs)
+        if propagation is not None:
+            flag = self.functions["mount"].extra["flag"]
+            attr.propagation = flag["MS_%s" % propagation.upper()]
+        flags = 0
+        if not path:
+            flags |= _AT_EMPTY_PATH
+        if recursive:
+            flags |= _AT_RECURSIVE
+        return self._mount_api_syscall("mount_setattr", c_int(fd),
+                                           c_char_p(to_bytes(path)),
+                                           c_uint(flags), byref(attr),
+                                           c_size_t(sizeof(attr)))
+
+    def close_fds(self, keep_fds=None, cloexec=False, lowest_fd=3):
+        """
+        close all descriptors from lowest_fd except keep_fds, or only mark
+        them close-on-exec if cloexec is true. Use close_range(2) if the
+        kernel supports it, else walk /proc/self/fd.
+        """
+        keep_fds = sorted(set([fd for fd in keep_fds or []
+                                   if fd >= lowest_fd]))
+        try:
+            self._close_fds_by_range(keep_fds, cloexec, lowest_fd)
+        except (CFunctionNotFound, CFunctionCallFailed):
+            self._close_fds_by_walk(keep_fds, cloexec, lowest_fd)
+
+    def _close_fds_by_range(self, keep_fds, cloexec, lowest_fd):
+        NR_CLOSE_RANGE = self._syscall_nr("close_range")
+        flags = 0
+        if cloexec:
+            flags = _CLOSE_RANGE_CLOEXEC
+        ranges = []
+        first = lowest_fd
+        for fd in keep_fds:
+            if fd > first:
+                ranges.append((first, fd - 1))
+            first = fd + 1
+        ranges.append((first, _MAX_FD))
+        for first, last in ranges:
+            self._c_func_syscall(c_long(NR_CLOSE_RANGE), c_uint(first),
+                                     c_uint(last), c_uint(flags))
+
+    def _close_fds_by_walk(self, keep_fds, cloexec, lowest_fd):
+        try:
+            fds = [int(fd) for fd in os.listdir("/proc/self/fd")]
+        except OSError:
+            fds = range(lowest_fd,
+                            resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+        for fd in fds:
+            if fd < lowest_fd or fd in keep_fds:
+                continue
+            try:
+                if cloexec:
+                    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+                    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+                else:
+                    os.close(fd)
+            except (OSError, IOError):
+                pass
+
+    def set_propagation(self, type=None, table=None):
+        """
+        change the propagation type of all mounts. If a MountTable of the
+        current mount namespace is given, and the mounts have had the
+        type, the remount is skipped.
+        """
         if type is None:
             return
         mount_func_obj = self.functions["mount"]
@@ -1219,11 +3431,13 @@ class Workbench(object):
             raise RuntimeError("%s: unknown propagation type" % type)
         if type == "unchanged":
             return
+        if table is not None and table.all_propagation(type):
+            return
         self.mount(source="none", target="/", mount_type=type)
 
-    def unshare(self, namespaces=None):
+    def namespaces_to_flags(self, namespaces=None):
         if namespaces is None:
-            return
+            return 0
 
         target_flags = []
         for ns_name in namespaces:
@@ -1231,23 +3445,46 @@ class Workbench(object):
             if ns_obj.available:
                 target_flags.append(ns_obj.value)
 
-        flags = reduce(lambda res, flag: res | flag, target_flags, 0)
-        self._c_func_unshare(flags)
+        return reduce(lambda res, flag: res | flag, target_flags, 0)
+
+    def unshare(self, namespaces=None):
+        if namespaces is None:
+            return
+
+        self._c_func_unshare(self.namespaces_to_flags(namespaces))
+
+    def open_namespace(self, namespace, pid=None, path=None):
+        """
+        return a NamespaceHandle of the namespace of pid, or of a nsfs
+        file. Handles of pids come from workbench.namespace_handles and
+        belong to it, others should be closed by the caller.
+        """
+        if is_string_or_unicode(namespace) and (
+                namespace in self.namespaces.namespaces):
+            pass
+        else:
+            raise UnknownNamespaceFound([namespace])
+        if path is None:
+            if pid is None:
+                pid = os.getpid()
+            return self.namespace_handles.get(namespace, pid)
+        return NamespaceHandle.open(namespace, path=path)
 
     def setns(self, **kwargs):
         """
         workbench.setns(path=path2ns, namespace=namespace)
 
-        E.g., setns(pid=1234, namespace="pid")
+        E.g., setns(pid=1234, namespace="pid"), or setns(handle=handle),
+        the handles that setns(pid=...) opens are cached, see
+        open_namespace().
         """
-        keys = ["fd", "path", "pid", "file_obj"]
+        keys = ["fd", "path", "pid", "file_obj", "handle"]
         wrong_keys = [k for k in keys if k in kwargs.keys()]
         if len(wrong_keys) != 1:
             raise TypeError("complicating named argument found: %s"
                             % ", ".join(wrong_keys))
 
-        _kwargs = deepcopy(kwargs)
-        namespace = 0
+        namespace = None
         if  "namespace" in kwargs:
             ns = kwargs["namespace"]
             if is_string_or_unicode(ns) and ns in self.namespaces.namespaces:
@@ -1255,57 +3492,161 @@ class Workbench(object):
             else:
                 raise UnknownNamespaceFound([ns])
 
-        _kwargs["namespace"] = namespace.value
-
-        if "fd" in kwargs:
+        fo = None
+        if "handle" in kwargs:
+            handle = kwargs["handle"]
+            if not isinstance(handle, NamespaceHandle):
+                raise TypeError("unavailable namespace handle found")
+            if namespace is None:
+                namespace = self.get_namespace(handle.namespace)
+            elif namespace.name != handle.namespace:
+                raise TypeError("complicating handle and namespace args found")
+            fd = handle.fileno()
+        elif "fd" in kwargs:
             fd = kwargs["fd"]
             if not isinstance(fd, int):
                 raise TypeError("unavailable file descriptor found")
         elif "path" in kwargs:
             path = os.path.abspath(kwargs["path"])
             entry = os.path.basename(path)
-            if "namespace" in kwargs:
-                ns = kwargs["namespace"]
-                ns_obj = self.get_namespace(ns)
-                ns_obj_entry = ns_obj.entry
-                if entry != ns_obj_entry:
-                    raise TypeError("complicating path and namespace args found")
+            if namespace is not None and entry != namespace.entry:
+                raise TypeError("complicating path and namespace args found")
             if not os.path.exists(path):
                 raise TypeError("%s not existed" % path)
-
             fo = open(path, 'r')
-            _kwargs["file_obj"] = fo
-            _kwargs["fd"] = fo.fileno()
-            _kwargs["path"] = path
+            fd = fo.fileno()
         elif "pid" in kwargs:
             pid = kwargs["pid"]
-            if namespace == 0:
+            if namespace is None:
                 raise TypeError("pid named argument need a namespace")
             if not isinstance(pid, int):
                 raise TypeError("unknown pid found")
-            ns = kwargs["namespace"]
-            ns_obj = self.get_namespace(ns)
-            entry = ns_obj.entry
-            path = "/proc/%d/ns/%s" % (pid, entry)
-            if os.path.exists(path):
-                fo = open(path, 'r')
-                _kwargs["file_obj"] = fo
-                _kwargs["fd"] = fo.fileno()
+            fd = self.namespace_handles.get(namespace.name, pid).fileno()
         elif "file_obj" in kwargs:
-            fo = kwargs["file_obj"]
-            _kwargs["fd"] = fo.fileno()
+            fd = kwargs["file_obj"].fileno()
+
+        flags = 0
+        if namespace is not None:
+            flags = namespace.value
+        try:
+            return self._setns(fd, flags)
+        finally:
+            if fo is not None:
+                fo.close()
+
+    def enter(self, target, namespaces=None):
+        """
+        join the namespaces of target, that is a pid, a SandboxHandle, or
+        a NamespaceHandle or a list of them, and return the names of the
+        namespaces joined. The namespaces that we are in already are
+        skipped. E.g.,
+
+            enter(1234, namespaces=["net", "uts"])
 
-        flags = c_int(_kwargs["namespace"])
-        fd = c_int(_kwargs["fd"])
+        A pid is entered by one setns(2) call on a pidfd with all the
+        CLONE_NEW* flags, so either all namespaces are joined or none.
+        Kernels older than 5.8 do not support it, then the namespaces
+        files are opened first and joined one by one, user first.
+        """
+        if isinstance(target, NamespaceHandle):
+            target = [target]
+        if isinstance(target, list):
+            handles = [handle for handle in target
+                           if namespaces is None
+                           or handle.namespace in namespaces]
+            return self._enter_handles(handles)
+
+        if isinstance(target, SandboxHandle):
+            pid = target.pid
+            if target.config is not None and (
+                    target.config.bottom_halves_child_pid is not None):
+                pid = target.config.bottom_halves_child_pid
+        elif isinstance(target, int):
+            pid = target
+        else:
+            raise TypeError("unknown target found")
+
+        if namespaces is None:
+            namespaces = [ns for ns, available in self.show_namespaces_status()
+                              if available]
+        unknown_namespaces = [ns for ns in namespaces
+                                  if ns not in self.namespaces.namespaces]
+        if unknown_namespaces:
+            raise UnknownNamespaceFound(namespaces=unknown_namespaces)
+
+        pending = []
+        for ns in _ENTER_ORDER:
+            if ns not in namespaces:
+                continue
+            entry = self.get_namespace(ns).entry
+            try:
+                theirs = os.stat("/proc/%d/ns/%s" % (pid, entry))
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    raise OSError(errno.ESRCH, "%d exited" % pid)
+                raise
+            try:
+                ours = os.stat("/proc/self/ns/%s" % entry)
+            except OSError:
+                pending.append(ns)
+                continue
+            if (theirs.st_dev, theirs.st_ino) != (ours.st_dev, ours.st_ino):
+                pending.append(ns)
+        if not pending:
+            return []
+
+        pidfd = None
+        try:
+            pidfd = self.pidfd_open(pid)
+        except (CFunctionNotFound, CFunctionCallFailed, OSError) as e:
+            if getattr(e, "errno", None) == errno.ESRCH:
+                raise OSError(errno.ESRCH, "%d exited" % pid)
+        if pidfd is not None:
+            try:
+                self._setns(pidfd, self.namespaces_to_flags(pending))
+                return pending
+            except CFunctionCallFailed as e:
+                if e.errno != errno.EINVAL:
+                    raise
+            finally:
+                os.close(pidfd)
+
+        handles = [self.namespace_handles.get(ns, pid) for ns in pending]
+        return self._enter_handles(handles)
+
+    def _enter_handles(self, handles):
+        order = dict([(ns, idx) for idx, ns in enumerate(_ENTER_ORDER)])
+        handles = sorted(handles, key=lambda handle: order[handle.namespace])
+        for handle in handles:
+            if not handle.valid():
+                raise OSError(errno.ESRCH, "%s is stale" % handle)
+        pending = []
+        for handle in handles:
+            entry = self.get_namespace(handle.namespace).entry
+            try:
+                ours = os.stat("/proc/self/ns/%s" % entry)
+            except OSError:
+                pending.append(handle)
+                continue
+            if (ours.st_dev, ours.st_ino) != handle.identity:
+                pending.append(handle)
+        handles = pending
+        for handle in handles:
+            self._setns(handle.fileno(),
+                            self.get_namespace(handle.namespace).value)
+        return [handle.namespace for handle in handles]
+
+    def _setns(self, fd, flags):
         if self.functions["setns"].func is None:
             try:
                 NR_SETNS = self._syscall_nr("setns")
             except CFunctionUnknowSyscall as e:
                 raise CFunctionNotFound()
             else:
-                return self._c_func_syscall(c_long(NR_SETNS), fd, flags)
+                return self._c_func_syscall(c_long(NR_SETNS), c_int(fd),
+                                                c_int(flags))
         else:
-            return self._c_func_setns(fd, flags)
+            return self._c_func_setns(c_int(fd), c_int(flags))
 
     def gethostname(self):
         buf_len = _HOST_NAME_MAX
@@ -1354,7 +3695,8 @@ class Workbench(object):
             raise CFunctionNotFound()
         else:
             return self._c_func_syscall(c_long(NR_PIVOT_ROOT),
-                                            new_root, put_old)
+                                            c_char_p(to_bytes(new_root)),
+                                            c_char_p(to_bytes(put_old)))
 
     def adjust_namespaces(self, namespaces=None, negative_namespaces=None):
         self.check_namespaces_available_status()
@@ -1453,21 +3795,30 @@ class Workbench(object):
             mountpoint=None, ns_bind_dir=None, nscmd=None,
             propagation=None, negative_namespaces=None,
             setgroups=None, users_map=None, groups_map=None,
-            init_prog=None, func=None, interactive=None):
+            init_prog=None, func=None, interactive=None, engine=None,
+            rootfs=None, mounts=None, prune_mounts=None, cgroup=None,
+            limits=None, cgroup_root=None, cgroupfs=None, timing=None,
+            keep_fds=None, cloexec_fds=None):
         """
         workbench.spawn_namespace(namespaces=["pid", "net", "mount"])
         """
         SpawnNamespacesConfig(
             namespaces, maproot, mountproc, mountpoint, ns_bind_dir, nscmd,
             propagation, negative_namespaces,setgroups, users_map, groups_map,
-            init_prog, func, interactive=interactive).entry_point()
+            init_prog, func, interactive=interactive,
+            engine=engine, rootfs=rootfs, mounts=mounts,
+            prune_mounts=prune_mounts, cgroup=cgroup, limits=limits,
+            cgroup_root=cgroup_root, cgroupfs=cgroupfs, timing=timing,
+            keep_fds=keep_fds, cloexec_fds=cloexec_fds).entry_point()
 
 
 class CFunctionBaseException(Exception):
     pass
 
 class CFunctionCallFailed(CFunctionBaseException):
-    pass
+    def __init__(self, *args, **kwargs):
+        self.errno = kwargs.pop("errno", None)
+        CFunctionBaseException.__init__(self, *args)
 
 class CFunctionNotFound(CFunctionBaseException):
     pass
@@ -1516,21 +3867,75 @@ def mount(source=None, target=None, mount_type=None,
 def umount(mountpoint=None):
     return workbench.umount(mountpoint)
 
+def close_fds(keep_fds=None, cloexec=False):
+    return workbench.close_fds(keep_fds, cloexec)
+
+def pidfd_open(pid, flags=0):
+    return workbench.pidfd_open(pid, flags)
+
+def enable_stats(audit=True):
+    return workbench.enable_stats(audit)
+
+def disable_stats():
+    return workbench.disable_stats()
+
+def get_stats():
+    return workbench.get_stats()
+
+def reset_stats():
+    return workbench.reset_stats()
+
+def add_audit_hook(hook):
+    """
+    hook(event, args) is called for each audit event of procszoo, like
+    the hooks of sys.addaudithook(), but only for procszoo events.
+    """
+    _AUDIT_HOOKS.append(hook)
+
+def remove_audit_hook(hook):
+    if hook in _AUDIT_HOOKS:
+        _AUDIT_HOOKS.remove(hook)
+
+def pidfd_send_signal(pidfd, signum, flags=0):
+    return workbench.pidfd_send_signal(pidfd, signum, flags)
+
 def umount2(mountpoint=None, behavior=None):
     return workbench.umount2(mountpoint, behavior)
 
 def unshare(namespaces=None):
     return workbench.unshare(namespaces)
 
+def prune_mounts(keep=None, table=None):
+    return workbench.prune_mounts(keep, table)
+
+def umount_tree(mountpoint, behavior=None, table=None):
+    return workbench.umount_tree(mountpoint, behavior, table)
+
+def mount_api_available():
+    return workbench.mount_api_available()
+
+def open_tree(path="", flags=None, dirfd=None):
+    return workbench.open_tree(path, flags, dirfd)
+
+def move_mount(from_fd, to_path, to_dirfd=None, from_path="", flags=None):
+    return workbench.move_mount(from_fd, to_path, to_dirfd, from_path, flags)
+
 def setns(**kwargs):
     """
     setns(fd, namespace)
     setns(path, namespace)
     setns(pid, namespace)
     setns(file_obj, namespace)
+    setns(handle)
     """
     return workbench.setns(**kwargs)
 
+def open_namespace(namespace, pid=None, path=None):
+    return workbench.open_namespace(namespace, pid, path)
+
+def enter(target, namespaces=None):
+    return workbench.enter(target, namespaces)
+
 def gethostname():
     return workbench.gethostname()
 
@@ -1553,13 +3958,130 @@ def spawn_namespaces(namespaces=None, maproot=True, mountproc=True,
                          mountpoint="/proc", ns_bind_dir=None, nscmd=None,
                          propagation=None, negative_namespaces=None,
                          setgroups=None, users_map=None, groups_map=None,
-                         init_prog=None, func=None, interactive=None):
+                         init_prog=None, func=None, interactive=None,
+                         engine=None, rootfs=None, mounts=None,
+                         prune_mounts=None, cgroup=None, limits=None,
+                         cgroup_root=None, cgroupfs=None, timing=None,
+                         keep_fds=None, cloexec_fds=None):
     return workbench.spawn_namespaces(
         namespaces=namespaces, maproot=maproot, mountproc=mountproc,
         mountpoint=mountpoint, ns_bind_dir=ns_bind_dir, nscmd=nscmd,
         propagation=propagation, negative_namespaces=negative_namespaces,
         setgroups=setgroups, users_map=users_map, groups_map=groups_map,
-        init_prog=init_prog, func=func, interactive=interactive)
+        init_prog=init_prog, func=func, interactive=interactive,
+        engine=engine, rootfs=rootfs, mounts=mounts,
+        prune_mounts=prune_mounts, cgroup=cgroup, limits=limits,
+        cgroup_root=cgroup_root, cgroupfs=cgroupfs, timing=timing,
+        keep_fds=keep_fds, cloexec_fds=cloexec_fds)
+
+def spawn_sandbox(**kwargs):
+    """
+    spawn_sandbox(**kwargs) takes SpawnNamespacesConfig arguments, and
+    returns a SandboxHandle instead of waiting for the sandbox.
+    """
+    return SpawnNamespacesConfig(**kwargs).start()
+
+def _close_quietly(fds):
+    for fd in fds:
+        if fd is None:
+            continue
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def _abort_children(children, config):
+    """
+    kill and reap children of start_children() that are not synced yet.
+    """
+    pid = children[0]
+    _close_quietly(children[1:])
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        pass
+    try:
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+    config.release_cgroup()
+
+
+def spawn_many(config, count, per_instance_overrides=None,
+                   max_parallel=None):
+    """
+    spawn count sandboxes from one config, that is checked only once.
+    config is a SpawnNamespacesConfig or a dict of its arguments,
+    per_instance_overrides is a list of dicts, one for each sandbox,
+    see SpawnNamespacesConfig.instance(). At most max_parallel sandboxes
+    are in the middle of spawning at the same time.
+
+    Return a list of SandboxHandles in order. If a sandbox failed to
+    spawn, its handle has the exception in handle.error.
+    """
+    if isinstance(config, dict):
+        config = SpawnNamespacesConfig(**config)
+    if not config.interactive:
+        raise NamespaceSettingError("batch mode exits the caller")
+    if max_parallel is None:
+        max_parallel = _SPAWN_MANY_PARALLEL
+    if max_parallel < 1:
+        raise NamespaceSettingError("max_parallel should be positive")
+    if per_instance_overrides is None:
+        per_instance_overrides = []
+    if len(per_instance_overrides) > count:
+        raise NamespaceSettingError("more overrides than sandboxes")
+    config.prepare()
+
+    handles = [None] * count
+    pending = {}
+    poller = select.poll()
+    idx = 0
+    try:
+        while idx < count or pending:
+            while idx < count and len(pending) < max_parallel:
+                overrides = {}
+                if idx < len(per_instance_overrides):
+                    overrides = per_instance_overrides[idx] or {}
+                instance = config.instance(**overrides)
+                try:
+                    children = instance.start_children()
+                except (OSError, CFunctionCallFailed,
+                            NamespaceRequireSuperuserPrivilege) as e:
+                    handles[idx] = SandboxHandle(None, config=instance,
+                                                     error=e)
+                else:
+                    pending[children[2]] = (idx, instance, children)
+                    poller.register(children[2], select.POLLIN)
+                idx += 1
+            if not pending:
+                continue
+
+            try:
+                events = poller.poll()
+            except (select.error, OSError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                i, instance, children = pending.pop(fd)
+                poller.unregister(fd)
+                try:
+                    handles[i] = instance.finish_start(children)
+                except Exception as e:
+                    pid = children[0]
+                    _close_quietly(children[1:])
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                    handles[i] = SandboxHandle(pid, config=instance, error=e)
+    finally:
+        # only left when an unexpected exception escapes
+        for i, instance, children in pending.values():
+            _abort_children(children, instance)
+    return handles
 
 def check_namespaces_available_status():
     return workbench.check_namespaces_available_status()
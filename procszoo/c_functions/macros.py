@@ -0,0 +1,109 @@
+NR_PIVOT_ROOT = "155"
+NR_SETNS = "308"
+NR_CLONE3 = "435"
+NR_CLOSE_RANGE = "436"
+NR_PIDFD_OPEN = "434"
+NR_PIDFD_SEND_SIGNAL = "424"
+NR_OPEN_TREE = "428"
+NR_MOVE_MOUNT = "429"
+NR_FSOPEN = "430"
+NR_FSCONFIG = "431"
+NR_FSMOUNT = "432"
+NR_MOUNT_SETATTR = "442"
+EINVAL = "22"
+EPERM = "1"
+
+SYSCALL_PIVOT_ROOT_AVAILABLE = True
+SYSCALL_SETNS_AVAILABLE = True
+SYSCALL_CLONE3_AVAILABLE = True
+SYSCALL_CLOSE_RANGE_AVAILABLE = True
+SYSCALL_PIDFD_OPEN_AVAILABLE = True
+SYSCALL_PIDFD_SEND_SIGNAL_AVAILABLE = True
+SYSCALL_OPEN_TREE_AVAILABLE = True
+SYSCALL_MOVE_MOUNT_AVAILABLE = True
+SYSCALL_FSOPEN_AVAILABLE = True
+SYSCALL_FSCONFIG_AVAILABLE = True
+SYSCALL_FSMOUNT_AVAILABLE = True
+SYSCALL_MOUNT_SETATTR_AVAILABLE = True
+
+try:
+    NR_PIVOT_ROOT = int(NR_PIVOT_ROOT)
+except ValueError:
+    SYSCALL_PIVOT_ROOT_AVAILABLE = False
+
+try:
+    NR_SETNS = int(NR_SETNS)
+except ValueError:
+    SYSCALL_SETNS_AVAILABLE = False
+
+try:
+    NR_CLONE3 = int(NR_CLONE3)
+except ValueError:
+    SYSCALL_CLONE3_AVAILABLE = False
+
+try:
+    NR_CLOSE_RANGE = int(NR_CLOSE_RANGE)
+except ValueError:
+    SYSCALL_CLOSE_RANGE_AVAILABLE = False
+
+try:
+    NR_PIDFD_OPEN = int(NR_PIDFD_OPEN)
+except ValueError:
+    SYSCALL_PIDFD_OPEN_AVAILABLE = False
+
+try:
+    NR_PIDFD_SEND_SIGNAL = int(NR_PIDFD_SEND_SIGNAL)
+except ValueError:
+    SYSCALL_PIDFD_SEND_SIGNAL_AVAILABLE = False
+
+try:
+    NR_OPEN_TREE = int(NR_OPEN_TREE)
+except ValueError:
+    SYSCALL_OPEN_TREE_AVAILABLE = False
+
+try:
+    NR_MOVE_MOUNT = int(NR_MOVE_MOUNT)
+except ValueError:
+    SYSCALL_MOVE_MOUNT_AVAILABLE = False
+
+try:
+    NR_FSOPEN = int(NR_FSOPEN)
+except ValueError:
+    SYSCALL_FSOPEN_AVAILABLE = False
+
+try:
+    NR_FSCONFIG = int(NR_FSCONFIG)
+except ValueError:
+    SYSCALL_FSCONFIG_AVAILABLE = False
+
+try:
+    NR_FSMOUNT = int(NR_FSMOUNT)
+except ValueError:
+    SYSCALL_FSMOUNT_AVAILABLE = False
+
+try:
+    NR_MOUNT_SETATTR = int(NR_MOUNT_SETATTR)
+except ValueError:
+    SYSCALL_MOUNT_SETATTR_AVAILABLE = False
+
+try:
+    EINVAL = int(EINVAL)
+except ValueError:
+    raise RuntimeError("cannot determine the errno EINVAL value")
+
+try:
+    EPERM = int(EPERM)
+except ValueError:
+    raise RuntimeError("cannot determine the errno EPERM value")
+
+__all__ = ["SYSCALL_PIVOT_ROOT_AVAILABLE", "SYSCALL_SETNS_AVAILABLE",
+               "SYSCALL_CLONE3_AVAILABLE", "SYSCALL_CLOSE_RANGE_AVAILABLE",
+               "SYSCALL_PIDFD_OPEN_AVAILABLE",
+               "SYSCALL_PIDFD_SEND_SIGNAL_AVAILABLE",
+               "SYSCALL_OPEN_TREE_AVAILABLE", "SYSCALL_MOVE_MOUNT_AVAILABLE",
+               "SYSCALL_FSOPEN_AVAILABLE", "SYSCALL_FSCONFIG_AVAILABLE",
+               "SYSCALL_FSMOUNT_AVAILABLE", "SYSCALL_MOUNT_SETATTR_AVAILABLE",
+               "NR_PIVOT_ROOT", "NR_SETNS", "NR_CLONE3", "NR_CLOSE_RANGE",
+               "NR_PIDFD_OPEN", "NR_PIDFD_SEND_SIGNAL", "NR_OPEN_TREE",
+               "NR_MOVE_MOUNT", "NR_FSOPEN", "NR_FSCONFIG", "NR_FSMOUNT",
+               "NR_MOUNT_SETATTR", "EINVAL", "EPERM"]
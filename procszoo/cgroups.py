@@ -0,0 +1,444 @@
+# Copyright 2016 Red Hat, Inc. All Rights Reserved.
+# Licensed to GPL under a Contributor Agreement.
+
+"""
+cgroup v2 leaves of sandboxes. E.g.,
+
+    spawn_namespaces(limits={"cpu.max": 0.5, "memory.max": "256M",
+                             "pids.max": 64,
+                             "io.max": {"/dev/sda": {"wbps": 1 << 20}}},
+                     nscmd=["/bin/sh"])
+
+Every sandbox gets its own leaf cgroup under a delegated root, that is
+the cgroup of the caller, or cgroup_root=, or $PROCSZOO_CGROUP_ROOT. The
+clone engine puts the child into its leaf by clone3(2) CLONE_INTO_CGROUP,
+the fork engine moves the bottom halves into it before the namespaces
+are created, so nothing of the sandbox ever runs outside its limits.
+The leaf is removed when the sandbox has been reaped.
+
+Limits are the interface files of cgroup v2, a number of cpu.max is the
+CPUs, e.g., 0.5, io.max is a dict of devices, by path or "major:minor".
+"""
+
+import os
+import time
+import math
+import errno
+import select
+import itertools
+
+from procszoo.utils import *
+from procszoo.namespaces import *
+from procszoo.mountinfo import MountTable
+
+__all__ = ["Cgroup", "CgroupRoot", "IdleReclaimPolicy", "cgroup2_mountpoint",
+           "cgroup_path"]
+
+_CGROUP_ROOT_ENV = "PROCSZOO_CGROUP_ROOT"
+_CPU_MAX_PERIOD = 100000
+_LEAF_PREFIX = "procszoo"
+_leaf_counter = itertools.count()
+_GONE_ERRNOS = [errno.ENOENT, errno.ENODEV]
+
+
+def cgroup2_mountpoint(table=None):
+    """
+    where the cgroup v2 hierarchy is mounted, /sys/fs/cgroup on a unified
+    host, /sys/fs/cgroup/unified on a hybrid one, or None.
+    """
+    if table is None:
+        table = MountTable.read()
+    found = None
+    for mount in table:
+        if mount.fstype != "cgroup2" or mount.root != "/":
+            continue
+        if mount.mount_point == "/sys/fs/cgroup":
+            return mount.mount_point
+        if found is None:
+            found = mount.mount_point
+    return found
+
+
+def cgroup_path(pid=None):
+    """
+    the cgroup v2 path of pid, relative to the hierarchy, e.g., "/".
+    """
+    if pid is None:
+        path = "/proc/self/cgroup"
+    else:
+        path = "/proc/%d/cgroup" % pid
+    fo = open(path, "r")
+    try:
+        for line in fo:
+            if line.startswith("0::"):
+                return line[3:].strip()
+    finally:
+        fo.close()
+    return None
+
+
+def _device_number(device):
+    if device.startswith("/"):
+        rdev = os.stat(device).st_rdev
+        return "%d:%d" % (os.major(rdev), os.minor(rdev))
+    return device
+
+
+def _format_limit(key, value):
+    """
+    return the lines to write to the interface file key.
+    """
+    if value is None:
+        value = "max"
+    if key == "cpu.max":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = "%d %d" % (int(value * _CPU_MAX_PERIOD), _CPU_MAX_PERIOD)
+        elif isinstance(value, tuple):
+            value = "%s %s" % value
+    elif key == "io.max":
+        if not isinstance(value, dict):
+            return ["%s" % value]
+        lines = []
+        for device in sorted(value):
+            spec = value[device]
+            if isinstance(spec, dict):
+                spec = " ".join(["%s=%s" % (name, spec[name])
+                                     for name in sorted(spec)])
+            lines.append("%s %s" % (_device_number(device), spec))
+        return lines
+    return ["%s" % value]
+
+
+def _controller(key):
+    """
+    the controller of an interface file, "cgroup" is the core one.
+    """
+    if "." not in key:
+        raise NamespaceSettingError("%s: not a cgroup interface file" % key)
+    return key.split(".", 1)[0]
+
+
+class Cgroup(object):
+    """
+    a cgroup v2 dir.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return "<Cgroup %s>" % self.path
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def read(self, name):
+        fo = open(self._file(name), "r")
+        try:
+            return fo.read()
+        finally:
+            fo.close()
+
+    def write(self, name, value):
+        """
+        one write(2) per value, the kernel takes one line at a time.
+        """
+        fd = os.open(self._file(name), os.O_WRONLY | os.O_CLOEXEC)
+        try:
+            os.write(fd, to_bytes("%s" % value))
+        finally:
+            os.close(fd)
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def controllers(self):
+        return self.read("cgroup.controllers").split()
+
+    def subtree_controllers(self):
+        return self.read("cgroup.subtree_control").split()
+
+    def enable(self, controllers):
+        """
+        enable controllers for the children, the ones already enabled are
+        not written again.
+        """
+        enabled = self.subtree_controllers()
+        for controller in controllers:
+            if controller not in enabled:
+                self.write("cgroup.subtree_control", "+%s" % controller)
+
+    def procs(self):
+        return [int(pid) for pid in self.read("cgroup.procs").split()]
+
+    def events(self, fd=None):
+        """
+        cgroup.events as a dict, e.g., {"populated": "1", "frozen": "0"}.
+        """
+        if fd is None:
+            text = self.read("cgroup.events")
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            text = os.read(fd, 4096).decode()
+        events = {}
+        for line in text.splitlines():
+            key, _, value = line.partition(" ")
+            events[key] = value
+        return events
+
+    def populated(self):
+        return self.events().get("populated") == "1"
+
+    def frozen(self):
+        return self.events().get("frozen") == "1"
+
+    def wait_event(self, key, value, timeout=None):
+        """
+        wait until key of cgroup.events has value, return False if timeout
+        seconds passed first. The kernel wakes up POLLPRI pollers of the
+        file when it changes, so it is not polled at an interval. A cgroup
+        that has gone is not populated, nor frozen.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        try:
+            fd = os.open(self._file("cgroup.events"),
+                         os.O_RDONLY | os.O_CLOEXEC)
+        except OSError as e:
+            if e.errno in _GONE_ERRNOS:
+                return value == "0"
+            raise
+        try:
+            poller = select.poll()
+            poller.register(fd, select.POLLPRI)
+            while True:
+                try:
+                    if self.events(fd).get(key) == value:
+                        return True
+                except OSError as e:
+                    if e.errno in _GONE_ERRNOS:
+                        return value == "0"
+                    raise
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    remaining = int(math.ceil(remaining * 1000))
+                poller.poll(remaining)
+        finally:
+            os.close(fd)
+
+    def freeze(self, timeout=None):
+        """
+        freeze the processes of the cgroup and its descendants. timeout 0
+        does not wait, otherwise return whether they are all frozen.
+        """
+        self.write("cgroup.freeze", 1)
+        if timeout == 0:
+            return self.frozen()
+        return self.wait_event("frozen", "1", timeout)
+
+    def thaw(self):
+        self.write("cgroup.freeze", 0)
+
+    def memory_current(self):
+        try:
+            return int(self.read("memory.current"))
+        except (IOError, OSError) as e:
+            if e.errno in _GONE_ERRNOS:
+                return None
+            raise
+
+    def reclaim(self, amount=None):
+        """
+        write memory.reclaim, amount is in bytes or e.g. "64M", all the
+        memory by default. Return the bytes that were reclaimed, or None
+        if the cgroup has no memory.reclaim.
+        """
+        before = self.memory_current()
+        if before is None:
+            return None
+        if amount is None:
+            amount = before
+        if not amount:
+            return 0
+        try:
+            self.write("memory.reclaim", amount)
+        except (IOError, OSError) as e:
+            if e.errno in _GONE_ERRNOS:
+                return None
+            # EAGAIN, less than amount could be reclaimed
+            if e.errno != errno.EAGAIN:
+                raise
+        after = self.memory_current() or 0
+        return max(before - after, 0)
+
+    def add(self, pid=0):
+        """
+        move pid into the cgroup, 0 is the caller.
+        """
+        self.write("cgroup.procs", pid)
+
+    def set_limits(self, limits):
+        for key in sorted(limits):
+            _controller(key)
+            for line in _format_limit(key, limits[key]):
+                try:
+                    self.write(key, line)
+                except (IOError, OSError) as e:
+                    if e.errno == errno.ENOENT:
+                        raise NamespaceSettingError(
+                            "%s: no such interface file in %s"
+                            % (key, self.path))
+                    if e.errno in [errno.EINVAL, errno.ERANGE]:
+                        raise NamespaceSettingError(
+                            "%s: invalid value '%s'" % (key, line))
+                    raise
+
+    def open(self):
+        """
+        a dir descriptor of the cgroup, e.g., for CLONE_INTO_CGROUP.
+        """
+        return os.open(self.path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+
+    def remove(self):
+        """
+        rmdir the cgroup, return False if it still has processes.
+        """
+        try:
+            os.rmdir(self.path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return True
+            if e.errno == errno.EBUSY:
+                return False
+            raise
+        return True
+
+
+class CgroupRoot(Cgroup):
+    """
+    a delegated cgroup v2 dir that the leaves of sandboxes are created
+    under. By cgroup v2 rules a cgroup that enables controllers for its
+    children should have no processes, unless it is the root of the
+    hierarchy, so a delegated root is usually a dir that the caller
+    does not live in.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = os.environ.get(_CGROUP_ROOT_ENV) or None
+        if path is None:
+            mountpoint = cgroup2_mountpoint()
+            current = cgroup_path()
+            if mountpoint is None or current is None:
+                raise NamespaceSettingError("no cgroup v2 hierarchy")
+            path = os.path.join(mountpoint, current.lstrip("/"))
+        Cgroup.__init__(self, os.path.abspath(path))
+        if not os.path.isfile(self._file("cgroup.controllers")):
+            raise NamespaceSettingError(
+                "%s: not a cgroup v2 dir" % self.path)
+
+    def check(self, limits):
+        """
+        raise NamespaceSettingError if a controller of limits is not
+        available in the root.
+        """
+        available = self.controllers() + ["cgroup"]
+        for key in limits or {}:
+            controller = _controller(key)
+            if controller not in available:
+                raise NamespaceSettingError(
+                    "%s controller is not available in %s"
+                    % (controller, self.path))
+
+    def create_leaf(self, name=None, limits=None):
+        if name is None:
+            name = "%s-%d-%d" % (_LEAF_PREFIX, os.getpid(),
+                                     next(_leaf_counter))
+        limits = limits or {}
+        self.check(limits)
+        try:
+            self.enable(sorted(set([_controller(key) for key in limits
+                                        if not key.startswith("cgroup.")])))
+        except (IOError, OSError) as e:
+            if e.errno == errno.EBUSY:
+                raise NamespaceSettingError(
+                    "%s has processes, it could not enable controllers, "
+                    "give a delegated root" % self.path)
+            if e.errno in [errno.EACCES, errno.EPERM]:
+                raise NamespaceRequireSuperuserPrivilege(
+                    "%s is not delegated" % self.path)
+            raise
+
+        leaf = Cgroup(os.path.join(self.path, name))
+        try:
+            os.mkdir(leaf.path)
+        except OSError as e:
+            if e.errno in [errno.EACCES, errno.EPERM]:
+                raise NamespaceRequireSuperuserPrivilege(
+                    "%s is not delegated" % self.path)
+            raise
+        try:
+            leaf.set_limits(limits)
+        except BaseException:
+            leaf.remove()
+            raise
+        return leaf
+
+
+class IdleReclaimPolicy(object):
+    """
+    reclaim the memory of sandboxes that have been frozen longer than
+    threshold seconds, by memory.reclaim of their cgroups. E.g.,
+
+        policy = IdleReclaimPolicy(threshold=300)
+        while True:
+            for handle, reclaimed in policy.apply(handles):
+                ...
+            time.sleep(60)
+
+    A sandbox is reclaimed once in a freeze, or every interval seconds
+    if interval is given. Sandboxes whose cgroups have no memory.reclaim
+    are skipped.
+    """
+    def __init__(self, threshold=300.0, amount=None, interval=None):
+        self.threshold = threshold
+        self.amount = amount
+        self.interval = interval
+        self.reclaimed = {}
+
+    def due(self, handle, now=None):
+        if now is None:
+            now = time.time()
+        frozen_since = getattr(handle, "frozen_since", None)
+        if frozen_since is None or now - frozen_since < self.threshold:
+            return False
+        last = self.reclaimed.get(id(handle))
+        if last is None or last[0] != frozen_since:
+            return True
+        return self.interval is not None and now - last[1] >= self.interval
+
+    def apply(self, handles, now=None):
+        """
+        return (handle, bytes) of the sandboxes that were reclaimed.
+        """
+        if now is None:
+            now = time.time()
+        result = []
+        alive = set()
+        for handle in handles:
+            alive.add(id(handle))
+            if not self.due(handle, now):
+                continue
+            cgroup = handle.cgroup
+            reclaimed = None
+            if cgroup is not None:
+                reclaimed = cgroup.reclaim(self.amount)
+            self.reclaimed[id(handle)] = (handle.frozen_since, now)
+            if reclaimed is not None:
+                result.append((handle, reclaimed))
+        for key in list(self.reclaimed):
+            if key not in alive:
+                del self.reclaimed[key]
+        return result
@@ -0,0 +1,289 @@
+# Copyright 2016 Red Hat, Inc. All Rights Reserved.
+# Licensed to GPL under a Contributor Agreement.
+
+"""
+a parser of /proc/<pid>/mountinfo. E.g.,
+
+    table = MountTable.read()
+    table.propagation("/")
+    for mount in table.umount_order("/mnt"):
+        ...
+
+The file is parsed line by line, and the mounts are indexed by mount ID
+and by mount point, with their parents and children, so what is mounted
+under a path could be found without reading the file again.
+"""
+
+import os
+import re
+
+__all__ = ["Mount", "MountTable", "iter_mountinfo"]
+
+_ESCAPED = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(field):
+    """
+    the kernel escapes space, tab, newline and backslash as \\ooo.
+    """
+    if "\\" not in field:
+        return field
+    return _ESCAPED.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+
+class Mount(object):
+    """
+    a line of mountinfo, see proc(5). Only the IDs and the mount point are
+    parsed at once, other fields when they are used, as most of the lines
+    of a big table are only walked through.
+    """
+    __slots__ = ["mount_id", "parent_id", "mount_point", "parent",
+                 "children", "_line", "_all_fields", "_sep"]
+
+    def __init__(self, line):
+        fields = line.split(" ", 5)
+        self.mount_id = int(fields[0])
+        self.parent_id = int(fields[1])
+        self.mount_point = _unescape(fields[4])
+        self.parent = None
+        self.children = []
+        self._line = line
+        self._all_fields = None
+        self._sep = None
+
+    @property
+    def _fields(self):
+        if self._all_fields is None:
+            self._all_fields = self._line.split()
+        return self._all_fields
+
+    def _separator(self):
+        if self._sep is None:
+            self._sep = self._fields.index("-", 6)
+        return self._sep
+
+    @property
+    def major(self):
+        return int(self._fields[2].split(":")[0])
+
+    @property
+    def minor(self):
+        return int(self._fields[2].split(":")[1])
+
+    @property
+    def root(self):
+        return _unescape(self._fields[3])
+
+    @property
+    def options(self):
+        return self._fields[5].split(",")
+
+    @property
+    def optional(self):
+        optional = {}
+        for field in self._fields[6:self._separator()]:
+            key, _, value = field.partition(":")
+            optional[key] = value
+        return optional
+
+    @property
+    def fstype(self):
+        return self._fields[self._separator() + 1]
+
+    @property
+    def source(self):
+        return _unescape(self._fields[self._separator() + 2])
+
+    @property
+    def super_options(self):
+        sep = self._separator()
+        if len(self._fields) > sep + 3:
+            return self._fields[sep + 3].split(",")
+        return []
+
+    def __repr__(self):
+        return "<Mount %d %s %s>" % (self.mount_id, self.mount_point,
+                                     self.fstype)
+
+    @property
+    def shared(self):
+        """
+        the peer group ID, or None if the mount is not shared.
+        """
+        optional = self.optional
+        if "shared" in optional:
+            return int(optional["shared"])
+        return None
+
+    @property
+    def master(self):
+        optional = self.optional
+        if "master" in optional:
+            return int(optional["master"])
+        return None
+
+    @property
+    def propagation(self):
+        """
+        "shared", "slave", "shared,slave", "unbindable" or "private",
+        as findmnt(8) shows.
+        """
+        if self._fields[6] == "-":
+            return "private"
+        optional = self.optional
+        types = []
+        if "shared" in optional:
+            types.append("shared")
+        if "master" in optional:
+            types.append("slave")
+        if "unbindable" in optional:
+            types.append("unbindable")
+        return ",".join(types) or "private"
+
+    @property
+    def readonly(self):
+        return "ro" in self.options
+
+    def walk(self):
+        """
+        this mount and the mounts under it, parents first.
+        """
+        stack = [self]
+        while stack:
+            mount = stack.pop()
+            yield mount
+            stack.extend(reversed(mount.children))
+
+
+def iter_mountinfo(fo):
+    for line in fo:
+        line = line.strip()
+        if line:
+            yield Mount(line)
+
+
+class MountTable(object):
+    """
+    the mounts of a mount namespace, indexed by mount ID and mount point.
+    """
+    def __init__(self, mounts=None):
+        self.by_id = {}
+        self.by_point = {}
+        self.roots = []
+        for mount in mounts or []:
+            self.add(mount)
+        self.link()
+
+    @classmethod
+    def read(cls, pid=None, path=None):
+        if path is None:
+            if pid is None:
+                path = "/proc/self/mountinfo"
+            else:
+                path = "/proc/%d/mountinfo" % pid
+        fo = open(path, "r")
+        try:
+            return cls(iter_mountinfo(fo))
+        finally:
+            fo.close()
+
+    def add(self, mount):
+        self.by_id[mount.mount_id] = mount
+        self.by_point.setdefault(mount.mount_point, []).append(mount)
+
+    def link(self):
+        """
+        set the parents and children, the parent of a root mount is out
+        of the mount namespace, or is itself.
+        """
+        self.roots = []
+        for mount in self.by_id.values():
+            mount.children = []
+        for mount_id in sorted(self.by_id):
+            mount = self.by_id[mount_id]
+            parent = self.by_id.get(mount.parent_id)
+            if parent is None or parent is mount:
+                mount.parent = None
+                self.roots.append(mount)
+            else:
+                mount.parent = parent
+                parent.children.append(mount)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        for mount_id in sorted(self.by_id):
+            yield self.by_id[mount_id]
+
+    def __contains__(self, path):
+        return os.path.normpath(path) in self.by_point
+
+    def get(self, path):
+        """
+        the top mount at the mount point path, or None.
+        """
+        mounts = self.by_point.get(os.path.normpath(path))
+        if not mounts:
+            return None
+        top = mounts[0]
+        while True:
+            above = [child for child in top.children
+                         if child.mount_point == top.mount_point]
+            if not above:
+                return top
+            top = above[-1]
+
+    def find(self, path):
+        """
+        the mount that path is on.
+        """
+        path = os.path.normpath(path)
+        while True:
+            mount = self.get(path)
+            if mount is not None:
+                return mount
+            if path == "/":
+                return None
+            path = os.path.dirname(path)
+
+    def subtree(self, path):
+        """
+        the mounts at path and under it, parents first.
+        """
+        path = os.path.normpath(path)
+        mounts = self.by_point.get(path)
+        if not mounts:
+            return []
+        lowest = [mount for mount in mounts
+                      if mount.parent is None
+                      or mount.parent.mount_point != path]
+        result = []
+        for mount in lowest:
+            result.extend(mount.walk())
+        return result
+
+    def umount_order(self, path):
+        """
+        the mounts at path and under it, in the order they could be
+        unmounted one by one, children first.
+        """
+        return list(reversed(self.subtree(path)))
+
+    def propagation(self, path="/"):
+        mount = self.find(path)
+        if mount is None:
+            return None
+        return mount.propagation
+
+    def all_propagation(self, propagation, path="/"):
+        """
+        whether each mount at path and under it has the propagation type.
+        """
+        mounts = self.subtree(path)
+        if not mounts:
+            return False
+        for mount in mounts:
+            if mount.propagation != propagation:
+                return False
+        return True
@@ -0,0 +1,383 @@
+# Copyright 2016 Red Hat, Inc. All Rights Reserved.
+# Licensed to GPL under a Contributor Agreement.
+
+"""
+declarative mount plans. E.g.,
+
+    plan = MountPlan()
+    plan.bind("/usr", "/srv/root/usr", attrs=["ro", "nodev"])
+    plan.tmpfs("/srv/root/tmp", size="64M", mode="1777")
+    plan.proc("/srv/root/proc")
+    spawn_namespaces(mounts=plan.prepare(), nscmd=["/bin/sh"])
+
+A plan is applied through the new mount API, fsopen(2), fsmount(2),
+open_tree(2), mount_setattr(2) and move_mount(2), where mount(2) could
+not do the same, and by mount(2) for others, or when the kernel has not
+the new API. prepare() turns the bind mounts into detached trees once,
+then each sandbox only attaches clones of them, and the bind sources are
+not looked up again.
+"""
+
+import os
+import errno
+
+from procszoo.c_functions import *
+from procszoo.c_functions import (_mount_attrs, _OPEN_TREE_CLONE,
+                                      _AT_RECURSIVE)
+from procszoo.utils import *
+
+__all__ = ["MountPlan", "MountTree"]
+
+_LEGACY_ATTRS = {"ro": "MS_RDONLY", "nosuid": "MS_NOSUID",
+                     "nodev": "MS_NODEV", "noexec": "MS_NOEXEC",
+                     "noatime": "MS_NOATIME", "nodiratime": "MS_NODIRATIME",
+                     "nosymfollow": "MS_NOSYMFOLLOW"}
+
+
+def _legacy_flags(names):
+    flag = workbench.functions["mount"].extra["flag"]
+    flags = 0
+    for name in names or []:
+        if name not in _LEGACY_ATTRS:
+            raise RuntimeError("%s: unknown mount attribute" % name)
+        flags |= flag[_LEGACY_ATTRS[name]]
+    return flags
+
+
+def _options_items(options):
+    if options is None:
+        return []
+    if isinstance(options, dict):
+        return list(options.items())
+    return list(options)
+
+
+def _close_quietly(fd):
+    try:
+        os.close(fd)
+    except OSError:
+        pass
+
+
+class _MountStep(object):
+    """
+    one mount of a plan, kind is "bind", "filesystem" or "attach".
+    """
+    def __init__(self, kind, target, source=None, filesystemtype=None,
+                     options=None, attrs=None, recursive=True,
+                     propagation=None, tree=None):
+        self.kind = kind
+        self.target = target
+        self.source = source
+        self.filesystemtype = filesystemtype
+        self.options = _options_items(options)
+        self.attrs = list(attrs or [])
+        self.recursive = recursive
+        self.propagation = propagation
+        self.tree = tree
+        _mount_attrs(self.attrs)
+
+    def detached(self):
+        """
+        return a descriptor of a detached mount of this step.
+        """
+        if self.kind == "bind":
+            flags = _OPEN_TREE_CLONE | os.O_CLOEXEC
+            if self.recursive:
+                flags |= _AT_RECURSIVE
+            fd = workbench.open_tree(self.source, flags=flags)
+            try:
+                if self.attrs:
+                    workbench.mount_setattr(fd, attrs=self.attrs,
+                                            recursive=self.recursive)
+            except BaseException:
+                _close_quietly(fd)
+                raise
+            return fd
+
+        fs_fd = workbench.fsopen(self.filesystemtype)
+        try:
+            if self.source is not None:
+                workbench.fsconfig(fs_fd, "source", self.source)
+            for key, value in self.options:
+                workbench.fsconfig(fs_fd, key, value)
+            workbench.fsconfig(fs_fd)
+            return workbench.fsmount(fs_fd, attrs=self.attrs)
+        finally:
+            os.close(fs_fd)
+
+    def apply(self, target, dirfd=None):
+        if self.kind == "attach":
+            fd = self.tree.attach(target, dirfd)
+        else:
+            fd = self.detached()
+            try:
+                workbench.move_mount(fd, target, to_dirfd=dirfd)
+            except BaseException:
+                _close_quietly(fd)
+                raise
+        try:
+            if self.propagation is not None:
+                workbench.mount_setattr(fd, propagation=self.propagation,
+                                        recursive=self.recursive)
+        finally:
+            os.close(fd)
+
+    def needs_mount_api(self):
+        """
+        mount(2) could not make a recursive bind mount read-only, nor
+        attach a prepared tree.
+        """
+        if self.kind == "attach":
+            return True
+        return self.kind == "bind" and self.recursive and bool(self.attrs)
+
+    def apply_legacy(self, target):
+        if self.kind == "attach":
+            return self.tree.step.apply_legacy(target)
+
+        flag = workbench.functions["mount"].extra["flag"]
+        mount = workbench._c_func_mount
+        if self.kind == "bind":
+            flags = flag["MS_BIND"]
+            if self.recursive:
+                flags |= flag["MS_REC"]
+            mount(self.source, target, None, flags, None)
+            if self.attrs:
+                flags = (flag["MS_REMOUNT"] | flag["MS_BIND"]
+                         | _legacy_flags(self.attrs))
+                mount(None, target, None, flags, None)
+        else:
+            data = ",".join([key if value is None
+                                 else "%s=%s" % (key, value)
+                                 for key, value in self.options])
+            source = self.source
+            if source is None:
+                source = self.filesystemtype
+            mount(source, target, self.filesystemtype,
+                  _legacy_flags(self.attrs), to_bytes(data))
+
+        if self.propagation is not None:
+            flags = flag["MS_%s" % self.propagation.upper()]
+            if self.recursive:
+                flags |= flag["MS_REC"]
+            mount(None, target, None, flags, None)
+
+
+class MountTree(object):
+    """
+    a detached mount prepared once, every clone() is a new detached copy
+    of it that could be attached in another mount namespace. Clones of
+    a bind mount share the files with the source, as bind mounts do.
+    fd is None when the kernel has not the new mount API, then the
+    mount is done again from the source for each sandbox.
+
+    The kernel only clones a tree of open_tree(2) in the mount namespace
+    it comes from, so clone_ahead() should be called before the new
+    mount namespace is created, as SpawnNamespacesConfig does.
+    """
+    def __init__(self, step):
+        self.step = step
+        self.fd = None
+        self._ahead = None
+        if workbench.mount_api_available():
+            self.fd = step.detached()
+
+    def fileno(self):
+        return self.fd
+
+    def clone(self):
+        if self._ahead is not None:
+            fd, self._ahead = self._ahead, None
+            return fd
+        if self.fd is None:
+            return self.step.detached()
+        try:
+            return workbench.open_tree(dirfd=self.fd)
+        except CFunctionCallFailed as e:
+            if e.errno != errno.EINVAL:
+                raise
+            return self.step.detached()
+
+    def clone_ahead(self):
+        if self.fd is None or self._ahead is not None:
+            return
+        try:
+            self._ahead = workbench.open_tree(dirfd=self.fd)
+        except CFunctionCallFailed:
+            pass
+
+    def release(self):
+        """
+        close the clone of clone_ahead() if it has not been attached.
+        """
+        if self._ahead is not None:
+            _close_quietly(self._ahead)
+            self._ahead = None
+
+    def attach(self, target, dirfd=None):
+        """
+        attach a clone to target, return the descriptor of the clone.
+        """
+        fd = self.clone()
+        try:
+            workbench.move_mount(fd, target, to_dirfd=dirfd)
+            return fd
+        except (CFunctionCallFailed, NamespaceRequireSuperuserPrivilege):
+            _close_quietly(fd)
+        # a clone from another user namespace could not be attached
+        fd = self.step.detached()
+        try:
+            workbench.move_mount(fd, target, to_dirfd=dirfd)
+        except BaseException:
+            _close_quietly(fd)
+            raise
+        return fd
+
+    def close(self):
+        self.release()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MountPlan(object):
+    """
+    an ordered list of mounts. Targets are absolute paths, or paths in
+    root when apply() gets a root.
+    """
+    def __init__(self, steps=None):
+        self.steps = list(steps or [])
+
+    def __len__(self):
+        return len(self.steps)
+
+    def bind(self, source, target, attrs=None, recursive=True,
+                 propagation=None):
+        self.steps.append(_MountStep("bind", target, source=source,
+                                         attrs=attrs, recursive=recursive,
+                                         propagation=propagation))
+        return self
+
+    def filesystem(self, filesystemtype, target, options=None, attrs=None,
+                       source=None, propagation=None):
+        """
+        options are the filesystem parameters, a dict or a list of
+        (key, value) pairs, a value None means a flag parameter.
+        """
+        self.steps.append(_MountStep("filesystem", target, source=source,
+                                         filesystemtype=filesystemtype,
+                                         options=options, attrs=attrs,
+                                         recursive=False,
+                                         propagation=propagation))
+        return self
+
+    def tmpfs(self, target, size=None, mode=None, attrs=None):
+        options = []
+        if size is not None:
+            options.append(("size", size))
+        if mode is not None:
+            options.append(("mode", mode))
+        if attrs is None:
+            attrs = ["nosuid", "nodev"]
+        return self.filesystem("tmpfs", target, options=options, attrs=attrs)
+
+    def proc(self, target="/proc"):
+        return self.filesystem("proc", target,
+                               attrs=["nosuid", "nodev", "noexec"])
+
+    def attach(self, tree, target, propagation=None):
+        self.steps.append(_MountStep("attach", target, tree=tree,
+                                         recursive=tree.step.recursive,
+                                         propagation=propagation))
+        return self
+
+    def prepare(self):
+        """
+        return a plan whose bind mounts are detached trees prepared now.
+        Other filesystems, e.g., tmpfs and procfs, stay as they are,
+        every sandbox should get its own.
+        """
+        steps = []
+        for step in self.steps:
+            if step.kind == "bind":
+                step = _MountStep("attach", step.target,
+                                  tree=MountTree(step),
+                                  recursive=step.recursive,
+                                  propagation=step.propagation)
+            steps.append(step)
+        return MountPlan(steps)
+
+    def trees(self):
+        return [step.tree for step in self.steps if step.tree is not None]
+
+    def sources(self):
+        """
+        the (source, recursive) of the bind mounts. Prepared trees are
+        included, they may be bound from the source again, see
+        MountTree.attach().
+        """
+        sources = []
+        for step in self.steps:
+            if step.kind == "attach":
+                step = step.tree.step
+            if step.kind == "bind":
+                sources.append((step.source, step.recursive))
+        return sources
+
+    def clone_ahead(self):
+        """
+        clone the prepared trees in the current mount namespace, the next
+        apply() in a new mount namespace attaches these clones.
+        """
+        for tree in self.trees():
+            tree.clone_ahead()
+
+    def release(self):
+        for tree in self.trees():
+            tree.release()
+
+    def close(self):
+        """
+        close the prepared trees.
+        """
+        for tree in self.trees():
+            tree.close()
+
+    def apply(self, root=None, use_mount_api=None):
+        """
+        do the mounts in the current mount namespace. By default the new
+        mount API is used for the steps that need it, the prepared trees
+        and the recursive read-only bind mounts, and mount(2) for others,
+        it needs fewer calls. use_mount_api true or false forces one.
+        """
+        if use_mount_api is None:
+            available = workbench.mount_api_available()
+            use_mount_api = [available and step.needs_mount_api()
+                                 for step in self.steps]
+        else:
+            use_mount_api = [use_mount_api] * len(self.steps)
+
+        dirfd = None
+        if root is not None and True in use_mount_api:
+            dirfd = os.open(root, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        try:
+            for step, new_api in zip(self.steps, use_mount_api):
+                target = step.target
+                if not new_api:
+                    if root is not None:
+                        target = os.path.join(root, target.lstrip("/"))
+                    step.apply_legacy(target)
+                    continue
+                if dirfd is not None:
+                    target = target.lstrip("/") or "."
+                step.apply(target, dirfd)
+        finally:
+            if dirfd is not None:
+                os.close(dirfd)
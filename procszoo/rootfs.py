@@ -0,0 +1,256 @@
+# Copyright 2016 Red Hat, Inc. All Rights Reserved.
+# Licensed to GPL under a Contributor Agreement.
+
+"""
+overlayfs root filesystems of sandboxes. E.g.,
+
+    store = LayerStore()
+    base = store.import_tar("base.tar.gz")
+    app = store.import_dir("./app-files")
+    spawn_namespaces(rootfs=Rootfs([base, app], store=store),
+                     nscmd=["/bin/sh"])
+
+Layers are kept once in a content-addressed store and stacked read-only
+as the lower dirs of an overlayfs, every sandbox writes to its own tmpfs
+upper dir. So the cost of a sandbox start does not grow with the size of
+its image, the layers are never copied.
+"""
+
+import os
+import stat
+import errno
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from procszoo.c_functions import *
+from procszoo.c_functions import _cache_dir
+from procszoo.utils import *
+
+__all__ = ["LayerStore", "Rootfs"]
+
+_DIGEST_ALGORITHM = "sha256"
+_READ_SIZE = 1 << 16
+
+
+def _file_digest(path, algorithm=_DIGEST_ALGORITHM):
+    digest = hashlib.new(algorithm)
+    fo = open(path, "rb")
+    try:
+        while True:
+            data = fo.read(_READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        fo.close()
+    return digest.hexdigest()
+
+
+def _tree_digest(top, algorithm=_DIGEST_ALGORITHM):
+    """
+    digest of the names, types, modes, owners and contents of a tree.
+    """
+    digest = hashlib.new(algorithm)
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames.sort()
+        names = sorted(dirnames + filenames)
+        if dirpath == top:
+            names.insert(0, "")
+        for name in names:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            rel = os.path.relpath(path, top)
+            entry = "%s\0%o\0%d\0%d\0" % (rel, st.st_mode, st.st_uid,
+                                            st.st_gid)
+            if stat.S_ISREG(st.st_mode):
+                entry += _file_digest(path, algorithm)
+            elif stat.S_ISLNK(st.st_mode):
+                entry += os.readlink(path)
+            elif stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+                entry += "%d" % st.st_rdev
+            digest.update(to_bytes(entry + "\n"))
+    return digest.hexdigest()
+
+
+class LayerStore(object):
+    """
+    a local store of rootfs layers, a layer is a dir named by the digest
+    of its content. Imports are atomic, a layer shows up in the store
+    only when it is complete, and importing the same content twice keeps
+    one copy.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            cache_dir = _cache_dir()
+            if cache_dir is None:
+                raise NamespaceSettingError(
+                    "no cache dir for the layer store, give a path")
+            path = os.path.join(cache_dir, "layers")
+        self.path = os.path.abspath(path)
+        self.layers_dir = os.path.join(self.path, _DIGEST_ALGORITHM)
+        self.tmp_dir = os.path.join(self.path, "tmp")
+        self.mnt_dir = os.path.join(self.path, "mnt")
+        for path in [self.layers_dir, self.tmp_dir, self.mnt_dir]:
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+
+    def layer_path(self, digest):
+        return os.path.join(self.layers_dir, digest)
+
+    def has(self, digest):
+        return os.path.isdir(self.layer_path(digest))
+
+    def digests(self):
+        return sorted(os.listdir(self.layers_dir))
+
+    def remove(self, digest):
+        """
+        remove a layer, sandboxes that are using it keep their mounts.
+        """
+        path = self.layer_path(digest)
+        if not os.path.isdir(path):
+            return
+        trash = tempfile.mkdtemp(prefix="remove-", dir=self.tmp_dir)
+        os.rename(path, os.path.join(trash, digest))
+        shutil.rmtree(trash)
+
+    def _commit(self, tmp_path, digest):
+        path = self.layer_path(digest)
+        try:
+            os.rename(tmp_path, path)
+        except OSError as e:
+            if e.errno not in [errno.EEXIST, errno.ENOTEMPTY]:
+                raise
+            shutil.rmtree(tmp_path)
+        return digest
+
+    def import_dir(self, source):
+        """
+        copy a dir into the store, return the digest of the layer.
+        """
+        if not os.path.isdir(source):
+            raise NamespaceSettingError("%s: no such directory" % source)
+        digest = _tree_digest(source)
+        if self.has(digest):
+            return digest
+        tmp_path = tempfile.mkdtemp(prefix="import-", dir=self.tmp_dir)
+        try:
+            subprocess.check_call(["cp", "-a", "--", "%s/." % source,
+                                       tmp_path])
+            os.chmod(tmp_path, os.stat(source).st_mode & 0o7777)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return self._commit(tmp_path, digest)
+
+    def import_tar(self, archive):
+        """
+        extract a tarball into the store, the layer is named by the
+        digest of the archive, so a known archive is not extracted again.
+        """
+        digest = _file_digest(archive)
+        if self.has(digest):
+            return digest
+        tmp_path = tempfile.mkdtemp(prefix="import-", dir=self.tmp_dir)
+        try:
+            os.chmod(tmp_path, 0o755)
+            subprocess.check_call(["tar", "-x", "--numeric-owner",
+                                       "-f", os.path.abspath(archive),
+                                       "-C", tmp_path])
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return self._commit(tmp_path, digest)
+
+
+class Rootfs(object):
+    """
+    an overlayfs root of layers in a LayerStore, layers[0] is the bottom
+    one. setup() should be called in a new mount namespace, it mounts a
+    tmpfs for the upper and work dirs, mounts the overlayfs, then
+    pivot_root(2) to it and detaches the old root. It is what the
+    sandbox does when SpawnNamespacesConfig gets rootfs=.
+
+    size is the tmpfs size option of the upper dir, e.g., "64M".
+    """
+    def __init__(self, layers, store=None, size=None, put_old=".old-root"):
+        if not layers:
+            raise NamespaceSettingError("rootfs needs one layer at least")
+        if store is None:
+            store = LayerStore()
+        self.layers = list(layers)
+        self.store = store
+        self.size = size
+        self.put_old = put_old
+
+    def check(self):
+        for digest in self.layers:
+            if not self.store.has(digest):
+                raise NamespaceSettingError("%s: no such layer" % digest)
+
+    def overlay_options(self):
+        """
+        lower dirs are relative to store.layers_dir, it keeps the options
+        in one page even when there are many layers.
+        """
+        lowerdir = ":".join(reversed(self.layers))
+        return "lowerdir=%s,upperdir=../mnt/upper,workdir=../mnt/work" % (
+            lowerdir)
+
+    def mount(self):
+        """
+        mount the overlayfs, return the path of the new root.
+        """
+        self.check()
+        mnt_dir = self.store.mnt_dir
+        data = "mode=0755"
+        if self.size is not None:
+            data += ",size=%s" % self.size
+        workbench.mount(source="none", target=mnt_dir, filesystemtype="tmpfs",
+                        mount_type="unchanged", data=data)
+        merged = os.path.join(mnt_dir, "merged")
+        for name in ["upper", "work", "merged"]:
+            os.mkdir(os.path.join(mnt_dir, name), 0o755)
+
+        cwd = os.open(".", os.O_RDONLY)
+        try:
+            os.chdir(self.store.layers_dir)
+            workbench.mount(source="overlay", target=merged,
+                            filesystemtype="overlay", mount_type="unchanged",
+                            data=self.overlay_options())
+        finally:
+            os.fchdir(cwd)
+            os.close(cwd)
+        return merged
+
+    def pivot(self, new_root):
+        put_old = os.path.join(new_root, self.put_old)
+        if not os.path.isdir(put_old):
+            os.mkdir(put_old, 0o700)
+        workbench.pivot_root(new_root, put_old)
+        os.chdir("/")
+        old_root = os.path.join("/", self.put_old)
+        workbench.umount2(old_root, "detach")
+        os.rmdir(old_root)
+
+    def setup(self, mountproc=None, mounts=None):
+        """
+        mountproc is where procfs is mounted in the new root, e.g., "/proc".
+        mounts is a MountPlan whose targets are paths in the new root.
+        """
+        new_root = self.mount()
+        if mounts is not None:
+            mounts.apply(root=new_root)
+        if mountproc is not None:
+            target = os.path.join(new_root, mountproc.lstrip("/"))
+            if not os.path.isdir(target):
+                os.makedirs(target)
+            workbench.mount(source="proc", target=target,
+                            filesystemtype="proc", mount_type="mount_proc")
+        self.pivot(new_root)
@@ -27,9 +27,11 @@ import os
 import sys
 import pwd
 import grp
+import json
 from argparse import ArgumentParser, REMAINDER
 
 from procszoo.c_functions import *
+from procszoo.accounting import rusage_record
 from procszoo.utils import *
 
 def get_options():
@@ -83,6 +85,9 @@ def get_options():
     parser.add_argument(
         '--saved-group', action='store', type=str, dest='saved_group',
         metavar='group', help='run cmd as this group as the saved group')
+    parser.add_argument(
+        '--rusage', action='store_true', dest='rusage', default=False,
+        help='print the resource usage of cmd as JSON to stderr')
     parser.add_argument('cmd', nargs=REMAINDER, action='store', default=None)
 
     return parser.parse_args()
@@ -305,8 +310,11 @@ def main():
         change_users_and_groups(mamaji_data)
         os.execlp(target_cmd[0], *target_cmd)
     else:
-        status = os.wait4(pid, 0)[1] >> 8
-        sys.exit(status)
+        _, status, rusage = os.wait4(pid, 0)
+        if args.rusage:
+            record = rusage_record(rusage, pid=pid)
+            warn(json.dumps(record._asdict(), sort_keys=True))
+        sys.exit(status >> 8)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+import os
+import sys
+from argparse import ArgumentParser, REMAINDER
+from procszoo.c_functions import *
+from procszoo.utils import *
+
+def get_options():
+    available_namespaces = [
+        ns_status[0] for ns_status in show_namespaces_status()
+                                 if ns_status[1]]
+    prog = os.path.basename(sys.argv[0]) or 'pi_patel'
+    project_url = "http://github.com/xning/procszoo"
+    description = "%s, %s" % (
+        'A simple cli to enter the namespaces of a process',
+        'default it will enter each available namespaces.')
+    parser = ArgumentParser(
+        usage="%s [options] pid [cmd [cmd_options]]" % prog,
+        description=description,
+        epilog="%s is part of procszoo: %s"  % (prog, project_url))
+
+    parser.add_argument('-v', '--version', action='version',
+                            version='%s %s' %  (prog, __version__))
+    parser.add_argument("-n", "--namespace", action="append",
+                            dest="namespaces", choices=available_namespaces,
+                            help="namespace that should be entered")
+    parser.add_argument("-N", "--negative-namespace", action="append",
+                          dest="negative_namespaces",
+                          choices=available_namespaces,
+                          help="namespace that should not be entered")
+    parser.add_argument(
+        '--no-fork', action='store_false', dest='do_fork', default=True,
+        help='exec cmd directly, by default a subprocess is forked to run '
+        'cmd, so that it is in the pid namespace, too')
+    parser.add_argument('pid', type=int, action='store')
+    parser.add_argument('cmd', nargs=REMAINDER, action='store', default=None)
+
+    return parser.parse_args()
+
+def main():
+    args = get_options()
+
+    namespaces = adjust_namespaces(args.namespaces, args.negative_namespaces)
+    try:
+        entered = enter(args.pid, namespaces)
+    except (OSError, CFunctionBaseException, NamespaceGenericException) as e:
+        warn("cannot enter namespaces of %d: %s" % (args.pid, e))
+        sys.exit(1)
+
+    target_cmd = args.cmd
+    if not target_cmd:
+        target_cmd = [find_shell()]
+
+    if not args.do_fork or "pid" not in entered:
+        os.execlp(target_cmd[0], *target_cmd)
+
+    pid = os.fork()
+    if pid == 0:
+        os.execlp(target_cmd[0], *target_cmd)
+    else:
+        status = os.waitpid(pid, 0)[1]
+        if os.WIFSIGNALED(status):
+            sys.exit(128 + os.WTERMSIG(status))
+        sys.exit(os.WEXITSTATUS(status))
+
+if __name__ == "__main__":
+    main()
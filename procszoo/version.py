@@ -0,0 +1 @@
+PROCSZOO_VERSION = '0.97.2a1'
@@ -0,0 +1,424 @@
+# Copyright 2016 Red Hat, Inc. All Rights Reserved.
+# Licensed to GPL under a Contributor Agreement.
+
+"""
+A fork server for func= sandboxes.
+
+The zygote is a long-lived process that has already imported a list of
+modules and already lives in the target namespaces. It forks one child for
+each request it gets, so the cost of a sandbox does not grow with the size
+of the caller. E.g.,
+
+    zygote = Zygote(preload=["json", "myapp.tasks"], maproot=True)
+    zygote.start()
+    child = zygote.spawn(myapp.tasks.run, args=(1, 2))
+    status = child.wait()
+    zygote.close()
+
+The funcs and their arguments are pickled, so funcs should be defined at
+the top level of a module that the zygote can import.
+
+Requests are unpickled and run, so only the owner may reach the zygote: by
+default it listens on nothing, the caller keeps one end of a socketpair
+and passes a new connection over it for each request. A zygote given
+socket_path listens there, the path has to be in a 0700 directory of the
+owner, and connections from other uids are closed unread.
+"""
+
+import os
+import sys
+import socket
+import select
+import signal
+import struct
+import pickle
+import errno
+import fcntl
+import threading
+
+from procszoo.c_functions import *
+from procszoo.c_functions import _fork, _exit_forked_child
+from procszoo.utils import *
+
+__all__ = ["Zygote", "ZygoteChild"]
+
+_MSG_HEADER = struct.Struct("!I")
+_FD = struct.Struct("i")
+_UCRED = struct.Struct("3i")
+
+
+def _send_msg(sock, obj):
+    data = pickle.dumps(obj, 2)
+    sock.sendall(_MSG_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_msg(sock):
+    header = _recv_exactly(sock, _MSG_HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, _MSG_HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return pickle.loads(data)
+
+
+def _send_conn(sock, conn):
+    sock.sendmsg([b"c"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                               _FD.pack(conn.fileno()))])
+
+
+def _recv_conn(sock):
+    """
+    return a connection passed by _send_conn(), False if the message
+    carries none, or None if the owner closed its end.
+    """
+    msg, ancdata, flags, addr = sock.recvmsg(1, socket.CMSG_LEN(_FD.size))
+    if not msg:
+        return None
+    for level, msg_type, data in ancdata:
+        if level == socket.SOL_SOCKET and msg_type == socket.SCM_RIGHTS:
+            fd = _FD.unpack(data[:_FD.size])[0]
+            conn = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+            os.close(fd)
+            return conn
+    return False
+
+
+def _peer_uid(conn):
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                _UCRED.size)
+    return _UCRED.unpack(creds)[1]
+
+
+def _reap_children(children):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.ECHILD:
+                return
+            raise
+        if pid == 0:
+            return
+        conn = children.pop(pid, None)
+        if conn is None:
+            continue
+        try:
+            _send_msg(conn, {"status": status})
+        except (OSError, IOError, socket.error):
+            pass
+        conn.close()
+
+
+def serve(listener, preload=None):
+    """
+    the zygote main loop, it only returns when an exit request arrives or
+    the owner closes its end. listener is either a listening socket or
+    the zygote end of the socketpair that connections are passed over.
+    """
+    for name in preload or []:
+        __import__(name)
+
+    accepting = listener.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN)
+    owner_uid = os.getuid()
+
+    wakeup_r, wakeup_w = os.pipe()
+    flags = fcntl.fcntl(wakeup_w, fcntl.F_GETFL)
+    fcntl.fcntl(wakeup_w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def sigchld_handler(signum, frame):
+        try:
+            os.write(wakeup_w, b"x")
+        except OSError:
+            pass
+
+    signal.signal(signal.SIGCHLD, sigchld_handler)
+
+    children = {}
+    conns = []
+    while True:
+        try:
+            readable = select.select([listener, wakeup_r] + conns, [], [])[0]
+        except (select.error, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        if wakeup_r in readable:
+            os.read(wakeup_r, 4096)
+            _reap_children(children)
+
+        if listener in readable:
+            if accepting:
+                conn = listener.accept()[0]
+                if _peer_uid(conn) != owner_uid:
+                    conn.close()
+                    conn = False
+            else:
+                conn = _recv_conn(listener)
+                if conn is None:
+                    return
+            if conn:
+                conns.append(conn)
+
+        for conn in [c for c in conns if c in readable]:
+            conns.remove(conn)
+            try:
+                request = _recv_msg(conn)
+            except Exception as e:
+                request = {"error": "%s" % e}
+            if request is None:
+                conn.close()
+                continue
+            if request.get("command") == "exit":
+                conn.close()
+                return
+            if "error" in request:
+                _send_msg(conn, request)
+                conn.close()
+                continue
+
+            pid = _fork()
+            if pid == 0:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                for fo in [listener] + conns + list(children.values()):
+                    fo.close()
+                os.close(wakeup_r)
+                os.close(wakeup_w)
+                conn.close()
+                _exit_forked_child(request["func"], *request["args"],
+                                       **request["kwargs"])
+            children[pid] = conn
+            _send_msg(conn, {"pid": pid})
+
+
+class ZygoteChild(object):
+    """
+    a child forked by the zygote. pid is the pid seen in the zygote's
+    pid namespace.
+    """
+    def __init__(self, conn, pid):
+        self.conn = conn
+        self.pid = pid
+        self.status = None
+
+    def wait(self):
+        if self.conn is not None:
+            msg = _recv_msg(self.conn)
+            self.conn.close()
+            self.conn = None
+            if msg is None:
+                self.status = -1
+            else:
+                self.status = msg["status"]
+        return self.status
+
+
+class Zygote(object):
+    """
+    a fork server living in new namespaces, or in the namespaces of
+    target_pid when it is given. When exec_server is true, the zygote is
+    a fresh python interpreter rather than a copy of the caller.
+
+    Other keyword arguments are passed to SpawnNamespacesConfig.
+    """
+    def __init__(self, preload=None, target_pid=None, namespaces=None,
+                     socket_path=None, exec_server=True, **kwargs):
+        for key in ["func", "nscmd", "interactive"]:
+            if kwargs.get(key) is not None:
+                raise NamespaceSettingError(
+                    "'%s' cannot be set for the zygote" % key)
+        self.preload = preload or []
+        self.target_pid = target_pid
+        self.namespaces = namespaces
+        self.socket_path = socket_path
+        self.exec_server = exec_server
+        self.config_kwargs = kwargs
+        self.address = None
+        self.control = None
+        self._control_lock = threading.Lock()
+        self.pid = None
+        self.config = None
+
+    def _check_socket_dir(self):
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        result = os.stat(directory)
+        if result.st_uid != os.getuid() or result.st_mode & 0o077:
+            raise NamespaceSettingError(
+                "%s should be a 0700 directory of the zygote owner"
+                % directory)
+
+    def _listen(self):
+        if self.socket_path is None:
+            self.control, listener = socket.socketpair(socket.AF_UNIX,
+                                                       socket.SOCK_STREAM)
+        else:
+            self._check_socket_dir()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.address = self.socket_path
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            umask = os.umask(0o177)
+            try:
+                listener.bind(self.address)
+            finally:
+                os.umask(umask)
+            listener.listen(128)
+        if hasattr(os, "set_inheritable"):
+            os.set_inheritable(listener.fileno(), True)
+        return listener
+
+    def _server_args(self, listener):
+        return [sys.executable, "-m", "procszoo.zygote",
+                    "%d" % listener.fileno()] + self.preload
+
+    def _run_server(self, listener):
+        if self.control is not None:
+            self.control.close()
+        if self.exec_server:
+            os.environ["PYTHONPATH"] = os.pathsep.join(
+                [path for path in sys.path if path])
+            args = self._server_args(listener)
+            os.execv(args[0], args)
+        else:
+            serve(listener, self.preload)
+
+    def _join_namespaces(self):
+        namespaces = self.namespaces
+        if namespaces is None:
+            namespaces = [ns for ns, available in show_namespaces_status()
+                              if available]
+        if "user" in namespaces:
+            namespaces = ["user"] + [ns for ns in namespaces if ns != "user"]
+        for ns in namespaces:
+            setns(pid=self.target_pid, namespace=ns)
+
+    def start(self):
+        listener = self._listen()
+        try:
+            if self.target_pid is None:
+                self._spawn(listener)
+            else:
+                self.pid = _fork()
+                if self.pid == 0:
+                    _exit_forked_child(self._join_and_run, listener)
+        except BaseException:
+            self._close_control()
+            raise
+        finally:
+            listener.close()
+
+    def _join_and_run(self, listener):
+        self._join_namespaces()
+        self._run_server(listener)
+
+    def _spawn(self, listener):
+        config = SpawnNamespacesConfig(
+            namespaces=self.namespaces, interactive=True,
+            func=lambda *args, **kwargs: self._run_server(listener),
+            **self.config_kwargs)
+        config.top_halves_entry_point = config.top_halves_sync
+        config.bottom_halves_entry_point = (
+            lambda *args, **kwargs: _exit_forked_child(
+                config.default_bottom_halves_entry_point, *args, **kwargs))
+        config.entry_point()
+        if config.pidfd is not None:
+            os.close(config.pidfd)
+            config.pidfd = None
+        self.config = config
+        self.pid = config.top_halves_child_pid
+
+    def _connect(self):
+        if self.control is not None:
+            sock, theirs = socket.socketpair(socket.AF_UNIX,
+                                             socket.SOCK_STREAM)
+            try:
+                with self._control_lock:
+                    _send_conn(self.control, theirs)
+            except BaseException:
+                sock.close()
+                raise
+            finally:
+                theirs.close()
+            return sock
+        if self.address is None:
+            raise RuntimeError("zygote has not been started")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.address)
+        return sock
+
+    def _close_control(self):
+        if self.control is not None:
+            self.control.close()
+            self.control = None
+
+    def spawn(self, func, args=None, kwargs=None):
+        if not hasattr(func, '__call__'):
+            raise NamespaceSettingError('handler must be a callable')
+        sock = self._connect()
+        try:
+            _send_msg(sock, {"func": func, "args": args or (),
+                                 "kwargs": kwargs or {}})
+            reply = _recv_msg(sock)
+        except BaseException:
+            sock.close()
+            raise
+        if reply is None:
+            sock.close()
+            raise RuntimeError("zygote exited")
+        if "error" in reply:
+            sock.close()
+            raise RuntimeError("zygote failed: %s" % reply["error"])
+        return ZygoteChild(sock, reply["pid"])
+
+    def close(self):
+        if self.pid is None:
+            return
+        try:
+            sock = self._connect()
+        except socket.error:
+            pass
+        else:
+            _send_msg(sock, {"command": "exit"})
+            sock.close()
+        self._close_control()
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+        self.pid = None
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    listener = socket.fromfd(int(sys.argv[1]), socket.AF_UNIX,
+                                 socket.SOCK_STREAM)
+    os.close(int(sys.argv[1]))
+    serve(listener, sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,7 @@ setup(
         'console_scripts':[
             python_entrypoint("richard_parker", "procszoo.scripts.richard_parker:main"),
             python_entrypoint("mamaji", "procszoo.scripts.mamaji:main"),
+            python_entrypoint("pi_patel", "procszoo.scripts.pi_patel:main"),
             ]
         },
     ext_modules=[
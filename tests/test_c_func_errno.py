@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+import os
+import sys
+import errno
+import tempfile
+import threading
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+results = {}
+
+def call_and_record(name, func, expected, rounds=10000):
+    mismatched = 0
+    for i in range(rounds):
+        try:
+            func()
+        except CFunctionCallFailed as e:
+            if e.errno != expected:
+                mismatched += 1
+        except NamespaceRequireSuperuserPrivilege:
+            mismatched += 1
+    results[name] = mismatched
+
+def mount_with_str_data():
+    """
+    data of mount(2) is a c_void_p, a str there has to become bytes too.
+    """
+    mountpoint = tempfile.mkdtemp(prefix="procszoo-mount-")
+    pid = os.fork()
+    if pid == 0:
+        try:
+            workbench.unshare(["mount"])
+            workbench.mount(mount_type="private", target="/")
+            workbench.mount(source="tmpfs", target=mountpoint,
+                            filesystemtype="tmpfs", data="mode=700")
+            mode = os.stat(mountpoint).st_mode & 0o777
+        except Exception as e:
+            warn("mount: %s" % e)
+            os._exit(1)
+        os._exit(0 if mode == 0o700 else 1)
+    _, status = os.waitpid(pid, 0)
+    os.rmdir(mountpoint)
+    return os.WEXITSTATUS(status) == 0
+
+if __name__ == "__main__":
+    if os.geteuid() == 0 and not mount_with_str_data():
+        warn("mount failed with a str data argument")
+        sys.exit(1)
+
+    threads = [
+        threading.Thread(target=call_and_record, args=(
+            "umount", lambda: workbench._c_func_umount("/nonexistent"),
+            errno.ENOENT)),
+        threading.Thread(target=call_and_record, args=(
+            "setns", lambda: workbench._c_func_setns(-1, 0),
+            errno.EBADF)),
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for name, mismatched in sorted(results.items()):
+        printf("%s: %d calls got a wrong errno" % (name, mismatched))
+    if [v for v in results.values() if v]:
+        sys.exit(1)
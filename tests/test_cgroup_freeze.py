@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.cgroups import *
+from procszoo.utils import *
+
+def spin():
+    while True:
+        pass
+
+def cpu_usage(cgroup):
+    for line in cgroup.read("cpu.stat").splitlines():
+        key, value = line.split()
+        if key == "usage_usec":
+            return int(value)
+
+def play(engine):
+    handle = spawn_sandbox(engine=engine, limits={}, func=spin)
+    cgroup = handle.cgroup
+    time.sleep(0.1)
+
+    if not handle.freeze(timeout=5) or not cgroup.frozen():
+        warn("%s: not frozen" % engine)
+        sys.exit(1)
+    before = cpu_usage(cgroup)
+    time.sleep(0.2)
+    if cpu_usage(cgroup) != before:
+        warn("%s: a frozen sandbox runs" % engine)
+        sys.exit(1)
+
+    policy = IdleReclaimPolicy(threshold=0)
+    reclaimed = policy.apply([handle])
+    has_reclaim = os.path.exists(os.path.join(cgroup.path, "memory.reclaim"))
+    if has_reclaim != bool(reclaimed) or policy.due(handle):
+        warn("%s: reclaimed %r" % (engine, reclaimed))
+        sys.exit(1)
+
+    handle.thaw()
+    if handle.frozen_since is not None or cgroup.frozen():
+        warn("%s: still frozen" % engine)
+        sys.exit(1)
+    time.sleep(0.2)
+    if cpu_usage(cgroup) == before:
+        warn("%s: a thawed sandbox does not run" % engine)
+        sys.exit(1)
+
+    cgroup.write("cgroup.kill", 1)
+    handle.wait()
+    # the sandbox of the fork engine may die after the bottom halves
+    cgroup.wait_event("populated", "0", 5)
+    handle.config.release_cgroup()
+    if cgroup.exists():
+        warn("%s: leaf %s is left" % (engine, cgroup.path))
+        sys.exit(1)
+    printf("%s: frozen, thawed, reclaimed %r" % (engine, reclaimed))
+
+if __name__ == "__main__":
+    try:
+        CgroupRoot().create_leaf().remove()
+    except (NamespaceSettingError, OSError, IOError) as e:
+        warn("%s, quit" % e)
+        sys.exit(0)
+
+    for engine in ["fork", "clone"]:
+        play(engine)
+
+    handle = spawn_sandbox(func=lambda: None)
+    try:
+        handle.freeze()
+    except NamespaceSettingError:
+        pass
+    else:
+        warn("a sandbox without a cgroup is frozen")
+        sys.exit(1)
+    finally:
+        handle.wait()
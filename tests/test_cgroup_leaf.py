@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import asyncio
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.cgroups import *
+from procszoo.cgroups import _format_limit
+from procszoo.utils import *
+
+def read_cgroupfs(write_fd):
+    fo = open("/proc/self/cgroup", "r")
+    own = fo.read().splitlines()[-1]
+    fo.close()
+    fo = open("/sys/fs/cgroup/cgroup.max.descendants", "r")
+    descendants = fo.read().strip()
+    fo.close()
+    os.write(write_fd, to_bytes("%s %s\n" % (own, descendants)))
+    sys.exit(0)
+
+def limits_of(root):
+    """
+    the limits of controllers that the host has, cgroup.max.descendants
+    is of the core, it is always there.
+    """
+    limits = {"cgroup.max.descendants": 3}
+    controllers = root.controllers()
+    if "pids" in controllers:
+        limits["pids.max"] = 64
+    if "memory" in controllers:
+        limits["memory.max"] = "256M"
+    if "cpu" in controllers:
+        limits["cpu.max"] = 0.5
+    return limits
+
+def spawn_in_leaf(engine, root, limits):
+    r, w = os.pipe()
+    handle = spawn_sandbox(engine=engine, cgroup_root=root.path,
+                           limits=limits, cgroupfs=True,
+                           func=lambda: read_cgroupfs(w))
+    os.close(w)
+    leaf = handle.config.cgroup_leaf
+    handle.wait()
+    fo = os.fdopen(r, "r")
+    own, descendants = fo.read().split()
+    fo.close()
+
+    if handle.exit_code != 0:
+        warn("%s: sandbox exit code %d" % (engine, handle.exit_code))
+        sys.exit(1)
+    if own != "0::/" or descendants != "3":
+        warn("%s: sandbox sees %s %s" % (engine, own, descendants))
+        sys.exit(1)
+    if leaf.exists() or handle.config.cgroup_leaf is not None:
+        warn("%s: leaf %s is left" % (engine, leaf.path))
+        sys.exit(1)
+    printf("%s: %s" % (engine, ", ".join(sorted(limits))))
+
+def spawn_public(root, limits):
+    """
+    the same through the public spawn_namespaces(), whose children unwind
+    through our frames.
+    """
+    r, w = os.pipe()
+    pid = os.getpid()
+    try:
+        spawn_namespaces(cgroup_root=root.path, limits=limits, cgroupfs=True,
+                         func=lambda: read_cgroupfs(w))
+    finally:
+        if os.getpid() != pid:
+            os._exit(1)
+    os.close(w)
+    fo = os.fdopen(r, "r")
+    own, descendants = fo.read().split()
+    fo.close()
+    if own != "0::/" or descendants != "3" or leaves_of(root, pid):
+        warn("spawn_namespaces: sandbox sees %s %s" % (own, descendants))
+        sys.exit(1)
+    printf("spawn_namespaces: %s" % ", ".join(sorted(limits)))
+
+def leaves_of(root, pid):
+    prefix = "procszoo-%d-" % pid
+    return [name for name in os.listdir(root.path) if name.startswith(prefix)]
+
+def release_in_other_paths(root):
+    """
+    the leaves of async and batch mode sandboxes are released too.
+    """
+    from procszoo.aio import spawn_namespaces_async
+
+    async def spawn_and_wait():
+        sandbox = await spawn_namespaces_async(cgroup_root=root.path,
+                                               limits={}, func=lambda: None)
+        await sandbox
+        return sandbox.config
+
+    config = asyncio.run(spawn_and_wait())
+    if config.cgroup_leaf is not None or leaves_of(root, os.getpid()):
+        warn("async: leaf is left")
+        sys.exit(1)
+
+    for engine in ["fork", "clone"]:
+        pid = os.fork()
+        if pid == 0:
+            # batch mode exits the caller
+            SpawnNamespacesConfig(engine=engine, interactive=False,
+                                  cgroup_root=root.path, limits={},
+                                  func=lambda: time.sleep(0.3)).entry_point()
+            os._exit(1)
+        os.waitpid(pid, 0)
+        deadline = time.time() + 5
+        while leaves_of(root, pid) and time.time() < deadline:
+            time.sleep(0.05)
+        if leaves_of(root, pid):
+            warn("%s batch: leaf is left" % engine)
+            sys.exit(1)
+    printf("async and batch leaves released")
+
+def check_format():
+    formats = [("cpu.max", 0.5, ["50000 100000"]),
+               ("cpu.max", (20000, 50000), ["20000 50000"]),
+               ("memory.max", None, ["max"]),
+               ("pids.max", 64, ["64"]),
+               ("io.max", {"8:0": {"wbps": 1024, "riops": 10}},
+                    ["8:0 riops=10 wbps=1024"])]
+    for key, value, lines in formats:
+        if _format_limit(key, value) != lines:
+            warn("%s %r: %r" % (key, value, _format_limit(key, value)))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    check_format()
+    if not cgroup_namespace_available():
+        warn("cgroup namespace unavailable, quit")
+        sys.exit(0)
+    if cgroup2_mountpoint() is None:
+        warn("no cgroup v2 hierarchy, quit")
+        sys.exit(0)
+    try:
+        root = CgroupRoot()
+        root.create_leaf().remove()
+    except NamespaceSettingError as e:
+        warn("%s, quit" % e)
+        sys.exit(0)
+
+    limits = limits_of(root)
+    for engine in ["fork", "clone"]:
+        spawn_in_leaf(engine, root, limits)
+    spawn_public(root, limits)
+    release_in_other_paths(root)
+
+    for controller in ["pids", "memory", "cpu"]:
+        if controller not in root.controllers():
+            try:
+                root.create_leaf(limits={"%s.max" % controller: 1})
+            except NamespaceSettingError:
+                pass
+            else:
+                warn("%s.max without the %s controller is accepted"
+                         % (controller, controller))
+                sys.exit(1)
+            break
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+def demo():
+    pass
+
+def show_ids():
+    printf("pid: %d, uid: %d, procs: %s"
+               % (os.getpid(), os.getuid(), ", ".join(os.listdir("/proc")[:3])))
+
+if __name__ == "__main__":
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    rounds = 50
+    for engine in ["fork", "clone"]:
+        try:
+            spawn_namespaces(maproot=maproot, func=demo, engine=engine)
+            begin = time.time()
+            for i in range(rounds):
+                spawn_namespaces(maproot=maproot, func=demo, engine=engine)
+        except NamespaceRequireSuperuserPrivilege as e:
+            warn(e)
+            sys.exit(1)
+        printf("%-5s engine: %.6fs per spawn"
+                   % (engine, (time.time() - begin) / rounds))
+
+    spawn_namespaces(maproot=maproot, func=show_ids, engine="clone")
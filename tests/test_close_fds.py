@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import resource
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+def close_by_loop(keep_fds, cloexec):
+    for fd in range(3, resource.getrlimit(resource.RLIMIT_NOFILE)[0]):
+        if fd in keep_fds:
+            continue
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+def open_fds(nofile):
+    fd = os.open("/dev/null", os.O_RDONLY)
+    fds = [fd]
+    for target in [10, 100, nofile // 2, nofile - 1]:
+        fds.append(os.dup2(fd, target) or target)
+    return fds
+
+def run(nofile, name, func):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (nofile, nofile))
+        except ValueError as e:
+            printf("nofile %-8d %-6s skipped: %s" % (nofile, name, e))
+            os._exit(0)
+        fds = open_fds(nofile)
+        keep_fds = [fds[1]]
+        begin = time.time()
+        func(keep_fds, False)
+        cost = time.time() - begin
+        left = []
+        for fd in fds:
+            try:
+                os.fstat(fd)
+            except OSError:
+                continue
+            left.append(fd)
+        ok = left == keep_fds
+        printf("nofile %-8d %-6s %.6fs %s" % (
+            nofile, name, cost, "ok" if ok else "failed: %s" % left))
+        os._exit(0 if ok else 1)
+    return os.waitpid(pid, 0)[1]
+
+if __name__ == "__main__":
+    status = 0
+    for nofile in [1024, 16384, 65536, 1048576]:
+        status |= run(nofile, "range", lambda keep, cloexec:
+                          workbench._close_fds_by_range(keep, cloexec, 3))
+        status |= run(nofile, "walk", lambda keep, cloexec:
+                          workbench._close_fds_by_walk(keep, cloexec, 3))
+        status |= run(nofile, "loop", close_by_loop)
+    sys.exit(status and 1)
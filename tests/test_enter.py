@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+def in_child(func, *args):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func(*args)
+        except Exception as e:
+            warn(e)
+            os._exit(1)
+        os._exit(0)
+    return os.WEXITSTATUS(os.waitpid(pid, 0)[1])
+
+def enter_and_check(target, namespaces, pid):
+    entered = enter(target, namespaces)
+    printf("entered %s" % ", ".join(entered))
+    for ns in namespaces:
+        entry = get_namespace(ns).entry
+        if os.stat("/proc/self/ns/%s" % entry).st_ino != os.stat(
+                "/proc/%d/ns/%s" % (pid, entry)).st_ino:
+            raise RuntimeError("%s namespace not entered" % ns)
+    if enter(target, namespaces):
+        raise RuntimeError("entered twice")
+
+    # our pid is not in the procfs of the sandbox
+    if enter(target, ["mount"]) != ["mount"]:
+        raise RuntimeError("mount namespace not entered")
+
+if __name__ == "__main__":
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    try:
+        sandbox = spawn_sandbox(maproot=maproot,
+                                    func=lambda: time.sleep(60))
+    except NamespaceRequireSuperuserPrivilege as e:
+        warn(e)
+        sys.exit(1)
+    pid = sandbox.config.bottom_halves_child_pid
+    namespaces = [ns for ns in ["user", "net", "uts", "ipc"]
+                      if ns in sandbox.config.namespaces]
+
+    code = in_child(enter_and_check, pid, namespaces, pid)
+    code += in_child(enter_and_check, sandbox, namespaces, pid)
+    handles = [NamespaceHandle.open(ns, pid=pid)
+                   for ns in namespaces + ["mount"]]
+    code += in_child(enter_and_check, handles, namespaces, pid)
+    for handle in handles:
+        handle.close()
+
+    sandbox.kill()
+    os.kill(pid, 9)
+    sandbox.wait()
+    if code:
+        sys.exit(1)
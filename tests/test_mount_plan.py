@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import os
+import sys
+import errno
+import shutil
+import tempfile
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.mounts import *
+from procszoo.utils import *
+
+def check(root):
+    fo = open(os.path.join(root, "ro/hello"))
+    try:
+        if fo.read() != "hello":
+            sys.exit(2)
+    finally:
+        fo.close()
+    try:
+        open(os.path.join(root, "ro/new"), "w").close()
+    except (IOError, OSError) as e:
+        if e.errno != errno.EROFS:
+            sys.exit(3)
+    else:
+        sys.exit(3)
+    open(os.path.join(root, "tmp/new"), "w").close()
+    if not os.path.exists(os.path.join(root, "proc/self")):
+        sys.exit(4)
+    sys.exit(0)
+
+def check_and_report(root, write_fd):
+    try:
+        check(root)
+    except SystemExit as e:
+        os.write(write_fd, to_bytes("%s" % e.code))
+        os._exit(e.code)
+
+def spawn_and_report(root, **kwargs):
+    """
+    the children of spawn_namespaces() unwind through our frames,
+    they must not get out of here.
+    """
+    r, w = os.pipe()
+    pid = os.getpid()
+    try:
+        spawn_namespaces(func=lambda: check_and_report(root, w), **kwargs)
+    finally:
+        if os.getpid() != pid:
+            os._exit(1)
+    os.close(w)
+    fo = os.fdopen(r, "r")
+    try:
+        return fo.read()
+    finally:
+        fo.close()
+
+def apply_legacy(plan, root):
+    namespaces = ["mount"]
+    if os.geteuid() != 0:
+        namespaces = ["user"] + namespaces
+    workbench.unshare(namespaces)
+    workbench.set_propagation("private")
+    plan.apply(use_mount_api=False)
+    check(root)
+
+if __name__ == "__main__":
+    if os.geteuid() != 0 and not user_namespace_available():
+        warn("need superuser privilege or user namespaces, quit")
+        sys.exit(1)
+
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    workdir = tempfile.mkdtemp(prefix="procszoo-mounts-")
+    try:
+        src = os.path.join(workdir, "src")
+        root = os.path.join(workdir, "root")
+        for path in [src, root] + [os.path.join(root, name)
+                                       for name in ["ro", "tmp", "proc"]]:
+            os.mkdir(path)
+        fo = open(os.path.join(src, "hello"), "w")
+        fo.write("hello")
+        fo.close()
+
+        plan = MountPlan()
+        plan.bind(src, os.path.join(root, "ro"), attrs=["ro", "nodev"])
+        plan.tmpfs(os.path.join(root, "tmp"), size="1M")
+        plan.proc(os.path.join(root, "proc"))
+        prepared = plan.prepare()
+        printf("new mount API: %s" % mount_api_available())
+
+        failed = False
+        for name, mounts in [("plan", plan), ("prepared", prepared)]:
+            for engine in ["fork", "clone"]:
+                try:
+                    handle = spawn_sandbox(maproot=maproot, mounts=mounts,
+                                           func=lambda: check(root),
+                                           engine=engine)
+                except NamespaceRequireSuperuserPrivilege as e:
+                    warn(e)
+                    sys.exit(1)
+                handle.wait()
+                printf("%s, %s: exit code %d" % (name, engine,
+                                                     handle.exit_code))
+                failed = failed or handle.exit_code != 0
+
+        # the same through the public spawn_namespaces()
+        code = spawn_and_report(root, maproot=maproot, mounts=prepared)
+        printf("spawn_namespaces: exit code %s" % code)
+        failed = failed or code != "0"
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                apply_legacy(plan, root)
+            except SystemExit as e:
+                os._exit(e.code)
+            finally:
+                os._exit(1)
+        status = os.waitpid(pid, 0)[1]
+        printf("mount(2) fallback: exit code %d" % os.WEXITSTATUS(status))
+        failed = failed or status != 0
+        prepared.close()
+
+        if os.path.exists(os.path.join(root, "tmp/new")):
+            warn("mounts leaked out of the sandboxes")
+            failed = True
+        if failed:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.mountinfo import *
+from procszoo.utils import *
+
+LINES = [
+    "20 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw",
+    "21 20 0:5 / /proc rw,nosuid shared:2 - proc proc rw",
+    "22 20 0:6 / /mnt/with\\040space ro master:1 - tmpfs none rw,size=1k",
+    "23 22 0:7 / /mnt/with\\040space/sub rw - tmpfs none rw",
+    "24 22 0:8 / /mnt/with\\040space rw unbindable - tmpfs none rw",
+]
+
+def check_parser():
+    table = MountTable(iter_mountinfo(LINES))
+    mount = table.find("/mnt/with space/sub/dir")
+    if mount.mount_id != 23:
+        sys.exit(2)
+    if table.get("/mnt/with space").mount_id != 24:
+        sys.exit(3)
+    if [m.mount_id for m in table.umount_order("/mnt/with space")] != [
+            24, 23, 22]:
+        sys.exit(4)
+    if table.propagation("/proc/1") != "shared":
+        sys.exit(5)
+    if table.by_id[22].propagation != "slave" or not table.by_id[22].readonly:
+        sys.exit(6)
+    if table.all_propagation("private", "/mnt"):
+        sys.exit(7)
+
+def play():
+    namespaces = ["mount"]
+    if os.geteuid() != 0:
+        namespaces = ["user"] + namespaces
+    unshare(namespaces)
+    workbench.set_propagation("private")
+
+    table = MountTable.read()
+    if not table.all_propagation("private"):
+        sys.exit(10)
+    enable_stats()
+    workbench.set_propagation("private", table=table)
+    if "mount" in get_stats():
+        sys.exit(11)
+
+    top = tempfile.mkdtemp(prefix="procszoo-mountinfo-")
+    paths = [top, top, os.path.join(top, "a"), os.path.join(top, "a/b")]
+    for path in paths:
+        if not os.path.isdir(path):
+            os.mkdir(path)
+        mount(source="none", target=path, filesystemtype="tmpfs",
+              mount_type="unchanged")
+    table = MountTable.read()
+    if len(table.subtree(top)) != 4:
+        sys.exit(12)
+    mountpoints = umount_tree(top)
+    printf("unmounted %s" % ", ".join(mountpoints))
+    if top in MountTable.read():
+        sys.exit(13)
+    os.rmdir(top)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    check_parser()
+    table = MountTable.read()
+    printf("%d mounts, / is %s" % (len(table), table.propagation("/")))
+
+    if os.geteuid() != 0 and not user_namespace_available():
+        warn("need superuser privilege or user namespaces, quit")
+        sys.exit(1)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            play()
+        except SystemExit as e:
+            os._exit(e.code)
+        finally:
+            os._exit(1)
+    status = os.waitpid(pid, 0)[1]
+    if status != 0:
+        warn("exit status %d" % os.WEXITSTATUS(status))
+        sys.exit(1)
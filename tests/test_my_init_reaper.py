@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+ORPHANS = 300
+
+def run(script):
+    handle = spawn_sandbox(nscmd=["sh", "-c", script])
+    handle.wait()
+    return handle.exit_code
+
+if __name__ == "__main__":
+    if not pid_namespace_available():
+        warn("pid namespace unavailable, quit")
+        sys.exit(0)
+
+    # my_init adopts and reaps the orphans while it waits for sh
+    started = time.time()
+    exit_code = run("for i in $(seq %d); do (true &); done; "
+                    "sleep 0.2 & wait; exit 7" % ORPHANS)
+    elapsed = time.time() - started
+    printf("%d orphans reaped in %.3fs" % (ORPHANS, elapsed))
+    if exit_code != 7:
+        warn("exit code %s" % exit_code)
+        sys.exit(1)
+
+    # the main command exits while a child of it still runs
+    started = time.time()
+    exit_code = run("sleep 100 & exit 3")
+    if exit_code != 3 or time.time() - started > 4:
+        warn("exit code %s in %.3fs" % (exit_code, time.time() - started))
+        sys.exit(1)
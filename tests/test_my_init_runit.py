@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import select
+import struct
+import shutil
+import tempfile
+from importlib.machinery import SourceFileLoader
+
+this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+my_init_path = os.path.abspath("%s/../procszoo/scripts/my_init"
+                                   % this_file_absdir)
+my_init = SourceFileLoader("my_init", my_init_path).load_module()
+my_init.log_level = my_init.LOG_LEVEL_ERROR
+
+SERVICES = 20
+STOP_DELAY = 0.3
+
+def write_status(supervise, pid, want, state):
+    data = struct.pack(my_init.RUNIT_STATUS_FORMAT, b"\0" * 12, pid, 0,
+                       want, 0, state)
+    path = os.path.join(supervise, "status.new")
+    with open(path, "wb") as f:
+        f.write(data)
+    os.rename(path, os.path.join(supervise, "status"))
+
+def fake_runsv(supervise):
+    """
+    what runsv does for sv down: read "d" from supervise/control, stop
+    the service and rename a new supervise/status.
+    """
+    control = os.path.join(supervise, "control")
+    fd = os.open(control, os.O_RDONLY | os.O_NONBLOCK)
+    write_status(supervise, os.getpid(), b"u", 1)
+    keep = os.open(control, os.O_WRONLY)
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    while True:
+        poller.poll()
+        if b"d" in os.read(fd, 64):
+            break
+    time.sleep(STOP_DELAY)
+    write_status(supervise, 0, b"d", 0)
+    os.close(keep)
+    os.close(fd)
+
+def play():
+    service_dir = tempfile.mkdtemp(prefix="procszoo-service-")
+    pids = []
+    for i in range(SERVICES):
+        supervise = os.path.join(service_dir, "svc%d" % i, "supervise")
+        os.makedirs(supervise)
+        os.mkfifo(os.path.join(supervise, "control"))
+        pid = os.fork()
+        if pid == 0:
+            try:
+                fake_runsv(supervise)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    services = my_init.runit_services(service_dir)
+    deadline = time.time() + 5
+    while [s for s in services if s.is_down()] and time.time() < deadline:
+        time.sleep(0.01)
+
+    started = time.time()
+    my_init.shutdown_runit_services(True, service_dir)
+    my_init.wait_for_runit_services(service_dir)
+    elapsed = time.time() - started
+    for pid in pids:
+        os.waitpid(pid, 0)
+    down = [s for s in services if s.is_down()]
+    shutil.rmtree(service_dir)
+
+    print("%d services down in %.3fs" % (len(down), elapsed))
+    if len(down) != SERVICES:
+        sys.exit(1)
+    if elapsed < STOP_DELAY or elapsed > STOP_DELAY + 0.5:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    play()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import shutil
+import tempfile
+from importlib.machinery import SourceFileLoader
+
+this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+my_init_path = os.path.abspath("%s/../procszoo/scripts/my_init"
+                                   % this_file_absdir)
+my_init = SourceFileLoader("my_init", my_init_path).load_module()
+my_init.log_level = my_init.LOG_LEVEL_ERROR
+
+DELAY = 0.3
+
+SCRIPTS = {
+    # three scripts of one level run together
+    "10_a": "sleep %s; echo a > $ENV_DIR/A" % DELAY,
+    "10_b": "sleep %s; echo b > $ENV_DIR/B" % DELAY,
+    "10_c": "sleep %s; echo c > $ENV_DIR/C" % DELAY,
+    # the next level sees what they exported
+    "20_d": "test \"$A$B$C\" = abc && echo d > $ENV_DIR/D",
+    # a header overrides the levels
+    "05_e": "# my_init-after: 20_d\ntest \"$D\" = d && echo e > $ENV_DIR/E",
+}
+
+def write_scripts(directory, scripts):
+    for name, body in scripts.items():
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n%s\n" % body)
+        os.chmod(path, 0o755)
+
+def play(workers):
+    startup_dir = tempfile.mkdtemp(prefix="procszoo-my_init.d-")
+    env_dir = tempfile.mkdtemp(prefix="procszoo-environment-")
+    write_scripts(startup_dir, SCRIPTS)
+    for name in ["PATH", "ENV_DIR"]:
+        with open(os.path.join(env_dir, name), "w") as f:
+            f.write({"PATH": os.environ["PATH"], "ENV_DIR": env_dir}[name])
+
+    my_init.container_environment = my_init.ContainerEnvironment(env_dir)
+    my_init.import_envvars()
+    started = time.time()
+    my_init.run_startup_scripts(startup_dir, workers)
+    elapsed = time.time() - started
+    with open(env_dir + ".sh") as f:
+        exported = f.read()
+    shutil.rmtree(startup_dir)
+    shutil.rmtree(env_dir)
+    os.unlink(env_dir + ".sh")
+    os.unlink(env_dir + ".json")
+
+    print("%d workers: %.3fs" % (workers, elapsed))
+    if os.environ.get("E") != "e" or "export E=e" not in exported:
+        print("environment %r" % dict(os.environ))
+        sys.exit(1)
+    return elapsed
+
+def failing():
+    startup_dir = tempfile.mkdtemp(prefix="procszoo-my_init.d-")
+    write_scripts(startup_dir, {"10_fail": "exit 3", "10_slow": "sleep 100"})
+    started = time.time()
+    try:
+        my_init.run_startup_scripts(startup_dir, 2)
+    except SystemExit:
+        pass
+    else:
+        print("a failed script did not stop the startup")
+        sys.exit(1)
+    finally:
+        shutil.rmtree(startup_dir)
+    if time.time() - started > my_init.KILL_PROCESS_TIMEOUT:
+        print("a running script was not stopped")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    my_init.reaper = my_init.Reaper()
+    sequential = play(1)
+    parallel = play(3)
+    if sequential < 3 * DELAY or parallel > 2 * DELAY:
+        sys.exit(1)
+    failing()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import signal
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+def enter_net(pid, count):
+    for i in range(count):
+        setns(pid=pid, namespace="net")
+
+def unshare_net_on_sigusr1(ready):
+    signal.signal(signal.SIGUSR1,
+                  lambda signum, frame: workbench.unshare(["net"]))
+    os.write(ready, b"x")
+    time.sleep(60)
+
+if __name__ == "__main__":
+    if not net_namespace_available():
+        warn("net namespace unavailable, quit")
+        sys.exit(1)
+
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    try:
+        sandbox = spawn_sandbox(maproot=maproot, func=lambda: time.sleep(60))
+    except NamespaceRequireSuperuserPrivilege as e:
+        warn(e)
+        sys.exit(1)
+    pid = sandbox.config.bottom_halves_child_pid
+
+    handle = open_namespace("net", pid=pid)
+    mine = open_namespace("net")
+    printf("%s, and ours %s" % (handle, mine))
+    if handle.identity == mine.identity:
+        sys.exit(1)
+
+    fds = len(os.listdir("/proc/self/fd"))
+    pid_child = os.fork()
+    if pid_child == 0:
+        if user_namespace_available() and os.geteuid() != 0:
+            setns(pid=pid, namespace="user")
+        started = time.time()
+        enter_net(pid, 1000)
+        printf("1000 setns(pid=...) in %.3fs" % (time.time() - started))
+        if open_namespace("net").identity != handle.identity:
+            os._exit(1)
+        os._exit(0)
+    if os.waitpid(pid_child, 0)[1] != 0:
+        sys.exit(1)
+    if len(os.listdir("/proc/self/fd")) != fds:
+        warn("setns leaks descriptors")
+        sys.exit(1)
+
+    # the handles of a pid share a pidfd, pidfds count against max_fds
+    cache = NamespaceHandleCache(max_fds=4)
+    for ns in ["net", "uts", "ipc", "mount", "pid"]:
+        cache.get(ns, pid)
+    printf("%d handles in %d descriptors" % (len(cache), cache.fds()))
+    if cache.fds() > 4 or len(cache.processes) != 1:
+        sys.exit(1)
+    cache.clear()
+    if cache.fds():
+        sys.exit(1)
+
+    # a pid that unshares is followed to its new namespace
+    r, w = os.pipe()
+    mover = spawn_sandbox(maproot=maproot,
+                          func=lambda: unshare_net_on_sigusr1(w))
+    os.close(w)
+    os.read(r, 1)
+    os.close(r)
+    mover_pid = mover.config.bottom_halves_child_pid
+    before = workbench.namespace_handles.get("net", mover_pid).identity
+    os.kill(mover_pid, signal.SIGUSR1)
+    path = "/proc/%d/ns/net" % mover_pid
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        with open_namespace("net", path=path) as current:
+            if current.identity != before:
+                break
+        time.sleep(0.01)
+    after = workbench.namespace_handles.get("net", mover_pid).identity
+    with open_namespace("net", path=path) as current:
+        if before == after or after != current.identity:
+            warn("a stale namespace of pid %d is cached" % mover_pid)
+            sys.exit(1)
+    os.kill(mover_pid, 9)
+    mover.wait()
+
+    os.kill(pid, 9)
+    sandbox.wait()
+    if handle.valid():
+        warn("the exited pid is not detected")
+        sys.exit(1)
+    try:
+        setns(pid=pid, namespace="net")
+    except OSError:
+        printf("pid %d exited, its cached handle is dropped" % pid)
+    else:
+        sys.exit(1)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.rootfs import *
+from procszoo.mounts import *
+from procszoo.utils import *
+
+def write_file(path, content):
+    fo = open(path, "w")
+    try:
+        fo.write(content)
+    finally:
+        fo.close()
+
+def read_file(path):
+    fo = open(path, "r")
+    try:
+        return fo.read()
+    finally:
+        fo.close()
+
+def make_layer(workdir, name, files):
+    top = os.path.join(workdir, name)
+    os.mkdir(top)
+    for path, content in files.items():
+        path = os.path.join(top, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        write_file(path, content)
+    return top
+
+def in_rootfs():
+    if read_file("/a") != "top":
+        sys.exit(2)
+    if read_file("/etc/hostname") != "base":
+        sys.exit(3)
+    if os.path.exists("/.old-root"):
+        sys.exit(4)
+    if not os.path.exists("/proc/self"):
+        sys.exit(5)
+    write_file("/etc/hostname", "changed")
+    sys.exit(0)
+
+def run_nscmd(workdir, store, maproot):
+    """
+    nscmd runs in the rootfs through the public spawn_namespaces(), the
+    host /usr is bound in for a shell.
+    """
+    if not os.path.isdir("/usr/bin") or not os.path.exists("/bin/sh"):
+        return
+    layer = os.path.join(workdir, "usr-layer")
+    os.makedirs(os.path.join(layer, "usr"))
+    os.mkdir(os.path.join(layer, "tmp"))
+    for name in ["bin", "lib", "lib64", "sbin"]:
+        if os.path.islink("/%s" % name):
+            os.symlink(os.readlink("/%s" % name), os.path.join(layer, name))
+    plan = MountPlan()
+    plan.bind("/usr", "/usr", attrs=["ro"])
+
+    r, w = os.pipe()
+    if hasattr(os, "set_inheritable"):
+        os.set_inheritable(w, True)
+    pid = os.getpid()
+    try:
+        spawn_namespaces(
+            maproot=maproot, mounts=plan,
+            rootfs=Rootfs([store.import_dir(layer)], store=store),
+            nscmd=["/bin/sh", "-c", "echo $$ >&%d" % w])
+    finally:
+        # the children of spawn_namespaces() unwind through our frames
+        if os.getpid() != pid:
+            os._exit(1)
+    os.close(w)
+    fo = os.fdopen(r, "r")
+    output = fo.read().strip()
+    fo.close()
+    if output != "1":
+        warn("nscmd in the rootfs: %r" % output)
+        sys.exit(1)
+    printf("nscmd in the rootfs: pid %s" % output)
+
+if __name__ == "__main__":
+    if os.geteuid() != 0 and not user_namespace_available():
+        warn("need superuser privilege or user namespaces, quit")
+        sys.exit(1)
+
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    workdir = tempfile.mkdtemp(prefix="procszoo-rootfs-")
+    try:
+        store = LayerStore(os.path.join(workdir, "store"))
+        base = store.import_dir(make_layer(workdir, "base",
+            {"a": "base", "etc/hostname": "base"}))
+        top = store.import_dir(make_layer(workdir, "top", {"a": "top"}))
+        if store.import_dir(os.path.join(workdir, "base")) != base:
+            warn("importing the same dir twice gives another layer")
+            sys.exit(1)
+        printf("layers: %s" % ", ".join(store.digests()))
+
+        rootfs = Rootfs([base, top], store=store)
+        for engine in ["fork", "clone"]:
+            try:
+                handle = spawn_sandbox(maproot=maproot, rootfs=rootfs,
+                                       func=in_rootfs, engine=engine,
+                                       timing=True)
+            except NamespaceRequireSuperuserPrivilege as e:
+                warn(e)
+                sys.exit(1)
+            handle.wait()
+            if handle.exit_code != 0:
+                warn("%s: sandbox exit code %d" % (engine, handle.exit_code))
+                sys.exit(1)
+            for timing in handle.config.timings:
+                if timing["phase"] == "rootfs":
+                    printf("%s: rootfs set up in %.3fms" % (engine,
+                        (timing["end"] - timing["begin"]) * 1000))
+
+        run_nscmd(workdir, store, maproot)
+
+        path = os.path.join(store.layer_path(base), "etc/hostname")
+        if read_file(path) != "base":
+            warn("the sandbox wrote to a lower layer")
+            sys.exit(1)
+        printf("done")
+    finally:
+        shutil.rmtree(workdir)
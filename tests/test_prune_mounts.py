@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import tempfile
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.mounts import MountPlan
+from procszoo.utils import *
+
+def count_mounts(write_fd):
+    started = time.time()
+    count = len(MountTable.read())
+    os.write(write_fd, to_bytes("%d %f\n" % (count, time.time() - started)))
+    if not os.path.exists("/proc/self") or not os.path.isdir("/tmp"):
+        sys.exit(2)
+    sys.exit(0)
+
+def sandbox_mounts(prune_mounts):
+    r, w = os.pipe()
+    handle = spawn_sandbox(maproot=False, negative_namespaces=["user"],
+                           prune_mounts=prune_mounts,
+                           func=lambda: count_mounts(w))
+    os.close(w)
+    handle.wait()
+    fo = os.fdopen(r, "r")
+    count, elapsed = fo.read().split()
+    fo.close()
+    if handle.exit_code != 0:
+        warn("sandbox exit code %d" % handle.exit_code)
+        sys.exit(1)
+    return int(count), float(elapsed)
+
+def public_sandbox_mounts():
+    """
+    the same through the public spawn_namespaces(), whose children unwind
+    through our frames.
+    """
+    r, w = os.pipe()
+    pid = os.getpid()
+    try:
+        spawn_namespaces(maproot=False, negative_namespaces=["user"],
+                         prune_mounts=True, func=lambda: count_mounts(w))
+    finally:
+        if os.getpid() != pid:
+            os._exit(1)
+    os.close(w)
+    fo = os.fdopen(r, "r")
+    count = int(fo.read().split()[0])
+    fo.close()
+    return count
+
+def play():
+    unshare(["mount"])
+    workbench.set_propagation("private")
+    top = tempfile.mkdtemp(prefix="procszoo-prune-")
+    mount(source="none", target=top, filesystemtype="tmpfs",
+          mount_type="unchanged")
+    for i in range(200):
+        path = os.path.join(top, "%d" % i)
+        os.mkdir(path)
+        mount(source="none", target=path, filesystemtype="tmpfs",
+              mount_type="unchanged")
+
+    before = sandbox_mounts(None)
+    after = sandbox_mounts(True)
+    if public_sandbox_mounts() != after[0]:
+        warn("spawn_namespaces(prune_mounts=True) does not prune")
+        sys.exit(1)
+    printf("without pruning: %d mounts, reading mountinfo %.3fms"
+               % (before[0], before[1] * 1000))
+    printf("with pruning: %d mounts, reading mountinfo %.3fms"
+               % (after[0], after[1] * 1000))
+
+    # the sources of the mount plan are pruned after they are bound
+    target = tempfile.mkdtemp(prefix="procszoo-prune-target-")
+    submount = os.path.join(target, "7")
+    handle = spawn_sandbox(maproot=False, negative_namespaces=["user"],
+                           prune_mounts=True,
+                           mounts=MountPlan().bind(top, target),
+                           func=lambda: sys.exit(
+                               0 if os.path.ismount(submount) else 3))
+    handle.wait()
+    os.rmdir(target)
+    if handle.exit_code != 0:
+        warn("a bind source of the mount plan is pruned")
+        sys.exit(1)
+
+    umount_tree(top, "detach")
+    os.rmdir(top)
+    if after[0] >= before[0] - 200:
+        sys.exit(1)
+
+    try:
+        SpawnNamespacesConfig(prune_mounts=True).parse_conf()
+    except NamespaceSettingError:
+        pass
+    else:
+        warn("prune_mounts in a user namespace is accepted")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if os.geteuid() != 0:
+        warn("need superuser privilege, quit")
+        sys.exit(1)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            play()
+            os._exit(0)
+        except SystemExit as e:
+            os._exit(e.code)
+        finally:
+            os._exit(1)
+    status = os.waitpid(pid, 0)[1]
+    sys.exit(os.WEXITSTATUS(status))
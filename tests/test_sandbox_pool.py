@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+def demo(idx):
+    printf("sandbox %d: pid %d" % (idx, os.getpid()))
+
+if __name__ == "__main__":
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    try:
+        pool = SandboxPool(high_watermark=4, low_watermark=2, max_age=60,
+                               maproot=maproot)
+        pool.start()
+    except NamespaceRequireSuperuserPrivilege as e:
+        warn(e)
+        sys.exit(1)
+
+    printf("%d sandboxes parked" % len(pool))
+    for idx in range(6):
+        begin = time.time()
+        sandbox = pool.spawn(func=demo, args=(idx,))
+        status = sandbox.wait()
+        printf("sandbox %d exit status: %d, cost %.6fs"
+                   % (idx, status, time.time() - begin))
+
+    sandbox = pool.spawn(nscmd=["hostname"])
+    printf("nscmd exit status: %d" % (sandbox.wait() >> 8))
+    pool.close()
+    printf("%d sandboxes parked after close" % len(pool))
+
+    pool = SandboxPool(high_watermark=2, engine="clone", maproot=maproot)
+    pool.start()
+    sandbox = pool.spawn(func=demo, args=(0,))
+    status = sandbox.wait()
+    printf("clone engine sandbox exit status: %d" % status)
+    pool.close()
+    if status != 0:
+        sys.exit(1)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import signal
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+def demo(idx):
+    time.sleep(0.1 * (idx % 3))
+    sys.exit(idx)
+
+def sleeper():
+    time.sleep(60)
+
+if __name__ == "__main__":
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    supervisor = SandboxSupervisor()
+    try:
+        for idx in range(10):
+            supervisor.add(spawn_sandbox(
+                maproot=maproot, func=lambda idx=idx: demo(idx),
+                engine=["fork", "clone"][idx % 2]))
+        handle = supervisor.add(spawn_sandbox(maproot=maproot, func=sleeper))
+    except NamespaceRequireSuperuserPrivilege as e:
+        warn(e)
+        sys.exit(1)
+
+    handle.send_signal(signal.SIGKILL)
+    rounds = 0
+    codes = []
+    while supervisor:
+        finished = supervisor.poll()
+        rounds += 1
+        for h in finished:
+            codes.append(h.exit_code)
+            printf("pid %d exit code %d, maxrss %dkB"
+                       % (h.pid, h.exit_code, h.rusage.ru_maxrss))
+    printf("%d sandboxes reaped in %d passes" % (len(codes), rounds))
+    supervisor.close()
+    if sorted(codes) != sorted(list(range(10)) + [137]):
+        sys.exit(1)
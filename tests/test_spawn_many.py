@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+def demo(idx):
+    sys.exit(idx)
+
+if __name__ == "__main__":
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    count = 64
+    overrides = [{"func": lambda idx=idx: demo(idx % 100)}
+                     for idx in range(count)]
+    for engine in ["fork", "clone"]:
+        started = time.time()
+        try:
+            handles = spawn_many(dict(maproot=maproot, engine=engine),
+                                     count, overrides, max_parallel=8)
+        except NamespaceRequireSuperuserPrivilege as e:
+            warn(e)
+            sys.exit(1)
+        spawned = time.time()
+        for handle in handles:
+            if handle.error is not None:
+                warn("sandbox failed: %s" % handle.error)
+                sys.exit(1)
+            handle.wait()
+        printf("%s engine: %d sandboxes spawned in %.3fs, reaped in %.3fs"
+                   % (engine, count, spawned - started, time.time() - spawned))
+        if [h.exit_code for h in handles] != list(range(count)):
+            sys.exit(1)
+
+    started = time.time()
+    for idx in range(count):
+        spawn_sandbox(maproot=maproot, func=lambda: demo(0)).wait()
+    printf("spawn_sandbox one by one: %d sandboxes in %.3fs"
+               % (count, time.time() - started))
+
+    try:
+        spawn_many(dict(maproot=maproot), 1, [{"namespaces": ["pid"]}])
+    except NamespaceSettingError:
+        pass
+    else:
+        sys.exit(1)
+
+    # a failure in the middle leaves no children behind, the bottom
+    # halves of the killed children complain about the closed pipes
+    start_children = SpawnNamespacesConfig.start_children
+    stderr = os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    for exc in [NamespaceRequireSuperuserPrivilege, RuntimeError]:
+        started = []
+        def failing_start_children(self, *args, **kwargs):
+            if len(started) == 4:
+                raise exc()
+            started.append(self)
+            return start_children(self, *args, **kwargs)
+        SpawnNamespacesConfig.start_children = failing_start_children
+        os.dup2(devnull, 2)
+        try:
+            handles = spawn_many(dict(maproot=maproot), 8,
+                                     [{"func": lambda: time.sleep(0.2)}] * 8)
+        except RuntimeError:
+            handles = []
+        finally:
+            SpawnNamespacesConfig.start_children = start_children
+        for handle in handles:
+            if handle.error is None:
+                handle.wait()
+        time.sleep(0.5)
+        os.dup2(stderr, 2)
+        try:
+            os.waitpid(-1, os.WNOHANG)
+            leaked = True
+        except OSError:
+            leaked = False
+        if leaked or [h for h in handles if h.error is not None
+                          and not isinstance(h.error, exc)]:
+            warn("%s: children leaked" % exc.__name__)
+            sys.exit(1)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import asyncio
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+from procszoo.aio import spawn_namespaces_async
+
+def demo(idx):
+    time.sleep(0.2)
+    sys.exit(idx % 4)
+
+async def main(maproot, count):
+    for engine in ["fork", "clone"]:
+        begin = time.time()
+        sandboxes = []
+        for idx in range(count):
+            sandboxes.append(await spawn_namespaces_async(
+                maproot=maproot, func=lambda idx=idx: demo(idx),
+                engine=engine))
+        statuses = await asyncio.gather(*sandboxes)
+        codes = [os.WEXITSTATUS(status) for status in statuses]
+        printf("%-5s engine: %d sandboxes in %.3fs, exit codes ok: %s"
+                   % (engine, count, time.time() - begin,
+                          codes == [idx % 4 for idx in range(count)]))
+
+async def cancel(maproot):
+    """
+    a cancelled spawn leaves no child behind.
+    """
+    for engine in ["fork", "clone"]:
+        task = asyncio.ensure_future(spawn_namespaces_async(
+            maproot=maproot, func=lambda: None, engine=engine))
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        else:
+            task.result().send_signal(9)
+            await task.result()
+            warn("%s engine: spawn is not cancelled" % engine)
+            sys.exit(1)
+        try:
+            os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pass
+        else:
+            warn("%s engine: cancelled children are left" % engine)
+            sys.exit(1)
+
+    try:
+        await spawn_namespaces_async(maproot=maproot, timing=True)
+    except NamespaceSettingError:
+        pass
+    else:
+        warn("timing is accepted")
+        sys.exit(1)
+    printf("cancelled spawns cleaned up")
+
+if __name__ == "__main__":
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    try:
+        asyncio.run(main(maproot, 50))
+        asyncio.run(cancel(maproot))
+    except NamespaceRequireSuperuserPrivilege as e:
+        warn(e)
+        sys.exit(1)
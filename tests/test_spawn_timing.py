@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import tempfile
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+if __name__ == "__main__":
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    for engine in ["fork", "clone"]:
+        config = SpawnNamespacesConfig(maproot=maproot, nscmd=["hostname"],
+                                           engine=engine, timing=True)
+        try:
+            config.entry_point()
+        except NamespaceRequireSuperuserPrivilege as e:
+            warn(e)
+            sys.exit(1)
+
+        printf("%s engine:" % engine)
+        for record in config.timings:
+            printf("    %-12s %-16s %8.3fms" % (
+                record["process"], record["phase"],
+                (record["end"] - record["begin"]) * 1000))
+        phases = [record["phase"] for record in config.timings]
+        for phase in ["parse_conf", "sync_wait", "exec"]:
+            if phase not in phases:
+                warn("phase %s not found" % phase)
+                sys.exit(1)
+
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    os.environ["PROCSZOO_SPAWN_TRACE"] = path
+    spawn_namespaces(maproot=maproot, func=lambda: None)
+    fo = open(path)
+    events = json.load(fo)["traceEvents"]
+    fo.close()
+    os.unlink(path)
+    printf("%d chrome trace events written" % len(events))
+    if not events:
+        sys.exit(1)
+
+    # parked sandboxes do not exec until they are used, the spawner must
+    # not wait for that
+    del os.environ["PROCSZOO_SPAWN_TRACE"]
+    pool = SandboxPool(high_watermark=2, maproot=maproot, timing=True)
+    pool.start()
+    sandbox = pool.spawn(nscmd=["true"])
+    sandbox.wait()
+    pool.close()
+    phases = [record["phase"] for record in sandbox.config.timings]
+    printf("pooled sandbox: %s" % ", ".join(phases))
+    if "sync_wait" not in phases:
+        sys.exit(1)
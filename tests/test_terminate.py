@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import signal
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+def stubborn():
+    """
+    ignore SIGTERM, and leave children that ignore it too.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    for i in range(2):
+        if os.fork() == 0:
+            while True:
+                time.sleep(1)
+    while True:
+        time.sleep(1)
+
+def graceful():
+    signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(3))
+    while True:
+        time.sleep(1)
+
+def cgroup_root_available():
+    try:
+        CgroupRoot().create_leaf().remove()
+    except (NamespaceSettingError, OSError, IOError):
+        return False
+    return True
+
+if __name__ == "__main__":
+    kwargs_list = [{}]
+    if cgroup_root_available():
+        kwargs_list.append({"limits": {}})
+
+    handles = []
+    for kwargs in kwargs_list:
+        for engine in ["fork", "clone"]:
+            for i in range(5):
+                handles.append(spawn_sandbox(engine=engine, func=stubborn,
+                                             **kwargs))
+    polite = spawn_sandbox(func=graceful)
+    time.sleep(0.5)
+
+    started = time.time()
+    left = terminate_sandboxes(handles + [polite], grace=0.5, timeout=5)
+    elapsed = time.time() - started
+    printf("%d sandboxes terminated in %.3fs" % (len(handles) + 1, elapsed))
+    if left or elapsed > 5.5:
+        warn("%d sandboxes are left" % len(left))
+        sys.exit(1)
+    if polite.exit_code != 3:
+        warn("a graceful sandbox exit code %s" % polite.exit_code)
+        sys.exit(1)
+    for handle in handles:
+        if handle.exit_code == 0:
+            warn("sandbox %d ignored the kill" % handle.pid)
+            sys.exit(1)
+        if handle.config.cgroup_leaf is not None:
+            warn("leaf %s is left" % handle.config.cgroup_leaf.path)
+            sys.exit(1)
+
+    handle = spawn_sandbox(func=stubborn)
+    time.sleep(0.2)
+    if handle.terminate(grace=0) is None:
+        warn("terminate() without grace failed")
+        sys.exit(1)
+
+    # a shared cgroup stays populated, it is not waited for, and the
+    # whole call is bounded by grace plus timeout
+    if cgroup_root_available():
+        shared = CgroupRoot().create_leaf()
+        r, w = os.pipe()
+        other = os.fork()
+        if other == 0:
+            shared.add()
+            os.write(w, b"x")
+            time.sleep(60)
+            os._exit(0)
+        os.read(r, 1)
+        handle = spawn_sandbox(cgroup=shared.path, func=stubborn)
+        time.sleep(0.2)
+        started = time.time()
+        left = terminate_sandboxes([handle], grace=0.2, timeout=2)
+        elapsed = time.time() - started
+        alive = os.waitpid(other, os.WNOHANG)[0] == 0
+        os.kill(other, signal.SIGKILL)
+        os.waitpid(other, 0)
+        shared.wait_event("populated", "0", 5)
+        shared.remove()
+        printf("a sandbox in a shared cgroup terminated in %.3fs" % elapsed)
+        if left or elapsed > 1 or not alive:
+            sys.exit(1)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.accounting import *
+from procszoo.cgroups import *
+from procszoo.utils import *
+
+def burn():
+    started = time.time()
+    while time.time() - started < 0.5:
+        pass
+    sys.exit(0)
+
+def cgroup_root_available():
+    try:
+        CgroupRoot().create_leaf().remove()
+    except (NamespaceSettingError, OSError, IOError):
+        return False
+    return True
+
+if __name__ == "__main__":
+    kwargs_list = [{}]
+    if cgroup_root_available():
+        kwargs_list.append({"limits": {}})
+
+    sampler = UsageSampler()
+    handles = []
+    for kwargs in kwargs_list:
+        for engine in ["fork", "clone"]:
+            handle = spawn_sandbox(engine=engine, func=burn, **kwargs)
+            handles.append(handle)
+            sampler.add(handle)
+
+    records = {}
+    for record in sampler.stream(interval=0.1):
+        records.setdefault(record.key, []).append(record)
+
+    for handle in handles:
+        key = handle.config.bottom_halves_child_pid
+        if handle.exit_code != 0:
+            warn("sandbox %d exit code %s" % (key, handle.exit_code))
+            sys.exit(1)
+        last = records[key][-1]
+        if not last.final or [r for r in records[key][:-1] if r.final]:
+            warn("sandbox %d: no final record" % key)
+            sys.exit(1)
+        if not last.cpu_usec:
+            warn("sandbox %d: cpu %s" % (key, last.cpu_usec))
+            sys.exit(1)
+        printf("%d: %d records, cpu %.3fs, memory peak %s" % (
+            key, len(records[key]), last.cpu_usec / 1e6,
+            last.memory_peak_bytes))
+    if len(sampler):
+        sys.exit(1)
+
+    # a sandbox reaped by someone else has no rusage and no stat files
+    handle = spawn_sandbox(nscmd=["true"])
+    sampler.add(handle)
+    os.waitpid(handle.pid, 0)
+    records = list(sampler.sample())
+    if len(records) != 1 or not records[0].final:
+        warn("reaped sandbox: %r" % records)
+        sys.exit(1)
+    printf("reaped sandbox: final record, cpu %s" % records[0].cpu_usec)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import tempfile
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+
+events = []
+
+def play():
+    enable_stats()
+    add_audit_hook(lambda event, args: events.append(event))
+    unshare(["user", "mount", "uts"])
+    workbench.set_propagation("private")
+    target = tempfile.mkdtemp()
+    for i in range(10):
+        mount(source="none", target=target, filesystemtype="tmpfs",
+                  mount_type="unchanged")
+        umount2(target, "detach")
+    os.rmdir(target)
+    sethostname("stats")
+    try:
+        umount2("/", "force")
+    except (CFunctionCallFailed, NamespaceRequireSuperuserPrivilege):
+        pass
+
+    stats = get_stats()
+    printf(json.dumps(stats, indent=2, sort_keys=True))
+    printf("%d audit events" % len(events))
+    if stats["mount"]["calls"] < 10 or stats["umount2"]["calls"] != 11:
+        sys.exit(1)
+    if not stats["umount2"]["failures"]:
+        sys.exit(1)
+    if "procszoo.sethostname" not in events:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if not user_namespace_available():
+        warn("user namespace unavailable, quit")
+        sys.exit(1)
+    pid = os.fork()
+    if pid == 0:
+        play()
+        sys.exit(0)
+    status = os.waitpid(pid, 0)[1]
+    sys.exit(os.WEXITSTATUS(status))
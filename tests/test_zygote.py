@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+try:
+    from procszoo.c_functions import *
+except ImportError:
+    this_file_absdir = os.path.dirname(os.path.abspath(__file__))
+    procszoo_mod_dir = os.path.abspath("%s/.." % this_file_absdir)
+    sys.path.append(procszoo_mod_dir)
+    from procszoo.c_functions import *
+from procszoo.utils import *
+from procszoo.zygote import Zygote
+
+if __name__ == "__main__":
+    maproot=False
+    if user_namespace_available():
+        maproot=True
+
+    private_dir = tempfile.mkdtemp(prefix="procszoo-zygote-")
+    socket_path = os.path.join(private_dir, "zygote.sock")
+    for exec_server, path, engine in [(True, None, "fork"),
+                                          (False, None, "fork"),
+                                          (True, socket_path, "fork"),
+                                          (False, None, "clone")]:
+        zygote = Zygote(preload=["json", "socket"], maproot=maproot,
+                            exec_server=exec_server, socket_path=path,
+                            engine=engine)
+        try:
+            zygote.start()
+        except NamespaceRequireSuperuserPrivilege as e:
+            warn(e)
+            sys.exit(1)
+
+        for func, args in [(os.system, ("hostname",)), (sys.exit, (3,))]:
+            begin = time.time()
+            child = zygote.spawn(func, args=args)
+            status = child.wait()
+            printf("exec_server %s, socket_path %s, engine %s: child %d "
+                       "exit status %d, cost %.6fs"
+                       % (exec_server, path, engine, child.pid,
+                              status >> 8, time.time() - begin))
+        zygote.close()
+
+    # a socket anyone could reach is refused
+    os.chmod(private_dir, 0o755)
+    try:
+        Zygote(socket_path=socket_path).start()
+    except NamespaceSettingError:
+        pass
+    else:
+        warn("a zygote listens in a public directory")
+        sys.exit(1)
+    finally:
+        shutil.rmtree(private_dir)